@@ -1,22 +1,49 @@
-from flask import Flask, render_template, request, redirect, url_for
+from flask import Flask, Response, g, render_template, request, redirect, url_for
 app = Flask(__name__)
-app.config.from_pyfile('my_zotconfig.py')
+import os
+app.config.from_pyfile(os.environ.get('ZOTGRAPH_CONFIG', 'my_zotconfig.py'))
 import logging
 FORMAT = "[%(filename)s:%(lineno)s - %(funcName)20s() ] %(message)s"
 logging.basicConfig(format=FORMAT, level=logging.INFO)
 
-import os
 import json
+import threading
+import time
 
 from zotgraph import ZotGraph
+from jobs import JobQueue
+import metrics
 
       
 ID_FILTER_FN="paperIds.filter"
 CONF_FILTER_FN="filter.conf"
 
 projects = {}
+jobqueues = {}
+# a project is loaded once, its jobs keep running on that instance
+projects_lock = threading.Lock()
 selectedLayout = "HIERACHICAL"
 
+PROJECT_NODES = metrics.REGISTRY.gauge(
+    "zotgraph_project_nodes", "Nodes of a loaded project, all and with full data in memory", ["project", "state"])
+PROJECT_NODE_BYTES = metrics.REGISTRY.gauge(
+    "zotgraph_project_node_memory_bytes", "Estimated size of the full node data in memory", ["project"])
+PROJECT_JOBS = metrics.REGISTRY.gauge(
+    "zotgraph_project_jobs", "Background jobs of a loaded project by status", ["project", "status"])
+
+@app.before_request
+def startTimer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def recordRequest(response):
+    # the route pattern, not the path, keeps the number of series bounded
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    if hasattr(g, "request_start"):
+        metrics.HTTP_SECONDS.observe(time.perf_counter() - g.request_start, route=route)
+    metrics.HTTP_REQUESTS.inc(route=route, status=response.status_code)
+    return response
+
 def getProjectList():
     pl = []
     for f in os.listdir(app.config["PROJ_DIR"]):
@@ -43,21 +70,33 @@ def load_project():
     if not os.path.exists(ppath):
       return "Project %s does not exists" % pname
 
-    fconf_fn = os.path.join(ppath, CONF_FILTER_FN)
-    with open(fconf_fn, "r") as fd: 
-        filters = json.loads(fd.read())
-    id_filter_fn = os.path.join(ppath, ID_FILTER_FN)
-    graph_path = os.path.join(ppath, "graph.pkl")
-    projects[pname] = ZotGraph(
-        graph_path,
-        filters, 
-        app.config['HTML_DIR'], 
-        app.config['N_CACHE'],
-        id_filter_fn, 
-        app.config['LCSV'], 
-        app.config['LIBRARY_ID'], 
-        app.config["LIBRARY_TYPE"], 
-        app.config['API_KEY'])
+    with projects_lock:
+        if pname in projects.keys():
+            # a second instance would race the running jobs on the same
+            # graph journal and crawl checkpoint
+            logging.info("Project '%s' already loaded" % pname)
+            return redirect(url_for('zotcit', pname=pname))
+        fconf_fn = os.path.join(ppath, CONF_FILTER_FN)
+        with open(fconf_fn, "r") as fd: 
+            filters = json.loads(fd.read())
+        id_filter_fn = os.path.join(ppath, ID_FILTER_FN)
+        graph_path = os.path.join(ppath, "graph.pkl")
+        project = ZotGraph(
+            graph_path,
+            filters, 
+            app.config['HTML_DIR'], 
+            app.config['N_CACHE'],
+            id_filter_fn, 
+            app.config.get('LCSV'), 
+            app.config['LIBRARY_ID'], 
+            app.config["LIBRARY_TYPE"], 
+            app.config['API_KEY'],
+            config=app.config)
+        jobqueues[pname] = JobQueue(workers=app.config.get('JOB_WORKERS', 2))
+        projects[pname] = project
+    if app.config.get('CRAWL_AUTORESUME', True) and projects[pname].hasCrawlCheckpoint():
+        logging.info("Resuming crawl for project '%s'" % pname)
+        jobqueues[pname].submitExclusive("crawl", "crawl (resumed)", crawlProject, pname)
     return redirect(url_for('zotcit', pname=pname))
 
 @app.route("/create_project")
@@ -91,10 +130,12 @@ def create_project():
         app.config['HTML_DIR'], 
         app.config['N_CACHE'],
         id_filter_fn, 
-        app.config['LCSV'], 
+        app.config.get('LCSV'), 
         app.config['LIBRARY_ID'], 
         app.config["LIBRARY_TYPE"], 
-        app.config['API_KEY'])
+        app.config['API_KEY'],
+        config=app.config)
+    jobqueues[pname] = JobQueue(workers=app.config.get('JOB_WORKERS', 2))
     return redirect(url_for('zotcit', pname=pname))
  
 
@@ -104,13 +145,15 @@ def zotcit():
     logging.info("zotcit project %s" % pname)
     nodes = []
     edges = []
+    # version first, changes racing with getGraph are sent again by the next delta
+    epoch, version = projects[pname].getVersion()
     nodes, edges = projects[pname].getGraph()
-    paperInfo = projects[pname].getPaperInfo()
     return render_template(
         "papers.html",
         nodes=nodes,
         edges=edges,
-        paperinfo=paperInfo,
+        epoch=epoch,
+        version=version,
         selectedLayout=selectedLayout,
         pname=pname
     )
@@ -134,17 +177,31 @@ def getgraph():
     logging.info("getgraph project %s" % pname)
     nodes = []
     edges = []
+    # version first, changes racing with getGraph are sent again by the next delta
+    epoch, version = projects[pname].getVersion()
     nodes, edges = projects[pname].getGraph()
-    paperInfo = projects[pname].getPaperInfo()
     return render_template(
         "papers.html",
         nodes=nodes,
         edges=edges,
-        paperinfo=paperInfo,
+        epoch=epoch,
+        version=version,
         selectedLayout=selectedLayout,
         pname=pname
     )
 
+@app.route('/paperinfo')
+def paperinfo():
+    pname = request.args.get("pname")
+    paperId = request.args.get("paperid")
+    logging.debug("Paper info for PaperId %s" % paperId)
+    html = None
+    if paperId is not None and paperId != "":
+        html = projects[pname].getPaperInfoById(paperId=paperId)
+    if html is None:
+        return {"id": paperId, "html": "NO INFO"}, 404
+    return {"id": paperId, "html": html}
+
 @app.route('/addpaper')
 def addpaper():
     pname = request.args.get("pname")
@@ -180,42 +237,91 @@ def addcollection():
     }
     return res
 
+def expandLinks(pname, paperId, onlyRef=False, onlyCit=False, job=None):
+    projects[pname].addLinks(paperId=paperId, onlyRef=onlyRef, onlyCit=onlyCit, job=job)
+    projects[pname].saveGraph()
+
 @app.route('/getcits')
 def getcits():
     pname = request.args.get("pname")
     paperId = request.args.get("paperid")
     logging.info("Get citations for PaperId %s" % paperId)
-    res = {}
-    new_edges = []
-    new_nodes = []
-    if paperId is not None and paperId != "":
-        new_nodes, new_edges, new_paperinfo = projects[pname].addLinks(paperId=paperId, onlyCit=True)
-        projects[pname].saveGraph()
-    res = {
-        'new_nodes': new_nodes,
-        'new_edges': new_edges,
-        'new_paperinfo': new_paperinfo,
-    }
-    return res
+    if paperId is None or paperId == "":
+        return {"error": "Invalid PaperId"}, 400
+    job = jobqueues[pname].submit("citations %s" % paperId, expandLinks, pname, paperId, onlyCit=True)
+    return job.info()
 
 @app.route('/getrefs')
 def getrefs():
     pname = request.args.get("pname")
     paperId = request.args.get("paperid")
     logging.info("Get references for PaperId %s" % paperId)
-    res = {}
-    new_edges = []
-    new_nodes = []
-    new_paperinfo = []
+    if paperId is None or paperId == "":
+        return {"error": "Invalid PaperId"}, 400
+    job = jobqueues[pname].submit("references %s" % paperId, expandLinks, pname, paperId, onlyRef=True)
+    return job.info()
+
+def crawlProject(pname, seeds=None, max_nodes=None, job=None):
+    projects[pname].crawl(seeds=seeds, max_nodes=max_nodes, job=job)
+
+@app.route('/crawl')
+def crawl():
+    pname = request.args.get("pname")
+    paperId = request.args.get("paperid")
+    max_nodes = request.args.get("max_nodes", type=int)
+    seeds = None
     if paperId is not None and paperId != "":
-        new_nodes, new_edges, new_paperinfo = projects[pname].addLinks(paperId=paperId, onlyRef=True)
-        projects[pname].saveGraph()
-    res = {
-        'new_nodes': new_nodes,
-        'new_edges': new_edges,
-        'new_paperinfo': new_paperinfo,
-    }
-    return res
+        seeds = [paperId]
+    logging.info("Crawl project %s from %s" % (pname, paperId))
+    # all crawls of a project share one checkpoint, a running crawl is returned instead
+    job = jobqueues[pname].submitExclusive(
+        "crawl", "crawl %s" % (paperId or "all"), crawlProject, pname, seeds=seeds, max_nodes=max_nodes)
+    return job.info()
+
+@app.route('/job_events')
+def job_events():
+    pname = request.args.get("pname")
+    job = jobqueues[pname].get(request.args.get("job_id"))
+    if job is None:
+        return {"error": "No such job"}, 404
+
+    # a reconnecting EventSource continues after the last event it got
+    first = request.headers.get("Last-Event-ID", 0, type=int)
+
+    def stream():
+        since = first
+        while True:
+            events, finished = job.wait(since, timeout=15)
+            for i, event in enumerate(events):
+                yield "id: %d\ndata: %s\n\n" % (since + i + 1, json.dumps(event))
+            since += len(events)
+            if finished and len(events) == 0:
+                yield "event: done\ndata: %s\n\n" % json.dumps(job.info())
+                return
+            if len(events) == 0:
+                yield ": keepalive\n\n"
+
+    return Response(stream(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.route('/job_status')
+def job_status():
+    pname = request.args.get("pname")
+    jobId = request.args.get("job_id")
+    if jobId is None:
+        return {"jobs": jobqueues[pname].list()}
+    job = jobqueues[pname].get(jobId)
+    if job is None:
+        return {"error": "No such job"}, 404
+    return job.info()
+
+@app.route('/job_cancel')
+def job_cancel():
+    pname = request.args.get("pname")
+    job = jobqueues[pname].get(request.args.get("job_id"))
+    if job is None:
+        return {"error": "No such job"}, 404
+    job.cancel()
+    return job.info()
 
 @app.route('/rescan')
 def rescan():
@@ -262,16 +368,40 @@ def filter():
         projects[pname].saveGraph()
     return {"status": "OK"}
 
+@app.route('/cachestats')
+def cachestats():
+    pname = request.args.get("pname")
+    return projects[pname].getCacheStats()
+
 @app.route('/setcolor')
 def setcolor():
     pname = request.args.get("pname")
     color = request.args.get("color")
-    if projects[pname].setColoring(color):
-        new_nodes, _ = projects[pname].getGraph()
-        return {
-            'new_nodes': new_nodes,
-        }
-    return {
-            'new_nodes': [],
-        }
+    since = request.args.get("since", default=0, type=int)
+    epoch = request.args.get("epoch")
+    if not projects[pname].setColoring(color):
+        return {"error": "Invalid coloring"}, 400
+    return projects[pname].getGraphDelta(since=since, epoch=epoch)
     #return redirect(url_for('zotcit', pname=pname))
+
+@app.route('/graph_delta')
+def graph_delta():
+    pname = request.args.get("pname")
+    since = request.args.get("since", default=0, type=int)
+    epoch = request.args.get("epoch")
+    return projects[pname].getGraphDelta(since=since, epoch=epoch)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    for pname, project in list(projects.items()):
+        stats = project.getCacheStats()["nodes"]
+        PROJECT_NODES.set(stats["nodes"], project=pname, state="all")
+        PROJECT_NODES.set(stats["size"], project=pname, state="in_memory")
+        PROJECT_NODE_BYTES.set(stats["weight"], project=pname)
+    for pname, jobqueue in list(jobqueues.items()):
+        counts = {}
+        for info in jobqueue.list():
+            counts[info["status"]] = counts.get(info["status"], 0) + 1
+        for status in ["queued", "running", "done", "cancelled", "failed"]:
+            PROJECT_JOBS.set(counts.get(status, 0), project=pname, status=status)
+    return Response(metrics.REGISTRY.expose(), content_type=metrics.Registry.CONTENT_TYPE)
@@ -0,0 +1,233 @@
+"""Synthetic citation corpus and a matching Zotero library export
+
+Papers are generated in publication order. Each one cites a lognormal
+number of older papers, picked by preferential attachment (most of them)
+or among recent papers, which gives the heavy tailed citation counts of
+real corpora. A sample of the papers becomes the Zotero library, with
+collections, annotation notes citing references as [n] and Semantic
+Scholar links, written as the CSV export ZotGraph indexes.
+
+    python bench/corpus.py OUTDIR [--papers 20000] [--library 0.1] [--port 8765]
+
+OUTDIR gets corpus.json (read by stubserver.py), library.csv, a
+zotconfig.py pointing ZotGraph at the stub server and empty project,
+html and node cache directories.
+"""
+import argparse
+import csv
+import hashlib
+import json
+import math
+import os
+import random
+
+WORDS = """
+adaptive analysis approach attacks automated binary cache certified cloud
+compiler concurrent consistent control data debugging deep detection
+distributed dynamic efficient embedded enclave energy evaluation execution
+fast fault formal framework fuzzing graph hardware heterogeneous hypervisor
+isolation kernel language learning lightweight memory model monitoring
+network neural optimization parallel performance persistent practical
+program protocol provenance quantum recovery reliable runtime safe scalable
+scheduling secure side-channel software speculative static storage
+symbolic synthesis system testing trusted verification virtual vulnerability
+workloads
+""".split()
+CONNECT = ["for", "of", "in", "with", "on", "via", "towards"]
+NAMES = """
+Angel Baker Chen Dietrich Evans Fischer Garcia Huang Ito Jensen Kim Larsen
+Mueller Nakamura Oliveira Patel Quinn Rossi Schmidt Tanaka Ueda Villa Wang
+Xu Yamada Zhang
+""".split()
+VENUES = ["OSDI", "SOSP", "USENIX Security", "CCS", "NDSS", "S&P", "ASPLOS", "ISCA", "PLDI", "EuroSys"]
+KEY_CHARS = "23456789ABCDEFGHIJKLMNPQRSTUVWXYZ"
+
+FIRST_YEAR = 1990
+LAST_YEAR = 2024
+# papers per year grow by this factor
+GROWTH = 1.08
+# share of references picked among the most recent papers instead of by citation count
+RECENT_SHARE = 0.3
+RECENT_WINDOW = 0.05
+INFLUENTIAL_SHARE = 0.1
+
+
+def paperId(i):
+    return hashlib.sha1(b"zotgraph-bench-%d" % i).hexdigest()
+
+
+def zoteroKey(rnd, used):
+    while True:
+        key = "".join(rnd.choice(KEY_CHARS) for _ in range(8))
+        if key not in used:
+            used.add(key)
+            return key
+
+
+def title(rnd):
+    words = rnd.sample(WORDS, rnd.randint(3, 6))
+    words.insert(rnd.randint(1, len(words) - 1), rnd.choice(CONNECT))
+    return " ".join(words).capitalize()
+
+
+def years(n, rnd):
+    """Publication year of each of n papers, non decreasing"""
+    weights = [GROWTH ** (y - FIRST_YEAR) for y in range(FIRST_YEAR, LAST_YEAR + 1)]
+    total = sum(weights)
+    ys = []
+    for y, w in zip(range(FIRST_YEAR, LAST_YEAR + 1), weights):
+        ys.extend([y] * int(round(n * w / total)))
+    while len(ys) < n:
+        ys.append(LAST_YEAR)
+    return ys[:n]
+
+
+def citations(n, rnd, mean_refs):
+    """References of each paper as [[index, influential], ...]"""
+    # one urn entry per paper plus one per citation it got, a uniform
+    # draw from the urn is a draw proportional to citations + 1
+    urn = []
+    refs = []
+    mu = math.log(mean_refs) - 0.5 * 0.8 ** 2
+    for i in range(n):
+        want = min(i, int(rnd.lognormvariate(mu, 0.8)))
+        picked = set()
+        tries = 0
+        while len(picked) < want and tries < 4 * want:
+            tries += 1
+            if rnd.random() < RECENT_SHARE:
+                window = max(1, int(i * RECENT_WINDOW))
+                j = rnd.randrange(i - window, i)
+            else:
+                j = rnd.choice(urn)
+            picked.add(j)
+        refs.append([[j, 1 if rnd.random() < INFLUENTIAL_SHARE else 0] for j in sorted(picked)])
+        urn.extend(picked)
+        urn.append(i)
+    return refs
+
+
+def collections(rnd, used, count):
+    cols = []
+    for i in range(count):
+        parent = None
+        if i >= 4 and rnd.random() < 0.5:
+            parent = rnd.choice(cols[:4])["key"]
+        cols.append({
+            "key": zoteroKey(rnd, used),
+            "name": "%s %s" % (rnd.choice(WORDS).capitalize(), rnd.choice(WORDS)),
+            "parent": parent,
+        })
+    return cols
+
+
+def note(rnd, nrefs):
+    paragraphs = []
+    for _ in range(rnd.randint(1, 4)):
+        text = " ".join(rnd.sample(WORDS, 12))
+        if nrefs > 0:
+            text += " [%d]" % rnd.randint(1, nrefs)
+        paragraphs.append("<p>%s</p>" % text)
+    return "\n".join(paragraphs)
+
+
+def generate(n, library_share, ncollections, mean_refs, seed):
+    rnd = random.Random(seed)
+    ys = years(n, rnd)
+    refs = citations(n, rnd, mean_refs)
+    papers = []
+    for i in range(n):
+        papers.append({
+            "paperId": paperId(i),
+            "title": title(rnd),
+            "year": ys[i],
+            "doi": "10.5555/zg.%d" % i,
+            "venue": rnd.choice(VENUES),
+            "authors": rnd.sample(NAMES, rnd.randint(1, 5)),
+            "refs": refs[i],
+        })
+    used = set()
+    cols = collections(rnd, used, ncollections)
+    library = []
+    for i in sorted(rnd.sample(range(n), int(n * library_share))):
+        library.append({
+            "key": zoteroKey(rnd, used),
+            "paper": i,
+            "collections": [c["key"] for c in rnd.sample(cols, rnd.randint(1, 2))],
+            "note": note(rnd, len(refs[i])) if rnd.random() < 0.5 else None,
+        })
+    return {"seed": seed, "papers": papers, "collections": cols, "library": library}
+
+
+def writeLibraryCsv(corpus, path):
+    with open(path, "w", newline="") as fd:
+        w = csv.writer(fd)
+        w.writerow(["Key", "Item Type", "Publication Year", "Author", "Title", "DOI",
+                    "Notes", "File Attachments", "Link Attachments"])
+        for item in corpus["library"]:
+            p = corpus["papers"][item["paper"]]
+            w.writerow([
+                item["key"], "journalArticle", p["year"], "; ".join(p["authors"]), p["title"], p["doi"],
+                item["note"] or "", "",
+                "https://www.semanticscholar.org/paper/%s" % p["paperId"],
+            ])
+
+
+def writeConfig(outdir, port):
+    url = "http://127.0.0.1:%d" % port
+    conf = [
+        ("PROJ_DIR", os.path.join(outdir, "proj")),
+        ("HTML_DIR", os.path.join(outdir, "html")),
+        ("N_CACHE", os.path.join(outdir, "ncache")),
+        ("EXTREF_DIR", os.path.join(outdir, "extref")),
+        ("LIBRARY_ID", "1"),
+        ("API_KEY", "bench"),
+        ("LIBRARY_TYPE", "user"),
+        ("LCSV", os.path.join(outdir, "library.csv")),
+        ("S2_RATE", 1000.0),
+        ("S2_API_URL", url + "/s2/v1"),
+        ("S2_SEARCH_URL", url + "/s2/graph/v1/paper"),
+        ("ZOTERO_ENDPOINT", url + "/zotero"),
+        ("CRAWL_AUTORESUME", False),
+    ]
+    for name in ["proj", "html", "ncache", "extref"]:
+        os.makedirs(os.path.join(outdir, name), exist_ok=True)
+    with open(os.path.join(outdir, "zotconfig.py"), "w") as fd:
+        for key, value in conf:
+            fd.write("%s=%r\n" % (key, value))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic citation corpus and Zotero library")
+    parser.add_argument("outdir")
+    parser.add_argument("--papers", type=int, default=20000)
+    parser.add_argument("--library", type=float, default=0.1, help="share of the papers in the Zotero library")
+    parser.add_argument("--collections", type=int, default=20)
+    parser.add_argument("--refs", type=float, default=30, help="mean number of references per paper")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--port", type=int, default=8765, help="port of the stub server")
+    args = parser.parse_args()
+
+    outdir = os.path.abspath(args.outdir)
+    os.makedirs(outdir, exist_ok=True)
+    corpus = generate(args.papers, args.library, args.collections, args.refs, args.seed)
+    with open(os.path.join(outdir, "corpus.json"), "w") as fd:
+        json.dump(corpus, fd)
+    writeLibraryCsv(corpus, os.path.join(outdir, "library.csv"))
+    writeConfig(outdir, args.port)
+
+    ncits = [0] * len(corpus["papers"])
+    for p in corpus["papers"]:
+        for j, _ in p["refs"]:
+            ncits[j] += 1
+    ncits.sort()
+    nrefs = sum(len(p["refs"]) for p in corpus["papers"])
+    print("%d papers, %d citations, %d library items, %d collections" % (
+        len(corpus["papers"]), nrefs, len(corpus["library"]), len(corpus["collections"])))
+    print("citations per paper: median %d, p99 %d, max %d" % (
+        ncits[len(ncits) // 2], ncits[int(len(ncits) * 0.99)], ncits[-1]))
+    print("ZOTGRAPH_CONFIG=%s" % os.path.join(outdir, "zotconfig.py"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Import time of the server modules
+
+Imports each module in a fresh interpreter with -X importtime, reports
+the wall time and the slowest imports, and fails if one of the modules
+that must stay out of server start (pyplot, scholarly, ...) got imported.
+
+    python bench/importtime.py [--repeat 5] [--top 15] [module ...]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = ["zotgraph", "zotapi", "refextract", "semanticscholar"]
+FORBIDDEN = ["matplotlib", "matplotlib.pyplot", "scholarly"]
+
+PROBE = """
+import sys, time, json
+t0 = time.perf_counter()
+import %s
+t1 = time.perf_counter()
+print(json.dumps({"wall": t1 - t0, "modules": sorted(sys.modules.keys())}))
+"""
+
+
+def probe(module):
+    p = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE % module],
+        cwd=ROOT, capture_output=True, text=True)
+    if p.returncode != 0:
+        raise RuntimeError("import %s failed:\n%s" % (module, p.stderr))
+    res = json.loads(p.stdout.splitlines()[-1])
+    # "import time: self [us] | cumulative | imported package"
+    imports = []
+    for l in p.stderr.splitlines():
+        if not l.startswith("import time:") or "cumulative" in l:
+            continue
+        self_us, cumulative_us, name = [f.strip() for f in l.split(":", 1)[1].split("|")]
+        imports.append((int(cumulative_us), int(self_us), name))
+    res["imports"] = imports
+    return res
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure module import times")
+    parser.add_argument("modules", nargs="*", default=MODULES)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    failed = False
+    for module in args.modules:
+        runs = [probe(module) for _ in range(args.repeat)]
+        walls = [run["wall"] * 1000 for run in runs]
+        print("%s: median %.1f ms, min %.1f ms, max %.1f ms (%d runs)" % (
+            module, statistics.median(walls), min(walls), max(walls), len(walls)))
+        for cumulative_us, self_us, name in sorted(runs[-1]["imports"], reverse=True)[:args.top]:
+            print("  %8.1f ms %8.1f ms  %s" % (cumulative_us / 1000, self_us / 1000, name))
+        loaded = set(runs[-1]["modules"])
+        for name in FORBIDDEN:
+            if name in loaded:
+                print("  ERROR: %s imported by %s" % (name, module))
+                failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
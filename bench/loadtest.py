@@ -0,0 +1,249 @@
+"""Replay concurrent browser sessions against a running ZotGraph server
+
+Creates (or loads) a project, seeds it with papers of the synthetic
+library and then runs --sessions threads for --duration seconds, each
+doing what the papers page does: reload the graph, open paper infos,
+poll /graph_delta, switch colorings, expand references/citations and
+follow the job, add papers. Reports per route throughput and latency
+percentiles, and the requests the stub server got.
+
+    python bench/corpus.py /tmp/zg --papers 20000
+    python bench/stubserver.py /tmp/zg/corpus.json &
+    ZOTGRAPH_CONFIG=/tmp/zg/zotconfig.py flask run &
+    python bench/loadtest.py /tmp/zg/corpus.json [--sessions 8] [--duration 60]
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+# action -> weight, roughly what one user does on the papers page
+ACTIONS = {
+    "paperinfo": 8,
+    "graph_delta": 6,
+    "setcolor": 2,
+    "zotcit": 1,
+    "expand": 1,
+    "addpaper": 1,
+}
+COLORINGS = ["COLLECTION", "YEAR", "NCIT", "AUTHOR"]
+
+
+def percentile(values, p):
+    if len(values) == 0:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+
+class Stats:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latency = {}
+        self.errors = {}
+
+    def add(self, route, seconds, ok=True):
+        with self.lock:
+            self.latency.setdefault(route, []).append(seconds)
+            if not ok:
+                self.errors[route] = self.errors.get(route, 0) + 1
+
+    def report(self, elapsed):
+        print("%-14s %8s %8s %7s %9s %9s %9s %9s" % (
+            "route", "requests", "req/s", "errors", "p50 ms", "p90 ms", "p99 ms", "max ms"))
+        total = 0
+        for route in sorted(self.latency):
+            lat = self.latency[route]
+            total += len(lat)
+            print("%-14s %8d %8.1f %7d %9.1f %9.1f %9.1f %9.1f" % (
+                route, len(lat), len(lat) / elapsed, self.errors.get(route, 0),
+                percentile(lat, 50) * 1000, percentile(lat, 90) * 1000,
+                percentile(lat, 99) * 1000, max(lat) * 1000))
+        print("%-14s %8d %8.1f" % ("total", total, total / elapsed))
+
+
+class Client:
+
+    def __init__(self, url, pname, stats):
+        self.url = url.rstrip("/")
+        self.pname = pname
+        self.stats = stats
+
+    def get(self, route, timeout=300, record=None, **params):
+        params["pname"] = self.pname
+        url = "%s/%s?%s" % (self.url, route, urllib.parse.urlencode(params))
+        t0 = time.perf_counter()
+        ok = True
+        body = None
+        try:
+            with urllib.request.urlopen(url, timeout=timeout) as r:
+                body = r.read()
+        except urllib.error.HTTPError as e:
+            ok = e.code < 500
+            body = e.read()
+        except Exception:
+            ok = False
+        self.stats.add(record or route, time.perf_counter() - t0, ok)
+        return body
+
+    def getJson(self, route, **params):
+        body = self.get(route, **params)
+        try:
+            return json.loads(body)
+        except (TypeError, ValueError):
+            return None
+
+
+class Session(threading.Thread):
+    """One browser tab on the papers page"""
+
+    def __init__(self, client, known, corpus, deadline, seed):
+        super().__init__(daemon=True)
+        self.client = client
+        self.known = known
+        self.corpus = corpus
+        self.deadline = deadline
+        self.rnd = random.Random(seed)
+        self.epoch = None
+        self.version = 0
+
+    def sync(self, delta):
+        if not isinstance(delta, dict) or "version" not in delta:
+            return
+        self.epoch = delta["epoch"]
+        self.version = delta["version"]
+        self.known.addNodes(delta.get("new_nodes", []))
+
+    def expand(self):
+        paperId = self.known.pick(self.rnd)
+        route = self.rnd.choice(["getrefs", "getcits"])
+        t0 = time.perf_counter()
+        job = self.client.getJson(route, paperid=paperId)
+        if not isinstance(job, dict) or "job_id" not in job:
+            return
+        info = None
+        while time.time() < self.deadline:
+            info = self.client.getJson("job_status", job_id=job["job_id"])
+            if not isinstance(info, dict) or info.get("status") in ["done", "cancelled", "failed"]:
+                break
+            time.sleep(0.2)
+        # time until the expansion is visible, queueing included
+        self.client.stats.add("job:" + route, time.perf_counter() - t0, isinstance(info, dict) and info.get("status") == "done")
+        self.sync(self.client.getJson("graph_delta", since=self.version, epoch=self.epoch or ""))
+
+    def run(self):
+        actions = list(ACTIONS.keys())
+        weights = list(ACTIONS.values())
+        self.client.get("zotcit")
+        while time.time() < self.deadline:
+            action = self.rnd.choices(actions, weights)[0]
+            if action == "paperinfo":
+                self.client.get("paperinfo", paperid=self.known.pick(self.rnd))
+            elif action == "graph_delta":
+                self.sync(self.client.getJson("graph_delta", since=self.version, epoch=self.epoch or ""))
+            elif action == "setcolor":
+                self.sync(self.client.getJson("setcolor", color=self.rnd.choice(COLORINGS),
+                                              since=self.version, epoch=self.epoch or ""))
+            elif action == "zotcit":
+                self.client.get("zotcit")
+            elif action == "expand":
+                self.expand()
+            elif action == "addpaper":
+                paper = self.rnd.choice(self.corpus["papers"])
+                res = self.client.getJson("addpaper", paperid=paper["paperId"])
+                if isinstance(res, dict):
+                    self.known.addNodes(res.get("new_nodes", []))
+            time.sleep(self.rnd.expovariate(1.0 / 0.2))
+
+
+class KnownNodes:
+    """paperIds the sessions have seen in the graph"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ids = []
+        self.seen = set()
+
+    def addNodes(self, nodes):
+        with self.lock:
+            for node in nodes or []:
+                paperId = node.get("node_data", {}).get("id") if isinstance(node, dict) else node
+                if paperId and paperId not in self.seen:
+                    self.seen.add(paperId)
+                    self.ids.append(paperId)
+
+    def pick(self, rnd):
+        with self.lock:
+            return rnd.choice(self.ids) if len(self.ids) > 0 else ""
+
+
+def setup(client, corpus, seeds, rnd):
+    """Create or load the project and add seed papers from the library"""
+    projects = client.get("", record="setup:home") or b""
+    if client.pname.encode() in projects:
+        client.get("load_project", record="setup:load")
+    else:
+        client.get("create_project", record="setup:create", year=0, ncit=0)
+    known = KnownNodes()
+    library = rnd.sample(corpus["library"], min(seeds, len(corpus["library"])))
+    for item in library:
+        paper = corpus["papers"][item["paper"]]
+        res = client.getJson("addpaper", record="setup:addpaper", paperid=paper["paperId"])
+        if isinstance(res, dict):
+            known.addNodes(res.get("new_nodes", []))
+    delta = client.getJson("graph_delta", record="setup:delta", since=0)
+    if isinstance(delta, dict):
+        known.addNodes(delta.get("new_nodes", []))
+    return known
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test a running ZotGraph server")
+    parser.add_argument("corpus", help="corpus.json written by corpus.py")
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--pname", default="bench")
+    parser.add_argument("--sessions", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=60)
+    parser.add_argument("--seeds", type=int, default=20, help="library papers added before the sessions start")
+    parser.add_argument("--stub", default="http://127.0.0.1:8765", help="stub server, for its request counts")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    with open(args.corpus) as fd:
+        corpus = json.load(fd)
+    rnd = random.Random(args.seed)
+
+    setup_stats = Stats()
+    t0 = time.perf_counter()
+    known = setup(Client(args.url, args.pname, setup_stats), corpus, args.seeds, rnd)
+    elapsed = time.perf_counter() - t0
+    print("setup: %d nodes in %.1fs" % (len(known.ids), elapsed))
+    setup_stats.report(elapsed)
+
+    stats = Stats()
+    t0 = time.perf_counter()
+    deadline = time.time() + args.duration
+    sessions = [Session(Client(args.url, args.pname, stats), known, corpus, deadline, args.seed + i)
+                for i in range(args.sessions)]
+    for s in sessions:
+        s.start()
+    for s in sessions:
+        s.join()
+    elapsed = time.perf_counter() - t0
+
+    print("\n%d sessions, %.1fs, %d nodes known" % (args.sessions, elapsed, len(known.ids)))
+    stats.report(elapsed)
+    try:
+        with urllib.request.urlopen(args.stub.rstrip("/") + "/stats", timeout=10) as r:
+            print("stub server requests: %s" % json.dumps(json.loads(r.read()), sort_keys=True))
+    except Exception as e:
+        print("no stub server stats: %s" % e)
+
+
+if __name__ == "__main__":
+    main()
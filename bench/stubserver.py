@@ -0,0 +1,276 @@
+"""Local stand-in for the Semantic Scholar and Zotero web APIs
+
+Serves a corpus written by corpus.py in the shapes ZotGraph reads:
+
+    GET  /s2/v1/paper/<paperId|DOI>               v1 paper
+    GET  /s2/graph/v1/paper/search?query=...      Graph API title search
+    POST /s2/graph/v1/paper/batch?fields=...      Graph API batch lookup
+    GET  /zotero/users/<id>/items/top?itemKey=K   pyzotero top()
+    GET  /zotero/users/<id>/collections[/<key>[/items]]
+    GET  /stats                                   requests served per endpoint
+
+--latency adds a fixed delay (plus up to --jitter) to every request to
+mimic the remote services, --error-rate answers that share of the
+Semantic Scholar requests with a 429.
+
+    python bench/stubserver.py OUTDIR/corpus.json [--port 8765] [--latency 0.05]
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+P_WORD = re.compile(r"[a-z0-9\-]+")
+
+
+class Corpus:
+
+    def __init__(self, path):
+        with open(path) as fd:
+            data = json.load(fd)
+        self.papers = data["papers"]
+        self.byId = {}
+        self.cits = [[] for _ in self.papers]
+        self.words = {}
+        for i, p in enumerate(self.papers):
+            self.byId[p["paperId"]] = i
+            self.byId[p["doi"]] = i
+            for j, infl in p["refs"]:
+                self.cits[j].append([i, infl])
+            for w in set(P_WORD.findall(p["title"].lower())):
+                self.words.setdefault(w, []).append(i)
+        self.collections = {c["key"]: c for c in data["collections"]}
+        self.items = {}
+        self.colItems = {}
+        for item in data["library"]:
+            self.items[item["key"]] = item
+            for ckey in item["collections"]:
+                self.colItems.setdefault(ckey, []).append(item["key"])
+
+    def find(self, id):
+        id = urllib.parse.unquote(id)
+        if id.startswith("DOI:"):
+            id = id[4:]
+        return self.byId.get(id)
+
+    def search(self, query, limit):
+        words = set(P_WORD.findall(query.lower()))
+        scores = {}
+        # rarest words first, they decide the ranking anyway
+        for w in sorted(words, key=lambda w: len(self.words.get(w, [])))[:4]:
+            for i in self.words.get(w, []):
+                scores[i] = scores.get(i, 0) + 1
+        best = sorted(scores.items(), key=lambda s: -s[1])[:limit]
+        return [i for i, _ in best]
+
+    def authors(self, i):
+        return [{"authorId": "%d%d" % (i, k), "name": name} for k, name in enumerate(self.papers[i]["authors"])]
+
+    def v1Link(self, j, infl):
+        p = self.papers[j]
+        return {
+            "paperId": p["paperId"], "title": p["title"], "year": p["year"],
+            "doi": p["doi"], "arxivId": None, "venue": p["venue"],
+            "authors": self.authors(j), "intent": [], "isInfluential": bool(infl),
+            "url": "https://www.semanticscholar.org/paper/%s" % p["paperId"],
+        }
+
+    def v1Paper(self, i):
+        p = self.papers[i]
+        return {
+            "paperId": p["paperId"], "corpusId": i, "title": p["title"], "year": p["year"],
+            "doi": p["doi"], "arxivId": None, "venue": p["venue"],
+            "abstract": "Abstract of %s." % p["title"],
+            "authors": self.authors(i),
+            "url": "https://www.semanticscholar.org/paper/%s" % p["paperId"],
+            "isOpenAccess": False, "fieldsOfStudy": ["Computer Science"], "topics": [],
+            "influentialCitationCount": sum(infl for _, infl in self.cits[i]),
+            "numCitedBy": len(self.cits[i]), "numCiting": len(p["refs"]),
+            "citations": [self.v1Link(j, infl) for j, infl in self.cits[i]],
+            "references": [self.v1Link(j, infl) for j, infl in p["refs"]],
+        }
+
+    def graphLink(self, j):
+        p = self.papers[j]
+        return {"paperId": p["paperId"], "title": p["title"], "year": p["year"],
+                "externalIds": {"DOI": p["doi"]}}
+
+    def graphPaper(self, i, fields):
+        p = self.papers[i]
+        item = {
+            "paperId": p["paperId"], "externalIds": {"DOI": p["doi"]},
+            "url": "https://www.semanticscholar.org/paper/%s" % p["paperId"],
+            "title": p["title"], "abstract": "Abstract of %s." % p["title"],
+            "venue": p["venue"], "year": p["year"], "isOpenAccess": False,
+            "fieldsOfStudy": ["Computer Science"],
+            "authors": [{"authorId": a["authorId"], "name": a["name"]} for a in self.authors(i)],
+        }
+        if "citations" in fields:
+            item["citations"] = [self.graphLink(j) for j, _ in self.cits[i]]
+        if "references" in fields:
+            item["references"] = [self.graphLink(j) for j, _ in p["refs"]]
+        return {k: v for k, v in item.items() if k in fields or k == "paperId"}
+
+    def zoteroItem(self, key):
+        item = self.items[key]
+        p = self.papers[item["paper"]]
+        return {
+            "key": key, "version": 1,
+            "library": {"type": "user", "id": 1, "name": "bench"},
+            "meta": {"creatorSummary": p["authors"][0], "parsedDate": str(p["year"]), "numChildren": 0},
+            "data": {
+                "key": key, "version": 1, "itemType": "journalArticle", "title": p["title"],
+                "creators": [{"creatorType": "author", "lastName": a, "firstName": ""} for a in p["authors"]],
+                "date": str(p["year"]), "DOI": p["doi"], "publicationTitle": p["venue"],
+                "url": "https://www.semanticscholar.org/paper/%s" % p["paperId"],
+                "collections": item["collections"], "tags": [], "relations": {},
+            },
+        }
+
+    def zoteroCollection(self, key):
+        col = self.collections[key]
+        return {
+            "key": key, "version": 1,
+            "library": {"type": "user", "id": 1, "name": "bench"},
+            "meta": {"numCollections": 0, "numItems": len(self.colItems.get(key, []))},
+            "data": {"key": key, "version": 1, "name": col["name"],
+                     "parentCollection": col["parent"] or False, "relations": {}},
+        }
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def count(self, endpoint):
+        with self.server.lock:
+            self.server.stats[endpoint] = self.server.stats.get(endpoint, 0) + 1
+
+    def delay(self):
+        if self.server.latency > 0 or self.server.jitter > 0:
+            time.sleep(self.server.latency + random.random() * self.server.jitter)
+
+    def reply(self, data, status=200, headers=None):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def limited(self):
+        if self.server.error_rate > 0 and random.random() < self.server.error_rate:
+            self.count("s2 429")
+            self.reply({"message": "Too Many Requests"}, 429, {"Retry-After": "1"})
+            return True
+        return False
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        parts = [p for p in url.path.split("/") if p]
+        c = self.server.corpus
+        self.delay()
+        if parts[:3] == ["s2", "v1", "paper"] and len(parts) >= 4:
+            self.count("s2 paper")
+            if self.limited():
+                return
+            # DOIs contain slashes
+            i = c.find("/".join(parts[3:]))
+            if i is None:
+                return self.reply({"error": "Paper not found"}, 404)
+            return self.reply(c.v1Paper(i))
+        if parts == ["s2", "graph", "v1", "paper", "search"]:
+            self.count("s2 search")
+            if self.limited():
+                return
+            limit = int(query.get("limit", ["10"])[0])
+            found = c.search(query.get("query", [""])[0], limit)
+            return self.reply({"total": len(found), "offset": 0,
+                               "data": [{"paperId": c.papers[i]["paperId"], "title": c.papers[i]["title"]} for i in found]})
+        if parts[:1] == ["zotero"] and len(parts) >= 4:
+            return self.zotero(parts[3:], query)
+        if parts == ["stats"]:
+            with self.server.lock:
+                return self.reply(dict(self.server.stats))
+        self.reply({"error": "Not found"}, 404)
+
+    def zotero(self, parts, query):
+        c = self.server.corpus
+        if parts == ["items", "top"]:
+            self.count("zotero items/top")
+            keys = [k for k in query.get("itemKey", [""])[0].split(",") if k in c.items]
+            return self.reply([c.zoteroItem(k) for k in keys], headers={"Total-Results": str(len(keys))})
+        if parts[:1] == ["collections"]:
+            if len(parts) == 1:
+                self.count("zotero collections")
+                cols = [c.zoteroCollection(k) for k in c.collections]
+                return self.reply(cols, headers={"Total-Results": str(len(cols))})
+            if parts[1] not in c.collections:
+                return self.reply("Collection not found", 404)
+            if len(parts) == 2:
+                self.count("zotero collection")
+                return self.reply(c.zoteroCollection(parts[1]))
+            if parts[2:] == ["items"]:
+                self.count("zotero collection items")
+                items = [c.zoteroItem(k) for k in c.colItems.get(parts[1], [])]
+                return self.reply(items, headers={"Total-Results": str(len(items))})
+        self.reply({"error": "Not found"}, 404)
+
+    def do_POST(self):
+        url = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        c = self.server.corpus
+        self.delay()
+        if url.path.rstrip("/") == "/s2/graph/v1/paper/batch":
+            self.count("s2 batch")
+            if self.limited():
+                return
+            fields = set(f.split(".")[0] for f in query.get("fields", [""])[0].split(","))
+            ids = json.loads(body).get("ids", [])
+            items = []
+            for id in ids:
+                i = c.find(id)
+                items.append(None if i is None else c.graphPaper(i, fields))
+            return self.reply(items)
+        self.reply({"error": "Not found"}, 404)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a synthetic corpus as Semantic Scholar and Zotero APIs")
+    parser.add_argument("corpus", help="corpus.json written by corpus.py")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many seconds added at random")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of Semantic Scholar requests answered with 429")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    server.daemon_threads = True
+    server.corpus = Corpus(args.corpus)
+    server.latency = args.latency
+    server.jitter = args.jitter
+    server.error_rate = args.error_rate
+    server.stats = {}
+    server.lock = threading.Lock()
+    print("Serving %d papers, %d library items on http://%s:%d (loaded in %.1fs)" % (
+        len(server.corpus.papers), len(server.corpus.items), args.host, args.port, time.perf_counter() - t0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+import uuid
+from collections import deque
+
+
+class ChangeLog:
+    """Bounded log of graph mutations under a monotonically increasing version
+
+    Clients remember the version they have seen and ask for the changes
+    since. The epoch changes every time a project is loaded, versions of
+    different epochs are not comparable. Callers serialize access through
+    the graph lock.
+    """
+
+    NODE = "node"
+    NODE_REMOVED = "node_removed"
+    EDGE = "edge"
+    COLOR = "color"
+    # something every node depends on changed (e.g. the year levels)
+    LAYOUT = "layout"
+
+    def __init__(self, maxlen=10000):
+        self.epoch = uuid.uuid4().hex
+        self.version = 0
+        self.entries = deque(maxlen=maxlen)
+
+    def record(self, kind, key):
+        self.version += 1
+        self.entries.append((self.version, kind, key))
+        return self.version
+
+    def since(self, epoch, version):
+        """Changes after version as (kind, key) in order
+        :returns: None if they are not available anymore (truncated log, other epoch).
+        """
+        if epoch != self.epoch or version > self.version:
+            return None
+        if version == self.version:
+            return []
+        if len(self.entries) == 0 or self.entries[0][0] > version + 1:
+            return None
+        first = version + 1 - self.entries[0][0]
+        return [(kind, key) for _, kind, key in list(self.entries)[first:]]
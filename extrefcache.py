@@ -0,0 +1,119 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+
+class ExtRefCache:
+    """Extracted references keyed by the sha256 of the PDF
+
+    Layout below path:
+        sha256/<2 hex>/<sha256>.json   the extraction result
+        papers/<paperId>.json          paperId -> sha256, path, size and mtime of its PDF
+        <paperId>                      results of the old per paperId cache, adopted
+                                       on first use and moved to adopted/
+
+    The same PDF attached to several papers is extracted once, a replaced
+    PDF gets a new hash, and as every file is written atomically and named
+    by content the directory can be shared between installs.
+    """
+
+    CHUNK = 1024 * 1024
+
+    def __init__(self, path):
+        # directories are created on the first write
+        self.path = path
+        self.hashed = 0
+
+    def __contentPath(self, digest):
+        return os.path.join(self.path, "sha256", digest[:2], "%s.json" % digest)
+
+    def __indexPath(self, paperId):
+        return os.path.join(self.path, "papers", "%s.json" % paperId)
+
+    def __write(self, path, data):
+        # atomic, concurrent readers and other installs never see partial files
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(json.dumps(data, sort_keys=True, indent=2))
+            os.replace(tmp, path)
+        except:
+            os.unlink(tmp)
+            raise
+
+    def __read(self, path):
+        try:
+            with open(path, "r") as f:
+                return json.loads(f.read())
+        except FileNotFoundError:
+            return None
+        except ValueError as e:
+            logging.error("Corrupt extraction cache file %s: %s" % (path, e))
+            return None
+
+    def hashFile(pdfpath):
+        h = hashlib.sha256()
+        with open(pdfpath, "rb") as f:
+            for chunk in iter(lambda: f.read(ExtRefCache.CHUNK), b""):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def digest(self, pdfpath, paperId):
+        """sha256 of the PDF of paperId, only rehashed if path, size or mtime changed"""
+        try:
+            st = os.stat(pdfpath)
+        except OSError as e:
+            logging.warn("Can not read pdf '%s': %s" % (pdfpath, e))
+            return None
+        entry = self.__read(self.__indexPath(paperId))
+        if entry is not None and entry.get("path") == pdfpath and \
+                entry.get("size") == st.st_size and entry.get("mtime_ns") == st.st_mtime_ns:
+            return entry["sha256"]
+        digest = ExtRefCache.hashFile(pdfpath)
+        self.hashed += 1
+        if entry is not None and entry.get("sha256") != digest:
+            logging.info("PDF of %s changed: %s" % (paperId, pdfpath))
+        self.__write(self.__indexPath(paperId), {
+            "sha256": digest,
+            "path": pdfpath,
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+        })
+        return digest
+
+    def contains(self, digest):
+        return os.path.exists(self.__contentPath(digest))
+
+    def get(self, digest, paperId=None):
+        """Extraction result for the PDF digest, None if it was not extracted yet"""
+        refs = self.__read(self.__contentPath(digest))
+        if refs is None and paperId is not None:
+            refs = self.__adopt(digest, paperId)
+        return refs
+
+    def put(self, digest, refs):
+        self.__write(self.__contentPath(digest), refs)
+
+    def __adopt(self, digest, paperId):
+        # a result of the paperId keyed cache belongs to the PDF seen first,
+        # it is moved aside so a later, replaced PDF is extracted again
+        legacy = os.path.join(self.path, paperId)
+        refs = self.__read(legacy)
+        if refs is not None:
+            logging.info("Adopt extracted references of %s as %s" % (paperId, digest))
+            self.put(digest, refs)
+            os.makedirs(os.path.join(self.path, "adopted"), exist_ok=True)
+            try:
+                os.replace(legacy, os.path.join(self.path, "adopted", paperId))
+            except FileNotFoundError:
+                # adopted concurrently
+                pass
+        return refs
+
+    def stats(self):
+        return {
+            "hashed": self.hashed,
+        }
@@ -0,0 +1,149 @@
+import json
+import logging
+import os
+import threading
+from lazyimport import LazyModule
+
+nx = LazyModule("networkx")
+
+
+class GraphJournal:
+    """Graph persistence as a gpickle snapshot plus an append-only journal
+
+    Mutations are recorded with addNode/addEdge/removeNode/removeEdge and
+    appended to the journal on flush. Once the journal holds compact_every
+    records, compact writes a new snapshot in a background thread and the
+    journal starts over. load replays snapshot + journal.
+    """
+
+    def __init__(self, snapshot_path, compact_every=1000):
+        self.snapshot_path = snapshot_path
+        self.journal_path = snapshot_path + ".journal"
+        self.compacting_path = snapshot_path + ".journal.compacting"
+        self.compact_every = compact_every
+        self.pending = []
+        self.nrecords = 0
+        self.recording = True
+        self.lock = threading.Lock()
+        self.compactor = None
+
+    def exists(self):
+        return os.path.exists(self.snapshot_path) or \
+            os.path.exists(self.journal_path) or \
+            os.path.exists(self.compacting_path)
+
+    def load(self):
+        if os.path.exists(self.snapshot_path):
+            g = nx.read_gpickle(self.snapshot_path)
+        else:
+            g = nx.DiGraph()
+        self.nrecords = 0
+        # a compaction that did not finish leaves its journal behind
+        for path in [self.compacting_path, self.journal_path]:
+            if os.path.exists(path):
+                self.nrecords += self.__replay(g, path)
+        logging.info("Loaded graph %s: %d nodes, %d edges, %d journal records" % (
+            self.snapshot_path, g.number_of_nodes(), g.number_of_edges(), self.nrecords))
+        return g
+
+    def __replay(self, g, path):
+        n = 0
+        with open(path, "r") as fd:
+            for l in fd:
+                try:
+                    rec = json.loads(l)
+                except ValueError:
+                    logging.error("Skipping corrupted journal record in %s" % path)
+                    continue
+                op = rec["op"]
+                if op == "add_node":
+                    g.add_node(rec["id"], **rec["attrs"])
+                elif op == "add_edge":
+                    g.add_edge(rec["from"], rec["to"], **rec["attrs"])
+                elif op == "remove_node":
+                    if g.has_node(rec["id"]):
+                        g.remove_node(rec["id"])
+                elif op == "remove_edge":
+                    if g.has_edge(rec["from"], rec["to"]):
+                        g.remove_edge(rec["from"], rec["to"])
+                else:
+                    logging.error("Invalid journal op '%s'" % op)
+                    continue
+                n += 1
+        return n
+
+    def __record(self, rec):
+        if not self.recording:
+            return
+        with self.lock:
+            self.pending.append(rec)
+
+    def addNode(self, paperId, **attrs):
+        self.__record({"op": "add_node", "id": paperId, "attrs": attrs})
+
+    def addEdge(self, from_node, to_node, **attrs):
+        self.__record({"op": "add_edge", "from": from_node, "to": to_node, "attrs": attrs})
+
+    def removeNode(self, paperId):
+        self.__record({"op": "remove_node", "id": paperId})
+
+    def removeEdge(self, from_node, to_node):
+        self.__record({"op": "remove_edge", "from": from_node, "to": to_node})
+
+    def flush(self):
+        with self.lock:
+            if len(self.pending) == 0:
+                return
+            with open(self.journal_path, "a") as fd:
+                for rec in self.pending:
+                    fd.write(json.dumps(rec, separators=(",", ":")) + "\n")
+                fd.flush()
+                os.fsync(fd.fileno())
+            self.nrecords += len(self.pending)
+            logging.debug("Flushed %d journal records" % len(self.pending))
+            self.pending = []
+
+    def needsCompaction(self):
+        return self.nrecords >= self.compact_every
+
+    def compact(self, g, lock):
+        """Write g as the new snapshot in the background. lock() must keep g
+        from changing and from being recorded, the compaction thread holds it
+        while it copies g and starts the journal over."""
+        with self.lock:
+            if self.compactor is not None and self.compactor.is_alive():
+                logging.debug("Compaction already running")
+                return
+            self.compactor = threading.Thread(target=self.__compact, args=(g, lock), daemon=True)
+            self.compactor.start()
+
+    def __compact(self, g, lock):
+        with lock():
+            self.flush()
+            with self.lock:
+                if os.path.exists(self.journal_path):
+                    if os.path.exists(self.compacting_path):
+                        # left over from a failed compaction, keep its records
+                        with open(self.compacting_path, "a") as dst, open(self.journal_path, "r") as src:
+                            dst.write(src.read())
+                        os.remove(self.journal_path)
+                    else:
+                        os.replace(self.journal_path, self.compacting_path)
+                self.nrecords = 0
+            g = g.copy()
+        self.__writeSnapshot(g)
+
+    def __writeSnapshot(self, g):
+        tmp_path = self.snapshot_path + ".tmp"
+        logging.info("Compacting graph to %s" % self.snapshot_path)
+        try:
+            nx.write_gpickle(g, tmp_path)
+            os.replace(tmp_path, self.snapshot_path)
+            if os.path.exists(self.compacting_path):
+                os.remove(self.compacting_path)
+        except Exception as e:
+            logging.error("Failed to compact graph %s: %s" % (self.snapshot_path, e))
+
+    def join(self):
+        if self.compactor is not None:
+            self.compactor.join()
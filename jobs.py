@@ -0,0 +1,151 @@
+import itertools
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+
+
+class Job:
+    """Background task with an event log clients can follow and a cancel flag"""
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    CANCELLED = "cancelled"
+    FAILED = "failed"
+
+    def __init__(self, jobId, name):
+        self.id = jobId
+        self.name = name
+        self.status = Job.QUEUED
+        self.error = None
+        self.events = []
+        self.created = time.time()
+        self.finished = None
+        self.cond = threading.Condition()
+        self.cancelled = threading.Event()
+
+    def emit(self, event):
+        with self.cond:
+            self.events.append(event)
+            self.cond.notify_all()
+
+    def cancel(self):
+        logging.info("Cancel job %s" % self.id)
+        self.cancelled.set()
+
+    def isCancelled(self):
+        return self.cancelled.is_set()
+
+    def isFinished(self):
+        return self.status in [Job.DONE, Job.CANCELLED, Job.FAILED]
+
+    def setStatus(self, status, error=None):
+        with self.cond:
+            self.status = status
+            self.error = error
+            if self.isFinished():
+                self.finished = time.time()
+            self.cond.notify_all()
+
+    def wait(self, since, timeout=None):
+        """Events after index since, blocks until there are some or the job finished
+        :returns: (events, finished)
+        """
+        with self.cond:
+            if len(self.events) <= since and not self.isFinished():
+                self.cond.wait(timeout)
+            return self.events[since:], self.isFinished()
+
+    def info(self):
+        return {
+            "job_id": self.id,
+            "name": self.name,
+            "status": self.status,
+            "error": self.error,
+            "nevents": len(self.events),
+            "created": self.created,
+            "finished": self.finished,
+        }
+
+
+class JobQueue:
+    """Worker pool running Jobs for one project"""
+
+    def __init__(self, workers=2, keep=100):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="zgjob")
+        self.jobs = OrderedDict()
+        self.keep = keep
+        self.ids = itertools.count(1)
+        # key -> the last job submitted with submitExclusive
+        self.exclusive = {}
+        self.lock = threading.Lock()
+
+    def submit(self, name, fn, *args, **kwargs):
+        """Run fn(*args, job=job, **kwargs) on the pool
+        :returns: the new Job.
+        """
+        with self.lock:
+            job = self.__newJob(name)
+        self.executor.submit(self.__run, job, fn, args, kwargs)
+        logging.info("Submitted job %s: %s" % (job.id, name))
+        return job
+
+    def submitExclusive(self, key, name, fn, *args, **kwargs):
+        """Like submit, but while a job submitted with the same key is not
+        finished that job is returned and fn is not run
+        :returns: the new or the running Job.
+        """
+        with self.lock:
+            job = self.exclusive.get(key)
+            if job is not None and not job.isFinished():
+                logging.info("Job %s for %s still running" % (job.id, key))
+                return job
+            job = self.__newJob(name)
+            self.exclusive[key] = job
+        self.executor.submit(self.__run, job, fn, args, kwargs)
+        logging.info("Submitted job %s: %s" % (job.id, name))
+        return job
+
+    def __newJob(self, name):
+        job = Job("%d" % next(self.ids), name)
+        self.jobs[job.id] = job
+        # forget the oldest finished jobs
+        for jobId in list(self.jobs.keys()):
+            if len(self.jobs) <= self.keep:
+                break
+            if self.jobs[jobId].isFinished():
+                del self.jobs[jobId]
+        return job
+
+    def __run(self, job, fn, args, kwargs):
+        started = time.time()
+        metrics.JOB_SECONDS.observe(started - job.created, job=fn.__name__, state="queued")
+        try:
+            self.__runJob(job, fn, args, kwargs)
+        finally:
+            metrics.JOB_SECONDS.observe(time.time() - started, job=fn.__name__, state="running")
+            metrics.JOBS.inc(job=fn.__name__, status=job.status)
+
+    def __runJob(self, job, fn, args, kwargs):
+        if job.isCancelled():
+            job.setStatus(Job.CANCELLED)
+            return
+        job.setStatus(Job.RUNNING)
+        try:
+            fn(*args, job=job, **kwargs)
+        except Exception as e:
+            logging.exception("Job %s failed" % job.id)
+            job.setStatus(Job.FAILED, error=str(e))
+            return
+        job.setStatus(Job.CANCELLED if job.isCancelled() else Job.DONE)
+
+    def get(self, jobId):
+        with self.lock:
+            return self.jobs.get(jobId)
+
+    def list(self):
+        with self.lock:
+            return [job.info() for job in self.jobs.values()]
@@ -0,0 +1,37 @@
+import importlib
+import importlib.util
+
+
+class LazyModule:
+    """Stands in for a module (or an attribute of one) until first use
+
+    LazyModule("numpy") behaves like "import numpy", LazyModule("scholarly",
+    "scholarly") like "from scholarly import scholarly". The import happens
+    on the first attribute access, so rarely used heavy dependencies do not
+    slow down starting the server.
+    """
+
+    def __init__(self, name, attr=None):
+        self.__dict__['_name'] = name
+        self.__dict__['_attr'] = attr
+        self.__dict__['_target'] = None
+
+    def __load(self):
+        target = self.__dict__['_target']
+        if target is None:
+            target = importlib.import_module(self.__dict__['_name'])
+            if self.__dict__['_attr'] is not None:
+                target = getattr(target, self.__dict__['_attr'])
+            self.__dict__['_target'] = target
+        return target
+
+    def __getattr__(self, item):
+        return getattr(self.__load(), item)
+
+    def __call__(self, *args, **kwargs):
+        return self.__load()(*args, **kwargs)
+
+
+def available(name):
+    """True if the top level package name can be imported, without importing it"""
+    return importlib.util.find_spec(name) is not None
@@ -0,0 +1,69 @@
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Thread safe bounded LRU mapping with hit/miss counters
+
+    Without weigh every entry counts 1 towards maxsize, otherwise
+    weigh(value) is charged and maxsize is a budget in those units.
+    """
+
+    def __init__(self, maxsize=1024, weigh=None):
+        self.maxsize = maxsize
+        self.weigh = weigh
+        self.data = OrderedDict()
+        self.weights = {}
+        self.total = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key in self.data:
+                self.data.move_to_end(key)
+                self.hits += 1
+                return self.data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        weight = 1 if self.weigh is None else self.weigh(value)
+        with self.lock:
+            self.total -= self.weights.pop(key, 0)
+            self.data[key] = value
+            self.data.move_to_end(key)
+            self.weights[key] = weight
+            self.total += weight
+            # the newest entry stays even if it alone exceeds the budget
+            while self.total > self.maxsize and len(self.data) > 1:
+                old, _ = self.data.popitem(last=False)
+                self.total -= self.weights.pop(old)
+
+    def pop(self, key, default=None):
+        with self.lock:
+            self.total -= self.weights.pop(key, 0)
+            return self.data.pop(key, default)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.weights.clear()
+            self.total = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def stats(self):
+        with self.lock:
+            return {
+                "size": len(self.data),
+                "weight": self.total,
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
@@ -0,0 +1,206 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# seconds, from a cached lookup to a rate limited Semantic Scholar call
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace("\"", "\\\"")
+
+
+def formatLabels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra is not None:
+        pairs.append(extra)
+    if len(pairs) == 0:
+        return ""
+    return "{%s}" % ",".join("%s=\"%s\"" % (k, escape(v)) for k, v in pairs)
+
+
+def formatValue(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return "%d" % value
+    return repr(float(value))
+
+
+class Metric:
+    """One metric family, a value per combination of label values"""
+
+    TYPE = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def key(self, labels):
+        if set(labels.keys()) != set(self.labels):
+            raise ValueError("%s expects labels %s, got %s" % (self.name, self.labels, sorted(labels.keys())))
+        return tuple(str(labels[l]) for l in self.labels)
+
+    def header(self):
+        return [
+            "# HELP %s %s" % (self.name, self.help.replace("\\", "\\\\").replace("\n", "\\n")),
+            "# TYPE %s %s" % (self.name, self.TYPE),
+        ]
+
+
+class Counter(Metric):
+    TYPE = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def expose(self):
+        lines = self.header()
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append("%s%s %s" % (self.name, formatLabels(self.labels, key), formatValue(value)))
+        return lines
+
+
+class Gauge(Metric):
+    TYPE = "gauge"
+
+    def set(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def expose(self):
+        lines = self.header()
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append("%s%s %s" % (self.name, formatLabels(self.labels, key), formatValue(value)))
+        return lines
+
+
+class Histogram(Metric):
+    TYPE = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts, total = self.values.get(key, (None, 0.0))
+            if counts is None:
+                # one slot per bucket plus +Inf, cumulated on exposition
+                counts = [0] * (len(self.buckets) + 1)
+            counts[i] += 1
+            self.values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, **labels)
+
+    def expose(self):
+        lines = self.header()
+        with self.lock:
+            items = [(key, list(counts), total) for key, (counts, total) in sorted(self.values.items())]
+        for key, counts, total in items:
+            cumulative = 0
+            for le, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                lines.append("%s_bucket%s %d" % (self.name, formatLabels(self.labels, key, ("le", formatValue(le))), cumulative))
+            lines.append("%s_sum%s %s" % (self.name, formatLabels(self.labels, key), formatValue(total)))
+            lines.append("%s_count%s %d" % (self.name, formatLabels(self.labels, key), cumulative))
+        return lines
+
+
+class Registry:
+    """Metric families by name, rendered in the Prometheus text format"""
+
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def __register(self, cls, name, help, labels, **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = cls(name, help, labels, **kwargs)
+                self.metrics[name] = metric
+            elif not isinstance(metric, cls) or metric.labels != tuple(labels):
+                raise ValueError("Metric %s already registered as %s%s" % (name, metric.TYPE, metric.labels))
+            return metric
+
+    def counter(self, name, help, labels=()):
+        return self.__register(Counter, name, help, labels)
+
+    def gauge(self, name, help, labels=()):
+        return self.__register(Gauge, name, help, labels)
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.__register(Histogram, name, help, labels, buckets=buckets)
+
+    def expose(self):
+        with self.lock:
+            metrics = [self.metrics[name] for name in sorted(self.metrics.keys())]
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.expose())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.counter(
+    "zotgraph_http_requests_total", "HTTP requests by route and status code", ["route", "status"])
+HTTP_SECONDS = REGISTRY.histogram(
+    "zotgraph_http_request_seconds", "HTTP request handling time by route", ["route"])
+EXTERNAL_REQUESTS = REGISTRY.counter(
+    "zotgraph_external_requests_total", "Calls to Semantic Scholar, Zotero and Scholarcy by outcome",
+    ["service", "call", "outcome"])
+EXTERNAL_SECONDS = REGISTRY.histogram(
+    "zotgraph_external_request_seconds", "Time spent in calls to external services", ["service", "call"])
+RATELIMIT_WAIT_SECONDS = REGISTRY.histogram(
+    "zotgraph_ratelimit_wait_seconds", "Time spent waiting for the client side rate limiters", ["service"])
+CACHE_LOOKUPS = REGISTRY.counter(
+    "zotgraph_cache_lookups_total", "Node and extraction cache lookups", ["cache", "result"])
+JOBS = REGISTRY.counter(
+    "zotgraph_jobs_total", "Finished background jobs by function and status", ["job", "status"])
+JOB_SECONDS = REGISTRY.histogram(
+    "zotgraph_job_seconds", "Background job time queued and running", ["job", "state"])
+PHASE_SECONDS = REGISTRY.histogram(
+    "zotgraph_phase_seconds", "Time spent in local processing steps (title matching, rendering, ...)", ["phase"])
+
+
+class ExternalCall:
+    """Outcome of a timed external call, e.g. the HTTP status, "ok" if not set"""
+
+    def __init__(self):
+        self.outcome = None
+
+
+@contextmanager
+def external(service, call):
+    """Times a call to an external service, counts it by outcome ("error" if it raised)"""
+    t0 = time.perf_counter()
+    rec = ExternalCall()
+    failed = True
+    try:
+        yield rec
+        failed = False
+    finally:
+        EXTERNAL_SECONDS.observe(time.perf_counter() - t0, service=service, call=call)
+        outcome = "error" if failed else (rec.outcome or "ok")
+        EXTERNAL_REQUESTS.inc(service=service, call=call, outcome=str(outcome))
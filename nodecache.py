@@ -0,0 +1,197 @@
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+import zlib
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+
+
+class NodeCache(ABC):
+    """Persistent store for graph nodes, keyed by paperId"""
+
+    def get(self, paperId):
+        return self.getMany([paperId]).get(paperId)
+
+    def put(self, paperId, node):
+        self.putMany({paperId: node})
+
+    @abstractmethod
+    def getMany(self, paperIds):
+        pass
+
+    @abstractmethod
+    def putMany(self, nodes):
+        pass
+
+    @abstractmethod
+    def contains(self, paperId):
+        pass
+
+    @abstractmethod
+    def delete(self, paperId):
+        pass
+
+    @abstractmethod
+    def keys(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class DirNodeCache(NodeCache):
+    """One json file per node (the original N_CACHE layout)"""
+
+    def __init__(self, path, workers=8):
+        self.path = path
+        self.workers = workers
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def __nodePath(self, paperId):
+        return os.path.join(self.path, paperId)
+
+    def __read(self, paperId):
+        try:
+            with open(self.__nodePath(paperId), "r") as fd:
+                return json.loads(fd.read())
+        except FileNotFoundError:
+            return None
+
+    def getMany(self, paperIds):
+        paperIds = list(paperIds)
+        if len(paperIds) < 2 or self.workers < 2:
+            read = map(self.__read, paperIds)
+        else:
+            # file reads release the GIL, many small files load faster in parallel
+            with self.lock:
+                if self.executor is None:
+                    self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ncache")
+            read = self.executor.map(self.__read, paperIds)
+        return {paperId: node for paperId, node in zip(paperIds, read) if node is not None}
+
+    def putMany(self, nodes):
+        for paperId, node in nodes.items():
+            with open(self.__nodePath(paperId), "w") as fd:
+                fd.write(json.dumps(node, sort_keys=True, indent=2))
+
+    def contains(self, paperId):
+        return os.path.exists(self.__nodePath(paperId))
+
+    def delete(self, paperId):
+        if self.contains(paperId):
+            os.remove(self.__nodePath(paperId))
+
+    def keys(self):
+        return [f for f in os.listdir(self.path) if os.path.isfile(self.__nodePath(f))]
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+
+class SqliteNodeCache(NodeCache):
+    """All nodes in one sqlite file (WAL mode), stored as compressed compact json"""
+
+    # sqlite limits the number of host parameters per statement
+    MAX_VARS = 500
+
+    def __init__(self, path, workers=None):
+        self.path = path
+        self.local = threading.local()
+        self.__conn().execute("CREATE TABLE IF NOT EXISTS nodes (paperId TEXT PRIMARY KEY, data BLOB NOT NULL)")
+        self.__conn().commit()
+
+    def __conn(self):
+        # one connection per thread, WAL lets readers run next to a writer
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def encode(node):
+        return zlib.compress(json.dumps(node, separators=(",", ":")).encode("utf-8"))
+
+    def decode(data):
+        return json.loads(zlib.decompress(data).decode("utf-8"))
+
+    def getMany(self, paperIds):
+        paperIds = list(paperIds)
+        nodes = {}
+        for i in range(0, len(paperIds), SqliteNodeCache.MAX_VARS):
+            chunk = paperIds[i:i + SqliteNodeCache.MAX_VARS]
+            rows = self.__conn().execute(
+                "SELECT paperId, data FROM nodes WHERE paperId IN (%s)" % ",".join("?" * len(chunk)),
+                chunk)
+            for paperId, data in rows:
+                nodes[paperId] = SqliteNodeCache.decode(data)
+        return nodes
+
+    def putMany(self, nodes):
+        conn = self.__conn()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO nodes (paperId, data) VALUES (?, ?)",
+                [(paperId, SqliteNodeCache.encode(node)) for paperId, node in nodes.items()])
+
+    def contains(self, paperId):
+        row = self.__conn().execute("SELECT 1 FROM nodes WHERE paperId = ?", (paperId,)).fetchone()
+        return row is not None
+
+    def delete(self, paperId):
+        conn = self.__conn()
+        with conn:
+            conn.execute("DELETE FROM nodes WHERE paperId = ?", (paperId,))
+
+    def keys(self):
+        return [row[0] for row in self.__conn().execute("SELECT paperId FROM nodes")]
+
+    def close(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self.local.conn = None
+
+
+NODE_CACHES = {
+    "dir": DirNodeCache,
+    "sqlite": SqliteNodeCache,
+}
+
+
+def openNodeCache(path, backend=None, workers=8):
+    """Open the node cache at path, a directory is the json layout, anything else sqlite"""
+    if backend is None:
+        backend = "dir" if os.path.isdir(path) else "sqlite"
+    if backend not in NODE_CACHES.keys():
+        raise ValueError("Invalid node cache backend '%s', expected one of: %s" % (backend, ", ".join(NODE_CACHES.keys())))
+    logging.info("Node cache %s: %s" % (backend, path))
+    return NODE_CACHES[backend](path, workers=workers)
+
+
+def migrate(src, dst, batch=1000):
+    """Copy every node of the cache src into the cache dst"""
+    keys = src.keys()
+    logging.info("Migrating %d nodes" % len(keys))
+    for i in range(0, len(keys), batch):
+        nodes = src.getMany(keys[i:i + batch])
+        dst.putMany(nodes)
+        logging.info("Migrated %d/%d nodes" % (min(i + batch, len(keys)), len(keys)))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Migrate a ZotGraph node cache between backends")
+    parser.add_argument("src", help="source node cache (N_CACHE directory)")
+    parser.add_argument("dst", help="destination node cache (sqlite file)")
+    parser.add_argument("--src-backend", default="dir", choices=NODE_CACHES.keys())
+    parser.add_argument("--dst-backend", default="sqlite", choices=NODE_CACHES.keys())
+    args = parser.parse_args()
+    migrate(openNodeCache(args.src, args.src_backend), openNodeCache(args.dst, args.dst_backend))
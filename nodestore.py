@@ -0,0 +1,138 @@
+import logging
+import sys
+from lrucache import LRUCache
+import metrics
+
+
+class NodeCore:
+    """What stays in memory for every graph node
+
+    Neighbour ids are interned, so a paper referenced by many nodes is
+    stored once. Influence flags are one byte per link.
+    """
+
+    __slots__ = ("paperId", "title", "doi", "year", "has_smitem",
+                 "r_processed", "c_processed",
+                 "refs", "ref_infl", "cits", "cit_infl")
+
+    def __init__(self, paperId, node):
+        self.paperId = paperId
+        self.title = node.get('title')
+        self.doi = node.get('doi')
+        self.r_processed = node.get('r_processed', False)
+        self.c_processed = node.get('c_processed', False)
+        smitem = node.get('smitem')
+        self.has_smitem = smitem is not None
+        self.year = None
+        self.refs = ()
+        self.ref_infl = b""
+        self.cits = ()
+        self.cit_infl = b""
+        if smitem is None:
+            return
+        self.year = smitem.get('year')
+        self.refs, self.ref_infl = NodeCore.__links(smitem.get('references', []))
+        self.cits, self.cit_infl = NodeCore.__links(smitem.get('citations', []))
+
+    def __links(refs):
+        ids = []
+        infl = bytearray()
+        for ref in refs:
+            refId = ref.get('paperId')
+            ids.append(sys.intern(refId) if refId is not None else None)
+            infl.append(1 if ref.get('isInfluential') else 0)
+        return tuple(ids), bytes(infl)
+
+    def references(self):
+        """(paperId, isInfluential) of every reference"""
+        return zip(self.refs, map(bool, self.ref_infl))
+
+    def citations(self):
+        """(paperId, isInfluential) of every citation"""
+        return zip(self.cits, map(bool, self.cit_infl))
+
+
+class NodeStore:
+    """The graph nodes, a NodeCore each plus the full nodes within a memory budget
+
+    Full nodes (abstract, complete reference/citation dicts, extracted
+    references) are kept in an LRU bounded by their estimated serialized
+    size and paged in again through load(paperId) when they were evicted.
+    load must return the node as it was put, i.e. re-apply any post
+    processing done after reading it from the node cache.
+    """
+
+    # rough serialized size of one reference/citation dict and of the rest
+    LINK_SIZE = 300
+    BASE_SIZE = 2048
+
+    def __init__(self, load, budget=256 * 1024 * 1024):
+        self.load = load
+        self.cores = {}
+        self.full = LRUCache(budget, weigh=NodeStore.weigh)
+        self.pageins = 0
+
+    def weigh(node):
+        # an estimate, serializing every node just to weigh it slows down loading
+        size = NodeStore.BASE_SIZE
+        smitem = node.get('smitem')
+        if smitem is not None:
+            size += len(smitem.get('abstract') or "")
+            size += NodeStore.LINK_SIZE * (len(smitem.get('references', [])) + len(smitem.get('citations', [])))
+        for zaitem in node.get('zaitem') or []:
+            try:
+                size += NodeStore.LINK_SIZE * len(zaitem['extref']['titles'])
+            except (KeyError, TypeError):
+                pass
+            try:
+                size += NodeStore.LINK_SIZE * len(zaitem.get('refinfo') or [])
+            except TypeError:
+                pass
+        return size
+
+    def __contains__(self, paperId):
+        return paperId in self.cores
+
+    def __len__(self):
+        return len(self.cores)
+
+    def keys(self):
+        return self.cores.keys()
+
+    def core(self, paperId):
+        return self.cores[paperId]
+
+    def put(self, paperId, node):
+        self.cores[paperId] = NodeCore(paperId, node)
+        self.full.put(paperId, node)
+
+    def remove(self, paperId):
+        del self.cores[paperId]
+        self.full.pop(paperId)
+
+    def get(self, paperId):
+        """Full node for paperId, paged in from the node cache if needed"""
+        core = self.cores[paperId]
+        node = self.full.get(paperId)
+        if node is not None:
+            metrics.CACHE_LOOKUPS.inc(cache="node_memory", result="hit")
+            return node
+        metrics.CACHE_LOOKUPS.inc(cache="node_memory", result="miss")
+        logging.debug("Page in node %s" % paperId)
+        self.pageins += 1
+        node = self.load(paperId)
+        if node is None:
+            raise KeyError(paperId)
+        node['r_processed'] = core.r_processed
+        node['c_processed'] = core.c_processed
+        self.full.put(paperId, node)
+        return node
+
+    def __getitem__(self, paperId):
+        return self.get(paperId)
+
+    def stats(self):
+        stats = self.full.stats()
+        stats["nodes"] = len(self.cores)
+        stats["pageins"] = self.pageins
+        return stats
@@ -0,0 +1,57 @@
+class NodeSummary:
+    """Display fields of a graph node, derived once from its smitem/zaitem
+
+    Read by the table rows, node labels, colorings and edge checks instead
+    of going back to the Semantic Scholar item every time.
+    """
+
+    __slots__ = ("author", "year", "ncit", "title", "collection", "colkey", "label")
+
+    def __init__(self, author="?", year=0, ncit=-1, title="?", collection="N/A", colkey=None, label=None):
+        self.author = author
+        self.year = year
+        self.ncit = ncit
+        self.title = title
+        self.collection = collection
+        self.colkey = colkey
+        self.label = label
+
+    def fromNode(paperId, node, getCollectionName):
+        """Summary of node, getCollectionName maps a Zotero collection key to its name"""
+        ns = NodeSummary()
+        smitem = node.get('smitem')
+        try:
+            ns.author = smitem['authors'][0]['name']
+        except:
+            pass
+        try:
+            ns.year = smitem['year']
+        except:
+            pass
+        try:
+            ns.title = smitem['title']
+        except:
+            pass
+        try:
+            ns.ncit = len(smitem['citations'])
+        except:
+            pass
+        try:
+            ns.label = "%s - %d - %s" % (smitem['year'], len(smitem["citations"]), smitem['title'])
+        except:
+            ns.label = paperId
+        zaitems = node.get('zaitem')
+        if zaitems is not None and len(zaitems) == 1:
+            cols = sorted(zaitems[0]['data']['collections'])
+            ns.colkey = "_".join(cols)
+            ns.collection = ":".join([getCollectionName(col) for col in cols])
+        return ns
+
+    def asDict(self):
+        return {
+            "author": self.author,
+            "year": self.year,
+            "ncit": self.ncit,
+            "collection": self.collection,
+            "title": self.title,
+        }
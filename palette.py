@@ -0,0 +1,84 @@
+import threading
+from lazyimport import LazyModule
+
+np = LazyModule("numpy")
+
+# matplotlib's tab20c and tab20b, so colors do not need matplotlib
+TAB20C = [
+    "#3182bd", "#6baed6", "#9ecae1", "#c6dbef", "#e6550d", "#fd8d3c", "#fdae6b", "#fdd0a2",
+    "#31a354", "#74c476", "#a1d99b", "#c7e9c0", "#756bb1", "#9e9ac8", "#bcbddc", "#dadaeb",
+    "#636363", "#969696", "#bdbdbd", "#d9d9d9",
+]
+TAB20B = [
+    "#393b79", "#5254a3", "#6b6ecf", "#9c9ede", "#637939", "#8ca252", "#b5cf6b", "#cedb9c",
+    "#8c6d31", "#bd9e39", "#e7ba52", "#e7cb94", "#843c39", "#ad494a", "#d6616b", "#e7969c",
+    "#7b4173", "#a55194", "#ce6dbd", "#de9ed6",
+]
+# linear segmented colormaps as (red, green, blue) anchors at 0 and 1
+COLORMAPS = {
+    "summer": ((0.0, 0.5, 0.4), (1.0, 1.0, 0.4)),
+}
+
+
+def toNumber(value):
+    try:
+        return float(int(value))
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def toHex(rgba):
+    """Hex strings for an (n, 3|4) array of 0..1 colors, alpha is dropped"""
+    rgb = np.round(np.asarray(rgba)[:, :3] * 255).astype(int)
+    return ["#%02x%02x%02x" % (r, g, b) for r, g, b in rgb]
+
+
+class SequentialPalette:
+    """Lookup table of a colormap, values are mapped onto it in one pass"""
+
+    N = 256
+    MISSING = "#ffffff"
+
+    def __init__(self, name):
+        low, high = COLORMAPS[name]
+        x = np.linspace(0, 1, SequentialPalette.N)[:, None]
+        self.lut = np.array(toHex(np.array(low) + x * (np.array(high) - np.array(low))))
+
+    def colors(self, values, vmin, vmax):
+        """Colors of values (None for unknown) normalized to vmin..vmax"""
+        values = np.array([toNumber(v) for v in values], dtype=float)
+        missing = np.isnan(values)
+        span = float(vmax - vmin)
+        if span > 0:
+            x = (np.where(missing, vmin, values) - vmin) / span
+        else:
+            x = np.zeros(len(values))
+        idx = np.clip((x * SequentialPalette.N).astype(int), 0, SequentialPalette.N - 1)
+        colors = self.lut[idx]
+        colors[missing] = SequentialPalette.MISSING
+        return colors.tolist()
+
+
+class CategoricalPalette:
+    """Colors handed out to keys in order of first appearance, cycling"""
+
+    def __init__(self, colors):
+        self.lut = list(colors)
+        self.assigned = {}
+        self.lock = threading.Lock()
+
+    def colors(self, keys):
+        if len(keys) == 0:
+            return []
+        uniq, first, inverse = np.unique(np.array(keys, dtype=object).astype(str), return_index=True, return_inverse=True)
+        with self.lock:
+            for i in np.argsort(first):
+                key = uniq[i]
+                if key not in self.assigned:
+                    self.assigned[key] = self.lut[len(self.assigned) % len(self.lut)]
+            colors = np.array([self.assigned[key] for key in uniq])
+        return colors[inverse.reshape(-1)].tolist()
+
+
+def tab40():
+    return TAB20C + TAB20B
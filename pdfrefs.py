@@ -0,0 +1,178 @@
+import argparse
+import json
+import logging
+import re
+from lazyimport import LazyModule, available
+
+# either one is enough, PyMuPDF is much faster
+fitz = LazyModule("fitz")
+pdfminer_text = LazyModule("pdfminer.high_level")
+
+P_HEADING = re.compile(r"^\s*(?:[0-9IVX]+\.?\s+)?(?:references|bibliography|works cited|literature cited|references and notes)\s*$", re.I | re.M)
+P_END = re.compile(r"^\s*(?:[A-Z0-9]\.?\s+)?(?:appendix|appendices|supplementary material)\b", re.I | re.M)
+P_HYPHEN = re.compile(r"(\w)-\n([a-z])")
+P_BRACKET = re.compile(r"^\s*\[([^\]\n]{1,20})\]\s*", re.M)
+P_NUMBERED = re.compile(r"^\s*(\d{1,3})\.\s+(?=\S)", re.M)
+P_AUTHOR_START = re.compile(r"^\s*(?:[A-Z][^\s,.]+,\s+[A-Z]|[A-Z]\.\s)")
+P_QUOTED = re.compile(r"[\"“”]([^\"“”]{10,300}?)[,.]?[\"“”]")
+P_SENTENCE = re.compile(r"[.?!]:?(?:\s+|$)")
+P_YEAR = re.compile(r"^\(?\d{4}[a-z]?\)?[.,]?\s*")
+P_DOI = re.compile(r"\b(10\.\d{4,9}/[^\s\"<>]+)")
+P_URL = re.compile(r"https?://\S+")
+# tokens before a period that do not end an author list
+NAME_PARTS = set(["al", "jr", "sr", "st", "eds", "ed"])
+MIN_TITLE_LEN = 10
+MAX_TITLE_LEN = 300
+
+
+def isAvailable():
+    return available("fitz") or available("pdfminer")
+
+
+def pdfText(pdfpath):
+    if available("fitz"):
+        with fitz.open(pdfpath) as doc:
+            return "\n".join(page.get_text() for page in doc)
+    if available("pdfminer"):
+        return pdfminer_text.extract_text(pdfpath)
+    raise RuntimeError("Local reference extraction needs PyMuPDF or pdfminer.six")
+
+
+def bibliography(text):
+    """Text of the last references section, None if there is no such heading"""
+    headings = list(P_HEADING.finditer(text))
+    if len(headings) == 0:
+        return None
+    section = text[headings[-1].end():]
+    end = P_END.search(section)
+    if end is not None:
+        section = section[:end.start()]
+    return P_HYPHEN.sub(r"\1\2", section)
+
+
+def sequentialMarks(matches):
+    # "1." ... "n." at line starts, anything out of order is a false hit
+    kept = []
+    for m in matches:
+        if int(m.group(1)) == len(kept) + 1:
+            kept.append(m)
+    return kept
+
+
+def splitEntries(section):
+    """[(id, entry)] of a references section, [n] and n. numbering or author-year lists"""
+    marks = list(P_BRACKET.finditer(section))
+    if len(marks) < 2:
+        marks = sequentialMarks(P_NUMBERED.finditer(section))
+    if len(marks) >= 2:
+        entries = []
+        for m, nxt in zip(marks, marks[1:] + [None]):
+            entry = section[m.end():nxt.start() if nxt is not None else len(section)]
+            entries.append((m.group(1).strip(), " ".join(entry.split())))
+        return entries
+    # unnumbered: a new entry starts with an author after a line ending with a period
+    entries = []
+    lines = []
+    for line in section.splitlines():
+        if not line.strip():
+            continue
+        if len(lines) > 0 and lines[-1].rstrip().endswith(".") and P_AUTHOR_START.match(line):
+            entries.append(" ".join(" ".join(lines).split()))
+            lines = []
+        lines.append(line)
+    if len(lines) > 0:
+        entries.append(" ".join(" ".join(lines).split()))
+    return [("%d" % (i + 1), entry) for i, entry in enumerate(entries)]
+
+
+def isInitial(token):
+    return len(token.replace(".", "").replace("-", "")) <= 2
+
+
+def titleFollows(words):
+    # "Smith," "Lee." "K." "Smith and" continue an author list
+    if len(words) < 2:
+        return False
+    first = words[0]
+    if first[-1] in ",.:" or isInitial(first.lower()) or first.lower() in ["and", "&"]:
+        return False
+    return words[1].lower() not in ["and", "&"]
+
+
+def entryTitle(entry):
+    """Title of a reference entry, "?" if none can be told apart"""
+    m = P_QUOTED.search(entry)
+    if m is not None:
+        return m.group(1).strip(" ,.")
+    # skip the authors, they end at the first period after a name, or after
+    # an initial that is followed by a title rather than another name
+    rest = None
+    for m in P_SENTENCE.finditer(entry):
+        before = entry[:m.start()].split()
+        token = before[-1].strip("(),;").lower() if len(before) > 0 else ""
+        if isInitial(token) or token in NAME_PARTS:
+            if ":" not in m.group(0) and not titleFollows(entry[m.end():].split()):
+                continue
+        rest = entry[m.end():]
+        break
+    if rest is None:
+        return "?"
+    rest = P_YEAR.sub("", rest)
+    m = P_SENTENCE.search(rest)
+    end = len(rest) if m is None else m.start()
+    # question marks are part of the title
+    if m is not None and rest[end] in "?!":
+        end += 1
+    title = rest[:end].strip(" ,")
+    if len(title) < MIN_TITLE_LEN or len(title) > MAX_TITLE_LEN or title.startswith("In "):
+        return "?"
+    return title
+
+
+def entryLink(entry):
+    m = P_DOI.search(entry)
+    if m is not None:
+        return "https://doi.org/%s" % m.group(1).rstrip(".,;)")
+    m = P_URL.search(entry)
+    if m is not None:
+        return m.group(0).rstrip(".,;)")
+    return None
+
+
+def extractReferences(pdfpath):
+    """Reference list of a PDF, runs in the extraction worker processes"""
+    section = bibliography(pdfText(pdfpath))
+    refs = []
+    if section is None:
+        logging.warning("No references section in %s" % pdfpath)
+    else:
+        for idx, entry in splitEntries(section):
+            ref = {"id": idx, "entry": entry, "title": entryTitle(entry)}
+            link = entryLink(entry)
+            if link is not None:
+                ref["url"] = link
+            refs.append(ref)
+    return {"extractor": "local", "reference_links": refs}
+
+
+def parseReferences(refs):
+    """The titles/links/paperIds structure of RefExtract for extractReferences output"""
+    titles = {}
+    links = {}
+    for ref in refs.get("reference_links", []):
+        titles[ref["id"]] = ref.get("title") or "?"
+        if ref.get("url"):
+            links[ref["id"]] = ref["url"]
+    return {
+        "titles": titles,
+        "links": links,
+        "paperIds": {},
+    }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Extract the reference list of a PDF")
+    parser.add_argument("pdf")
+    args = parser.parse_args()
+    print(json.dumps(extractReferences(args.pdf), indent=2))
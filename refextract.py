@@ -3,14 +3,40 @@ import subprocess
 import json
 import re
 import os
+import time
+import threading
 import urllib
+import multiprocessing
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from datetime import timedelta
 from ratelimit import limits, sleep_and_retry
-from fuzzywuzzy import fuzz
-from fuzzywuzzy import process
-from scholarly import scholarly
+from lazyimport import LazyModule
+import metrics
+import pdfrefs
+from extrefcache import ExtRefCache
 
-class RefExtract:
+fuzz = LazyModule("fuzzywuzzy.fuzz")
+# only needed for Google Scholar title lookups
+scholarly = LazyModule("scholarly", "scholarly")
+
+class RefBackend(ABC):
+    """Extracts the reference list of a PDF
+
+    submit returns a Future of the raw, json serializable result (None if
+    the extraction failed), RefExtract caches it and turns it into the
+    titles/links/paperIds structure.
+    """
+
+    @abstractmethod
+    def submit(self, pdfpath):
+        pass
+
+    def close(self):
+        pass
+
+
+class ScholarcyBackend(RefBackend):
     """
 curl -X 'POST' \
   'https://ref.scholarcy.com/api/references/extract' \
@@ -22,11 +48,9 @@ curl -X 'POST' \
   -F 'resolve_references=true' \
   -F 'reference_style=ensemble' \
   -F 'engine=v1'
-  """
 
-    
-    P_REFS_TEST = re.compile("(\[(.*?)\])")
-    EXTREF_DIR = "/home/file/proj/zotcit/extref/"
+Scholarcy web API, one PDF every 10s
+  """
 
     CURL_CMD = [
         "curl", "-X", "'POST'",
@@ -41,8 +65,94 @@ curl -X 'POST' \
         "-F", "'engine=v1'",
         ]
 
-    def __init__(self, sm):
+    def __init__(self, workers=None):
+        # the rate limit serializes the calls anyway
+        self.workers = 1
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="scholarcy")
+
+    def submit(self, pdfpath):
+        return self.executor.submit(self.__extract, pdfpath, time.perf_counter())
+
+    def __extract(self, pdfpath, called):
+        pout = self.__getRefs(pdfpath, called)
+        try:
+            refs = json.loads(pout.decode('utf-8'))
+            refs["extractor"] = "scholarcy"
+            return refs
+        except Exception as e:
+            logging.error("Could not extract references from '%s': %s" % (pdfpath, e))
+            return None
+
+    @sleep_and_retry
+    @limits(calls=1, period=timedelta(seconds=10).total_seconds())
+    def __getRefs(self, pdfpath, called):
+        metrics.RATELIMIT_WAIT_SECONDS.observe(time.perf_counter() - called, service="scholarcy")
+        this_curl_cmd = self.CURL_CMD + ['-F'] + ["'file=@\"%s\";type=application/pdf'" % pdfpath]
+        logging.debug("Executing %s" % " ".join(this_curl_cmd))
+        with metrics.external("scholarcy", "extract") as call:
+            p = subprocess.Popen(" ".join(this_curl_cmd), shell=True, stdout=subprocess.PIPE)
+            pout, _ = p.communicate()
+            call.outcome = "ok" if p.returncode == 0 else "curl %d" % p.returncode
+        return pout
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+class LocalPdfBackend(RefBackend):
+    """Parses the bibliography section of the PDF text, offline
+
+    Needs PyMuPDF or pdfminer.six. Extraction is CPU bound and runs in a
+    pool of worker processes, one per core by default.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers if workers else os.cpu_count()
+        self.pool = None
+        self.lock = threading.Lock()
+        if not pdfrefs.isAvailable():
+            logging.error("Local reference extraction needs PyMuPDF or pdfminer.six")
+
+    def submit(self, pdfpath):
+        with self.lock:
+            if self.pool is None:
+                # spawn, forking the threaded server is not safe
+                self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        t0 = time.perf_counter()
+        fut = self.pool.submit(pdfrefs.extractReferences, pdfpath)
+        fut.add_done_callback(lambda f: metrics.PHASE_SECONDS.observe(time.perf_counter() - t0, phase="extract_refs_local"))
+        return fut
+
+    def close(self):
+        with self.lock:
+            if self.pool is not None:
+                self.pool.shutdown(wait=False)
+                self.pool = None
+
+
+REF_BACKENDS = {
+    "scholarcy": ScholarcyBackend,
+    "local": LocalPdfBackend,
+}
+
+
+class RefExtract:
+    P_REFS_TEST = re.compile("(\[(.*?)\])")
+
+    def __init__(self, sm, cache_dir, backend=None, workers=None):
         self.sm = sm
+        if not cache_dir:
+            raise ValueError("No directory for extracted references, set EXTREF_DIR")
+        if backend is None:
+            backend = "scholarcy"
+        if backend not in REF_BACKENDS.keys():
+            raise ValueError("Invalid reference extraction backend '%s', expected one of: %s" % (backend, ", ".join(REF_BACKENDS.keys())))
+        logging.info("Reference extraction backend: %s" % backend)
+        self.backend = REF_BACKENDS[backend](workers=workers)
+        self.cache = ExtRefCache(cache_dir)
+        # sha256 -> Future of the running extractions, one per PDF content
+        self.inflight = {}
+        self.lock = threading.Lock()
 
     def __getAllTitles(self, refs, tistr="TI  - "):
         ris = refs["ris"]
@@ -170,31 +280,83 @@ curl -X 'POST' \
             "paperIds": paperIds,
         }
 
-    @sleep_and_retry
-    @limits(calls=1, period=timedelta(seconds=10).total_seconds())
-    def __getRefs(self, pdfpath):
-        this_curl_cmd = self.CURL_CMD + ['-F'] + ["'file=@\"%s\";type=application/pdf'" % pdfpath]
-        logging.debug("Executing %s" % " ".join(this_curl_cmd))
-        p = subprocess.Popen(" ".join(this_curl_cmd), shell=True, stdout=subprocess.PIPE)
-        pout, _ = p.communicate()
-        return pout
+    def isEmptyLocal(refs):
+        # the local parser finds nothing in PDFs without a references heading,
+        # which says nothing about what another backend would find
+        return refs.get("extractor") == "local" and len(refs.get("reference_links", [])) == 0
+
+    def __cached(self, digest, paperId=None):
+        refs = self.cache.get(digest, paperId)
+        if refs is not None and RefExtract.isEmptyLocal(refs):
+            return None
+        return refs
+
+    def __extraction(self, pdfpath, digest):
+        # the running extraction of this PDF content, a new one if there is
+        # none and it is not cached yet (then None)
+        with self.lock:
+            fut = self.inflight.get(digest)
+            if fut is not None:
+                metrics.CACHE_LOOKUPS.inc(cache="extref", result="coalesced")
+                return fut
+            if self.__cached(digest) is not None:
+                return None
+            metrics.CACHE_LOOKUPS.inc(cache="extref", result="miss")
+            fut = self.backend.submit(pdfpath)
+            self.inflight[digest] = fut
+        fut.add_done_callback(lambda f: self.__store(digest, f))
+        return fut
+
+    def __store(self, digest, fut):
+        # cached before it stops being in flight, so lookups see one of both
+        try:
+            refs = fut.result()
+            if refs is not None and not RefExtract.isEmptyLocal(refs):
+                self.cache.put(digest, refs)
+        except Exception as e:
+            logging.error("Reference extraction %s failed: %s" % (digest, e))
+        finally:
+            with self.lock:
+                self.inflight.pop(digest, None)
+
+    def stats(self):
+        stats = self.cache.stats()
+        with self.lock:
+            stats["inflight"] = len(self.inflight)
+        return stats
+
+    def prefetch(self, pdfpath, paperId):
+        """Start extracting the references of pdfpath in the background"""
+        digest = self.cache.digest(pdfpath, paperId)
+        if digest is None or self.__cached(digest, paperId) is not None:
+            return
+        self.__extraction(pdfpath, digest)
 
     def extractRefs(self, pdfpath, paperId):
-        #this_curl_cmd = RefExtract.CURL_CMD + ['-F'] + ["'file=@\"%s\";type=application/pdf'" % pdfpath]
-        #logging.debug("Executing %s" % " ".join(this_curl_cmd))
-        #p = subprocess.Popen(" ".join(this_curl_cmd), shell=True, stdout=subprocess.PIPE)
-        #pout, _ = p.communicate()
-        refpath = os.path.join(RefExtract.EXTREF_DIR, paperId)
-        if os.path.exists(refpath):
-            refs = json.loads(open(refpath, "r").read())
+        digest = self.cache.digest(pdfpath, paperId)
+        if digest is None:
+            return {}, {}
+        refs = self.__cached(digest, paperId)
+        if refs is not None:
+            metrics.CACHE_LOOKUPS.inc(cache="extref", result="hit")
         else:
-            pout = self.__getRefs(pdfpath)
-            try:
-                refs = json.loads(pout.decode('utf-8'))
-            except Exception as e:
-                logging.error("Could not extract references")
+            fut = self.__extraction(pdfpath, digest)
+            if fut is None:
+                # finished in the meantime
+                refs = self.__cached(digest)
+            else:
+                try:
+                    refs = fut.result()
+                except Exception as e:
+                    logging.error("Could not extract references from '%s': %s" % (pdfpath, e))
+                    return {}, {}
+            if refs is None:
                 return {}, {}
-            open(refpath, "w").write(json.dumps(refs, sort_keys=True, indent=2))
         logging.debug("Parse references for '%s'" % pdfpath)
         #logging.info(refs)
-        return self.__parseRefs(refs), refs
+        with metrics.PHASE_SECONDS.time(phase="parse_refs"):
+            # cached results are kept whatever backend produced them,
+            # Scholarcy results cached before they were tagged have no extractor
+            if refs.get("extractor") == "local":
+                return pdfrefs.parseReferences(refs), refs
+            return self.__parseRefs(refs), refs
@@ -2,33 +2,113 @@ from typing import Literal
 import requests
 import urllib.parse
 import logging
-from datetime import timedelta
-from ratelimit import limits, sleep_and_retry
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import metrics
+from requests.adapters import HTTPAdapter
 from tenacity import (retry,
-                      wait_fixed,
+                      wait_exponential,
                       retry_if_exception_type,
                       stop_after_attempt)
 
 
+class RateLimitedError(ConnectionRefusedError):
+    pass
+
+
+class TokenBucket:
+    '''Token bucket shared by all threads talking to one API
+    :param float rate: tokens added per second.
+    :param int burst: maximum number of tokens in the bucket.
+    '''
+
+    def __init__(self, rate: float, burst: int=1) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+        self.blocked_until = 0
+        self.lock = threading.Lock()
+
+    def acquire(self) -> float:
+        '''Block until a token is available
+        :returns: seconds spent waiting.
+        '''
+        waited = 0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                wait = self.blocked_until - now
+                if wait <= 0:
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return waited
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+    def backoff(self, seconds: float) -> None:
+        '''Stop handing out tokens for seconds (e.g. after a 429)'''
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+            self.tokens = 0
+
+
+def _retry_wait(retry_state):
+    # the bucket already sleeps for Retry-After, everything else backs off
+    if isinstance(retry_state.outcome.exception(), RateLimitedError):
+        return 0
+    return wait_exponential(multiplier=2, max=240)(retry_state)
+
+
 class SemanticScholar:
 
     DEFAULT_API_URL = 'https://api.semanticscholar.org/v1'
     DEFAULT_SEARCH_API_URL = 'https://api.semanticscholar.org/graph/v1/paper'
     DEFAULT_PARTNER_API_URL = 'https://partner.semanticscholar.org/v1'
 
+    # paper/batch accepts at most this many ids per request
+    BATCH_SIZE = 500
+    # fields needed to build the v1 paper shape from a Graph API paper
+    LEGACY_FIELDS = [
+        'paperId', 'externalIds', 'url', 'title', 'abstract', 'venue', 'year',
+        'authors', 'isOpenAccess', 'fieldsOfStudy',
+        'citations.paperId', 'citations.title', 'citations.year', 'citations.externalIds',
+        'citations.citationCount',
+        'references.paperId', 'references.title', 'references.year', 'references.externalIds',
+        'references.citationCount',
+    ]
+
+    # requests per second without / with an API key
+    DEFAULT_RATE = 0.1
+    DEFAULT_KEY_RATE = 1.0
+    DEFAULT_RETRY_AFTER = 60
+
     auth_header = {}
 
     def __init__(
                 self,
                 timeout: int=240,
                 api_key: str=None,
-                api_url: str=None
+                api_url: str=None,
+                search_url: str=None,
+                rate: float=None,
+                burst: int=1,
+                workers: int=8
             ) -> None:
         '''
         :param float timeout: an exception is raised
             if the server has not issued a response for timeout seconds.
         :param str api_key: (optional) private API key.
         :param str api_url: (optional) custom API url.
+        :param str search_url: (optional) custom Graph API paper url.
+        :param float rate: (optional) requests per second allowed by the quota.
+        :param int burst: (optional) requests allowed back to back.
+        :param int workers: (optional) number of concurrent fetches.
         '''
 
         if api_url:
@@ -41,9 +121,18 @@ class SemanticScholar:
             if not api_url:
                 self.api_url = self.DEFAULT_PARTNER_API_URL
 
-        self.api_search_url = self.DEFAULT_SEARCH_API_URL
+        self.api_search_url = search_url if search_url else self.DEFAULT_SEARCH_API_URL
         self.timeout = timeout
 
+        if rate is None:
+            rate = self.DEFAULT_KEY_RATE if api_key else self.DEFAULT_RATE
+        self.bucket = TokenBucket(rate, burst)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="s2fetch")
+
     def findItem(self, doi, title) -> dict:
         smdata = None
         if doi and doi.startswith("10."):
@@ -67,6 +156,100 @@ class SemanticScholar:
 
         return data
 
+    def papers(self, ids: list, fields: list=None) -> list:
+        '''Batch paper lookup through the Graph API
+        :param list ids: S2PaperIds, DOIs or ArXivIds.
+        :param list fields: (optional) Graph API fields, defaults to
+            the fields of the v1 paper lookup.
+        :returns: paper data for each id, empty :class:`dict` if not found.
+        :rtype: :class:`list`
+        '''
+
+        data = dict(self.fetchPapers(ids, fields=fields))
+        return [data.get(id, {}) for id in ids]
+
+    def fetchPapers(self, ids: list, fields: list=None, batch: bool=True):
+        '''Fetch several papers concurrently, in chunks of BATCH_SIZE through
+        paper/batch or one v1 lookup per paper
+        :param list ids: S2PaperIds, DOIs or ArXivIds.
+        :param list fields: (optional) Graph API fields.
+        :param bool batch: (optional) False to use the v1 lookup, which is
+            one request per paper but has isInfluential for the links.
+        :returns: generator of (id, paper data) in completion order,
+            paper data is an empty :class:`dict` if the lookup failed.
+        '''
+
+        if not batch:
+            yield from self.__fetchEach(ids)
+            return
+        if fields is None:
+            fields = self.LEGACY_FIELDS
+        futures = {}
+        for i in range(0, len(ids), self.BATCH_SIZE):
+            chunk = ids[i:i + self.BATCH_SIZE]
+            futures[self.executor.submit(self.__post_batch, chunk, fields)] = chunk
+        try:
+            for fut in as_completed(futures):
+                chunk = futures[fut]
+                try:
+                    items = fut.result()
+                except Exception as e:
+                    logging.error("Failed to get %d papers from semanticscholar: %s" % (len(chunk), e))
+                    items = []
+                if len(items) != len(chunk):
+                    logging.error("Semantic Scholar returned %d papers for %d ids" % (len(items), len(chunk)))
+                    items = []
+                for id, item in itertools.zip_longest(chunk, items):
+                    yield id, self.__toLegacy(item)
+        finally:
+            for fut in futures:
+                fut.cancel()
+
+    def __fetchEach(self, ids: list):
+        futures = {self.executor.submit(self.paper, id): id for id in ids}
+        try:
+            for fut in as_completed(futures):
+                try:
+                    item = fut.result()
+                except Exception as e:
+                    logging.error("Failed to get paper '%s' from semanticscholar: %s" % (futures[fut], e))
+                    item = {}
+                yield futures[fut], item
+        finally:
+            for fut in futures:
+                fut.cancel()
+
+    def __toLegacy(self, item: dict) -> dict:
+        '''Add the v1 keys (doi, arxivId, flat citation/reference dicts)
+        to a Graph API paper. paper/batch has no isInfluential for the
+        links, they are False and influentialUnknown is set.
+        '''
+
+        if not item:
+            return {}
+        data = dict(item)
+        ext = item.get('externalIds') or {}
+        data['doi'] = ext.get('DOI')
+        data['arxivId'] = ext.get('ArXiv')
+        for link in ['citations', 'references']:
+            if link not in item.keys():
+                continue
+            entries = []
+            for entry in item[link] or []:
+                eext = entry.get('externalIds') or {}
+                entries.append({
+                    'paperId': entry.get('paperId'),
+                    'title': entry.get('title') or "",
+                    'year': entry.get('year'),
+                    'doi': eext.get('DOI'),
+                    'arxivId': eext.get('ArXiv'),
+                    'isInfluential': entry.get('isInfluential', False),
+                    'citationCount': entry.get('citationCount'),
+                })
+            data[link] = entries
+            data['influentialUnknown'] = True
+        return data
+
     def search(self, id: str, include_unknown_refs: bool=False) -> dict:
         '''
         http://api.semanticscholar.org/graph/v1/paper/search?query=literature+graph
@@ -100,10 +283,46 @@ class SemanticScholar:
 
         return data
 
-    @sleep_and_retry
-    @limits(calls=1, period=timedelta(seconds=10).total_seconds())
     @retry(
-        wait=wait_fixed(240),
+        wait=_retry_wait,
+        retry=(retry_if_exception_type(ConnectionRefusedError) | retry_if_exception_type(PermissionError) | retry_if_exception_type(TimeoutError)),
+        stop=stop_after_attempt(10)
+    )
+    def __post_batch(self, ids: list, fields: list) -> list:
+        '''Post one chunk to the Graph API paper/batch endpoint
+        :returns: paper data or None for each id.
+        :rtype: :class:`list`
+        '''
+
+        url = '{}/batch?fields={}'.format(self.api_search_url, ",".join(fields))
+        ids = ['DOI:' + id if id.startswith("10.") else id for id in ids]
+        metrics.RATELIMIT_WAIT_SECONDS.observe(self.bucket.acquire(), service="s2")
+        with metrics.external("s2", "batch") as call:
+            r = self.session.post(url, json={'ids': ids}, timeout=self.timeout, headers=self.auth_header)
+            call.outcome = r.status_code
+        if r.status_code == 200:
+            return r.json()
+        self.__check_status(r)
+        return []
+
+    def __check_status(self, r: requests.Response) -> None:
+        '''Raise the retryable errors for a failed request'''
+
+        if r.status_code == 403:
+            raise PermissionError('HTTP status 403 Forbidden.')
+        elif r.status_code == 429:
+            try:
+                retry_after = float(r.headers.get('Retry-After', self.DEFAULT_RETRY_AFTER))
+            except ValueError:
+                retry_after = self.DEFAULT_RETRY_AFTER
+            logging.warning("Semantic Scholar rate limited, retry after %ds" % retry_after)
+            self.bucket.backoff(retry_after)
+            raise RateLimitedError('HTTP status 429 Too Many Requests.')
+        elif r.status_code == 504:
+            raise TimeoutError('HTTP status 504 Connection Timeout.')
+
+    @retry(
+        wait=_retry_wait,
         retry=(retry_if_exception_type(ConnectionRefusedError) | retry_if_exception_type(PermissionError) | retry_if_exception_type(TimeoutError)),
         stop=stop_after_attempt(10)
     )
@@ -136,18 +355,17 @@ class SemanticScholar:
             
         
         #logging.info("Semantic Scholar %s" %(url))
-        r = requests.get(url, timeout=self.timeout, headers=self.auth_header)
+        metrics.RATELIMIT_WAIT_SECONDS.observe(self.bucket.acquire(), service="s2")
+        with metrics.external("s2", method) as call:
+            r = self.session.get(url, timeout=self.timeout, headers=self.auth_header)
+            call.outcome = r.status_code
 
         #logging.info("Semantic Scholar %d %s" %(r.status_code, url))
         if r.status_code == 200:
             data = r.json()
             if len(data) == 1 and 'error' in data:
                 data = {}
-        elif r.status_code == 403:
-            raise PermissionError('HTTP status 403 Forbidden.')
-        elif r.status_code == 429:
-            raise ConnectionRefusedError('HTTP status 429 Too Many Requests.')
-        elif r.status_code == 504:
-            raise TimeoutError('HTTP status 504 Connection Timeout.')
+        else:
+            self.__check_status(r)
 
         return data
@@ -0,0 +1,112 @@
+import logging
+import re
+import threading
+from collections import Counter
+from lazyimport import LazyModule, available
+
+if available("rapidfuzz"):
+    fuzz = LazyModule("rapidfuzz.fuzz")
+else:
+    fuzz = LazyModule("fuzzywuzzy.fuzz")
+
+
+class TitleIndex:
+    """Fuzzy title lookup over a set of keyed titles
+
+    Titles are normalized (lower case, alphanumeric tokens) and indexed by
+    character n-grams. A lookup collects candidates through the rarest
+    n-grams of the query and only scores the best MAX_CANDIDATES of them.
+    """
+
+    NGRAM = 3
+    # number of query n-grams used for candidate generation
+    MIN_PROBE_GRAMS = 8
+    MAX_CANDIDATES = 32
+    P_NONALNUM = re.compile(r"[^\w]+")
+
+    def __init__(self):
+        self.titles = {}
+        self.exact = {}
+        self.grams = {}
+        self.lock = threading.Lock()
+
+    def normalize(title):
+        if not isinstance(title, str):
+            return ""
+        return " ".join(TitleIndex.P_NONALNUM.sub(" ", title.lower()).split())
+
+    def ngrams(norm):
+        norm = " %s " % norm
+        return set(norm[i:i + TitleIndex.NGRAM] for i in range(0, len(norm) - TitleIndex.NGRAM + 1))
+
+    def __len__(self):
+        return len(self.titles)
+
+    def clear(self):
+        with self.lock:
+            self.titles = {}
+            self.exact = {}
+            self.grams = {}
+
+    def add(self, key, title):
+        norm = TitleIndex.normalize(title)
+        if norm == "":
+            return
+        with self.lock:
+            self.__remove(key)
+            self.titles[key] = norm
+            self.exact.setdefault(norm, set()).add(key)
+            for gram in TitleIndex.ngrams(norm):
+                self.grams.setdefault(gram, set()).add(key)
+
+    def remove(self, key):
+        with self.lock:
+            self.__remove(key)
+
+    def __remove(self, key):
+        norm = self.titles.pop(key, None)
+        if norm is None:
+            return
+        self.exact[norm].discard(key)
+        if len(self.exact[norm]) == 0:
+            del self.exact[norm]
+        for gram in TitleIndex.ngrams(norm):
+            self.grams[gram].discard(key)
+            if len(self.grams[gram]) == 0:
+                del self.grams[gram]
+
+    def exactKeys(self, title):
+        with self.lock:
+            return list(self.exact.get(TitleIndex.normalize(title), []))
+
+    def candidates(self, title):
+        norm = TitleIndex.normalize(title)
+        if norm == "":
+            return norm, []
+        with self.lock:
+            postings = [self.grams[gram] for gram in TitleIndex.ngrams(norm) if gram in self.grams]
+            # rare n-grams are the selective ones, skip the long posting lists
+            postings.sort(key=len)
+            nprobe = max(TitleIndex.MIN_PROBE_GRAMS, len(postings) // 2)
+            counts = Counter()
+            for posting in postings[:nprobe]:
+                counts.update(posting)
+            return norm, [(key, self.titles[key]) for key, _ in counts.most_common(TitleIndex.MAX_CANDIDATES)]
+
+    def lookup(self, title, minr=70, scorer="partial_ratio"):
+        """Best matching key for title
+        :returns: (key, score), key is None if no candidate scores above minr.
+        """
+        score = getattr(fuzz, scorer)
+        norm, candidates = self.candidates(title)
+        best_key = None
+        best_r = 0
+        for key, cand in candidates:
+            r = score(cand, norm)
+            if r > best_r:
+                best_r = r
+                best_key = key
+        if best_r <= minr:
+            logging.debug("No title match above %d for '%s' (best %d)" % (minr, title, best_r))
+            return None, best_r
+        return best_key, best_r
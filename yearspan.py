@@ -0,0 +1,63 @@
+class YearHistogram:
+    """Publication years of the graph nodes, counted per year
+
+    Adding or removing a paper is O(1) except when the last paper of the
+    oldest/newest year leaves. The year -> level mapping used for the
+    hierarchical layout is rebuilt lazily, on the first lookup after the
+    set of distinct years changed.
+    """
+
+    def __init__(self):
+        self.counts = {}
+        self.paper_year = {}
+        self.min = None
+        self.max = None
+        self.levels = {}
+        self.levels_dirty = False
+        # bumped whenever the set of distinct years, and so the levels, change
+        self.version = 0
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __contains__(self, key):
+        return key in self.paper_year
+
+    def add(self, key, year):
+        old = self.paper_year.get(key)
+        if old == year:
+            return
+        if old is not None:
+            self.remove(key)
+        self.paper_year[key] = year
+        if year in self.counts:
+            self.counts[year] += 1
+            return
+        self.counts[year] = 1
+        self.levels_dirty = True
+        self.version += 1
+        if self.min is None or year < self.min:
+            self.min = year
+        if self.max is None or year > self.max:
+            self.max = year
+
+    def remove(self, key):
+        year = self.paper_year.pop(key, None)
+        if year is None:
+            return False
+        self.counts[year] -= 1
+        if self.counts[year] == 0:
+            del self.counts[year]
+            self.levels_dirty = True
+            self.version += 1
+            if year == self.min:
+                self.min = min(self.counts.keys()) if len(self.counts) > 0 else None
+            if year == self.max:
+                self.max = max(self.counts.keys()) if len(self.counts) > 0 else None
+        return True
+
+    def level(self, year):
+        if self.levels_dirty:
+            self.levels = {y: i + 1 for i, y in enumerate(sorted(self.counts.keys()))}
+            self.levels_dirty = False
+        return self.levels[year]
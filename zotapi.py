@@ -1,23 +1,92 @@
-from pyzotero import zotero
-import pandas as pd
 import json
 import logging
+from titleindex import TitleIndex
+from lazyimport import LazyModule
+import metrics
+from zotsqlite import ZoteroSqlite
+
+zotero = LazyModule("pyzotero.zotero")
+pd = LazyModule("pandas")
 
 #from refextract import RefExtract
 
 
 class ZotApi:
-    def __init__(self, libcsv, library_id, library_type, api_key):
-        self.zot = zotero.Zotero(library_id, library_type, api_key)
-        self.df = pd.read_csv(libcsv)
+    INDEX_COLUMNS = ['Key', 'Title', 'DOI', 'Notes', 'File Attachments', 'Link Attachments']
+    FUZZ_TITLE_MINR = 90
+
+    def __init__(self, libcsv, library_id, library_type, api_key, endpoint=None, zotero_sqlite=None, zotero_storage=None, zotero_base_dir=None):
+        if zotero_sqlite:
+            # items, collections, notes and attachments from the local
+            # database, replaces both the web API and the csv export
+            self.zot = ZoteroSqlite(zotero_sqlite, library_id, library_type, storage=zotero_storage, base_dir=zotero_base_dir)
+            self.zot_service = "zotero_sqlite"
+        else:
+            self.zot = zotero.Zotero(library_id, library_type, api_key)
+            if endpoint:
+                # e.g. a local stand-in for api.zotero.org
+                self.zot.endpoint = endpoint
+            self.zot_service = "zotero"
+        self.zotero_sqlite = zotero_sqlite
         self.libcsv = libcsv
         self.colkeys = {}
         self.colkeys2 = {}
         self.keytocol = {}
-        logging.info("Initialized Zotero API csv: %s, libid: %s, libtype: %s, akey: %s" % (libcsv, library_id, library_type, api_key))
+        # ZoteroSqlite just took its snapshot
+        self.reloadCsv(refresh=False)
+        logging.info("Initialized Zotero API csv: %s, sqlite: %s, libid: %s, libtype: %s, akey: %s" % (libcsv, zotero_sqlite, library_id, library_type, api_key))
+
+    def reloadCsv(self, refresh=True):
+        # build everything first and swap at the end, lookups keep
+        # answering from the previous export in the meantime
+        if self.zotero_sqlite:
+            if refresh:
+                self.zot.refresh()
+            rows = self.zot.indexRows()
+        else:
+            rows = self.__csvRows(pd.read_csv(self.libcsv))
+        keyidx, doiidx, title_index = self.__buildIndex(rows)
+        self.keyidx = keyidx
+        self.doiidx = doiidx
+        self.title_index = title_index
 
-    def reloadCsv(self):
-        self.df = pd.read_csv(self.libcsv)
+    def __call(self, call, *args, **kwargs):
+        with metrics.external(self.zot_service, call):
+            return getattr(self.zot, call)(*args, **kwargs)
+
+    def normDOI(doi):
+        if not isinstance(doi, str):
+            return None
+        doi = doi.strip().lower()
+        if doi == "":
+            return None
+        return doi
+
+    def __csvRows(self, df):
+        cols = [c for c in ZotApi.INDEX_COLUMNS if c in df.columns]
+        for values in df[cols].itertuples(index=False, name=None):
+            yield {c: (v if isinstance(v, str) else None) for c, v in zip(cols, values)}
+
+    def __buildIndex(self, rows):
+        # one pass over the export, all lookups below are dict hits
+        keyidx = {}
+        doiidx = {}
+        title_index = TitleIndex()
+        for row in rows:
+            key = row.get('Key')
+            if key is None:
+                continue
+            keyidx.setdefault(key, []).append(row)
+            doi = ZotApi.normDOI(row.get('DOI'))
+            if doi is not None:
+                doiidx.setdefault(doi, []).append(key)
+            if row.get('Title') is not None:
+                title_index.add(key, row['Title'])
+        logging.info("Indexed %d Zotero keys, %d dois, %d titles" % (len(keyidx), len(doiidx), len(title_index)))
+        return keyidx, doiidx, title_index
+
+    def __getField(self, key, field):
+        return [row.get(field) for row in self.keyidx.get(key, [])]
 
     def isValidDOI(doi):
         if doi and doi.startswith("10."):
@@ -26,7 +95,14 @@ class ZotApi:
 
     def getItemIdByTitle(self, title):
         #logging.info("Searching Zotero for title '%s'" % title)
-        return self.df[self.df['Title'] == title]['Key'].values
+        keys = self.title_index.exactKeys(title)
+        if len(keys) > 0:
+            return keys
+        key, r = self.title_index.lookup(title, minr=ZotApi.FUZZ_TITLE_MINR, scorer="ratio")
+        if key is None:
+            return []
+        logging.info("Fuzzy matched Zotero title score %d '%s'" % (r, title))
+        return [key]
 
     def getItemByTitle(self, title):
         logging.info("Search Zotero for title '%s'" % title)
@@ -40,10 +116,10 @@ class ZotApi:
             logging.warn("Invalid Zotero title (mutliple entries %s) '%s'" % (title, len(keys)))
             return []
         logging.info("Got Zotero keys '%s' for title '%s'" % (", ".join(keys), title))
-        return self.zot.top(itemKey=keys[0])
+        return self.__call("top", itemKey=keys[0])
 
     def getItemIdByDOI(self, doi):
-        return self.df[self.df['DOI'] == doi]['Key'].values
+        return self.doiidx.get(ZotApi.normDOI(doi), [])
 
     def getItemByDOI(self, doi):
         logging.info("Searching Zotero for doi '%s'" % doi)
@@ -55,13 +131,13 @@ class ZotApi:
             return []
         try:
             logging.debug("Got Zotero keys '%s' for doi '%s'" % (", ".join(keys), doi))
-            return self.zot.top(itemKey=keys[0])
+            return self.__call("top", itemKey=keys[0])
         except Exception as e:
             logging.err("Could not get Zotero item by doi '%s': %s'" % (doi,e ))
         return []
 
     def getItemByKey(self, key):
-        return self.zot.top(itemKey=key)
+        return self.__call("top", itemKey=key)
 
     def findItem(self, key=None, doi=None, title=None):
         ret = []
@@ -75,7 +151,7 @@ class ZotApi:
 
     def getAnnotations(self, key):
         logging.debug("get annotations for key %s" % key)
-        annots = self.df[self.df['Key'] == key]['Notes'].values
+        annots = self.__getField(key, 'Notes')
         #if len(annots) < 1 or not isinstance(annots[0], str):
         #    logging.warn("No annotations for %s" % key)
         #logging.info("Got annots for %s: %s" % (key, annots))
@@ -99,8 +175,8 @@ class ZotApi:
         
     def getPdfPath(self, key):
         logging.debug("get pdf path for key %s" % key)
-        files = self.df[self.df['Key'] == key]['File Attachments'].values
-        if len(files) == 1:
+        files = self.__getField(key, 'File Attachments')
+        if len(files) == 1 and files[0] is not None:
             for fn in files[0].split("; "):
                 if fn.endswith(".pdf"):
                     return fn
@@ -108,7 +184,7 @@ class ZotApi:
 
 
     def __getParentCollectionNames(self, ckey):
-        col = self.zot.collection(ckey)
+        col = self.__call("collection", ckey)
         cname = col['data']['name']
         pcolkey = col['data']['parentCollection']
         parents = [cname]
@@ -125,7 +201,10 @@ class ZotApi:
         cols = {}
         for ckey in ckeys:
             if ckey not in self.colkeys.keys():
+                metrics.CACHE_LOOKUPS.inc(cache="zotero_collection", result="miss")
                 self.colkeys[ckey] = self.__getParentCollectionNames(ckey)
+            else:
+                metrics.CACHE_LOOKUPS.inc(cache="zotero_collection", result="hit")
             cols[ckey] = self.colkeys[ckey]
         return cols
     
@@ -142,7 +221,7 @@ class ZotApi:
 
     def getCollectionItemsByName(self, colname):
         skeys = []
-        collections = self.zot.collections()
+        collections = self.__call("collections")
         this_col = None
         for col in collections:
             if col['data']['name'] == colname:
@@ -152,12 +231,12 @@ class ZotApi:
                 this_col = col
         if this_col is not None:
             #logging.info(json.dumps(this_col, sort_keys=True, indent=2))
-            citems = self.zot.collection_items(this_col['data']['key'])
+            citems = self.__call("collection_items", this_col['data']['key'])
             for item in citems:
                 try:
-                    link = self.df[self.df['Key'] == item['key']]['Link Attachments'].values
-                    title = self.df[self.df['Key'] == item['key']]['Title'].values
-                    if len(link) > 0 and "semantic" in link[0]:
+                    link = self.__getField(item['key'], 'Link Attachments')
+                    title = self.__getField(item['key'], 'Title')
+                    if len(link) > 0 and link[0] is not None and "semantic" in link[0]:
                         skey = link[0].split("/")[-1]
                         skeys.append(skey)
                     elif len(title) > 0:
@@ -167,11 +246,15 @@ class ZotApi:
                     pass
             return skeys
     
-    def getCollectionName(self,  ckey):
+    def getCollectionName(self,  ckey, fetch=True):
         #logging.info("Get name for col %s" % ckey)
         if ckey in self.colkeys2.keys():
+            metrics.CACHE_LOOKUPS.inc(cache="zotero_collection_name", result="hit")
             return self.colkeys2[ckey]
-        col = self.zot.collection(ckey)
+        metrics.CACHE_LOOKUPS.inc(cache="zotero_collection_name", result="miss")
+        if not fetch:
+            return None
+        col = self.__call("collection", ckey)
         #logging.info(json.dumps(col, sort_keys=True, indent=2))
         cname = col['data']['name']
         self.colkeys2[ckey] = cname
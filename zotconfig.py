@@ -5,3 +5,23 @@ LIBRARY_ID=<ZOTERO_LIBRARY_ID>
 API_KEY=<ZOTERO_APY_KEY>
 LIBRARY_TYPE="user"
 LCSV=<ZOTERO_LIB_CSV_EXPORT>
+S2_API_KEY=None
+S2_RATE=None
+S2_WORKERS=8
+N_CACHE_BACKEND=None
+GRAPH_COMPACT_EVERY=1000
+ANNOT_CACHE_SIZE=2048
+JOB_WORKERS=2
+CRAWL_AUTORESUME=True
+CHANGELOG_SIZE=10000
+NODE_MEMORY_BUDGET=256
+N_CACHE_WORKERS=8
+S2_API_URL=None
+S2_SEARCH_URL=None
+ZOTERO_ENDPOINT=None
+REFEXTRACT_BACKEND="scholarcy"
+REFEXTRACT_WORKERS=None
+EXTREF_DIR=None
+ZOTERO_SQLITE=None
+ZOTERO_STORAGE=None
+ZOTERO_BASE_DIR=None
@@ -1,26 +1,40 @@
-from pyzotero import zotero
 import logging
 #FORMAT = "[%(filename)s:%(lineno)s - %(funcName)20s() ] %(message)s"
 #logging.basicConfig(format=FORMAT)
 #logging.basicConfig(format=FORMAT, level=logging.INFO)
 
-import itertools
-import networkx as nx
+import heapq
 import threading
+import time
 import os
+from concurrent.futures import ThreadPoolExecutor
 import re
 import json
-import pickle
-import matplotlib.pyplot as plt
-import matplotlib
-import numpy as np
-from fuzzywuzzy import fuzz
-from fuzzywuzzy import process
+from lazyimport import LazyModule, available
 from semanticscholar import SemanticScholar
 from zotapi import ZotApi
-from datetime import timedelta
-from ratelimit import limits, sleep_and_retry
 from refextract import RefExtract
+from nodecache import openNodeCache
+from graphstore import GraphJournal
+from lrucache import LRUCache
+from changelog import ChangeLog
+from nodesummary import NodeSummary
+from nodestore import NodeStore
+from titleindex import TitleIndex
+from rwlock import RWLock
+from yearspan import YearHistogram
+import metrics
+from palette import SequentialPalette, CategoricalPalette, tab40
+
+# imported on first use, keeps server start and project load light
+nx = LazyModule("networkx")
+np = LazyModule("numpy")
+fuzz = LazyModule("fuzzywuzzy.fuzz")
+if available("rapidfuzz"):
+    rf_process = LazyModule("rapidfuzz.process")
+    rf_fuzz = LazyModule("rapidfuzz.fuzz")
+else:
+    rf_process = None
 
 PAPER_DEDUPS= {
     "57cee3a90bb0caa822fc188b083a01aa1e17cca9": "d896ef2a393eb8022446a7d8951432ac8f424bbd",
@@ -67,26 +81,57 @@ class ZotGraph:
     #COLOR_CIT='#dd4b39'
     COLOR_DEFAULT_N = '#cccccc' #'#B1D8F1'
     COLORINGS = set(["COLLECTION", "YEAR", "NCIT", "AUTHOR"])
+    CRAWL_BATCH = 100
+    CRAWL_RETRIES = 2
+    LOAD_CHUNK = 500
+    CRAWL_CHECKPOINT_FN = "crawl.json"
 
 
-    def __init__(self, graph_path, cfilter, htmldir, ncache, filterfn, libcsv, library_id, library_type, api_key):
+    def __init__(self, graph_path, cfilter, htmldir, ncache, filterfn, libcsv, library_id, library_type, api_key, config=None):
         logging.info("FILTER CONF: %s" % json.dumps(cfilter, sort_keys=True, indent=2))
         logging.info("HTML DIR: %s" % htmldir)
         logging.info("NODE CAHCE: %s" % ncache)
         logging.info("FILTER: %s" % filterfn)
-        self.lock = threading.Lock()
+        # graph state: readers share it, mutations are serialized, network
+        # and extraction work happens before the write lock is taken
+        self.lock = RWLock()
+        self.mentions_lock = threading.RLock()
         self.max_dist = cfilter['dist']
         self.min_year = cfilter['year']
         self.max_cit = cfilter['cit']
-        self.za = ZotApi(libcsv, library_id, library_type, api_key)
-        self.sm = SemanticScholar()
-        self.re = RefExtract(self.sm)
-        self.nodes = {}
+        self.config = config if config is not None else {}
+        self.za = ZotApi(libcsv, library_id, library_type, api_key, endpoint=self.config.get('ZOTERO_ENDPOINT'),
+                         zotero_sqlite=self.config.get('ZOTERO_SQLITE'), zotero_storage=self.config.get('ZOTERO_STORAGE'),
+                         zotero_base_dir=self.config.get('ZOTERO_BASE_DIR'))
+        self.sm = SemanticScholar(
+            api_key=self.config.get('S2_API_KEY'),
+            api_url=self.config.get('S2_API_URL'),
+            search_url=self.config.get('S2_SEARCH_URL'),
+            rate=self.config.get('S2_RATE'),
+            workers=self.config.get('S2_WORKERS', 8))
+        extref = self.config.get('EXTREF_DIR')
+        if not extref:
+            # next to the node cache, e.g. zotgrap/ncache -> zotgrap/extref
+            extref = os.path.join(os.path.dirname(os.path.abspath(ncache.rstrip("/"))), "extref")
+        self.re = RefExtract(
+            self.sm,
+            extref,
+            backend=self.config.get('REFEXTRACT_BACKEND'),
+            workers=self.config.get('REFEXTRACT_WORKERS'))
+        # papers looked ahead for their PDFs while fetching
+        self.prefetch_refs = 2 * self.re.backend.workers
+        # full nodes beyond the budget are paged in again from the node cache
+        self.nodes = NodeStore(
+            self.__pageInNode,
+            budget=self.config.get('NODE_MEMORY_BUDGET', 256) * 1024 * 1024)
+        # paperId -> NodeSummary, kept in sync with self.nodes
+        self.summaries = {}
+        self.title_index = TitleIndex()
         self.ncachefn = ncache
+        self.ncache = openNodeCache(ncache, self.config.get('N_CACHE_BACKEND'), workers=self.config.get('N_CACHE_WORKERS', 8))
         self.htmldir = htmldir
-        self.year_to_paperid = {}
-        self.c_min_year = 2050 #self.min_year
-        self.c_max_year = 0
+        self.years = YearHistogram()
+        self.load_timings = {}
         self.c_min_ncit = 10000
         self.c_max_ncit = 0 #self.max_cit
 
@@ -94,16 +139,24 @@ class ZotGraph:
         #self.color = iter(cm.Pastel1(np.linspace(0,1,32)))
         self.coloring = "COLLECTION"
 
-        self.color = {}
-        self.color["COLLECTION"] = itertools.chain(iter(plt.cm.tab20c(np.linspace(0, 1, 20))), iter(plt.cm.tab20b(np.linspace(0, 1, 20))))
-        self.color["AUTHOR"] = itertools.chain(iter(plt.cm.tab20c(np.linspace(0, 1, 20))), iter(plt.cm.tab20b(np.linspace(0, 1, 20))))
-        seqmap = plt.get_cmap('summer')
-        norm_year = matplotlib.colors.Normalize(vmin=self.min_year, vmax=2021)
-        self.color["YEAR"] = plt.cm.ScalarMappable(cmap=seqmap, norm=norm_year)
-        norm_ncit = matplotlib.colors.Normalize(vmin=0, vmax=40) #self.max_cit)
-        self.color["NCIT"] = plt.cm.ScalarMappable(cmap=seqmap, norm=norm_ncit)
-        #self.color["NCIT"] = plt.cm.PuBuGn(np.linspace(0, 1.0, 100))
+        seqmap = SequentialPalette('summer')
+        self.color = {
+            "COLLECTION": CategoricalPalette(tab40()),
+            "AUTHOR": CategoricalPalette(tab40()),
+            "YEAR": seqmap,
+            "NCIT": seqmap,
+        }
+        # coloring -> (value range, {paperId: color}), dropped when the range changes
         self.colcolors = {}
+        self.color_lock = threading.Lock()
+        self.__clearMentions()
+        # rendered annotations, keyed by (paperId, zotero key, notes hash, membership_version)
+        self.annot_cache = LRUCache(self.config.get('ANNOT_CACHE_SIZE', 2048))
+        # bumped whenever a node enters or leaves the graph
+        self.membership_version = 0
+        # what clients need to catch up: added/removed/recoloured nodes and edges
+        self.changes = ChangeLog(self.config.get('CHANGELOG_SIZE', 10000))
+        self.node_colors = {}
         self.filterfn = filterfn
         self.filterIds = set()
         if os.path.exists(filterfn):
@@ -114,122 +167,219 @@ class ZotGraph:
                     self.filterIds.add(l)
         
         self.graph_path = graph_path
-        if os.path.exists(graph_path):
+        self.crawl_path = os.path.join(os.path.dirname(graph_path), ZotGraph.CRAWL_CHECKPOINT_FN)
+        self.journal = GraphJournal(graph_path, compact_every=self.config.get('GRAPH_COMPACT_EVERY', 1000))
+        if self.journal.exists():
             self.__loadGraph()
         else:
             self.g = nx.DiGraph()
+        # year levels and color range the clients were sent last
+        self.layout_years = self.years.version
+        self.layout_range = self.__colorRange(self.coloring)
     
     @dedup_paper
     def __getNodeInfo(self, paperId=None):
-        smitem = self.nodes[paperId]['smitem']
-        author = "?"
-        year = 0
-        title = "?"
-        ncit = -1
-        collection = "N/A"
-        try:
-            author = smitem['authors'][0]['name']
-        except:
-            pass
-        try:
-            year = smitem['year']
-        except:
-            pass
-        try:
-            title = smitem['title']
-        except:
-            pass
-        try:
-            ncit = len(smitem['citations'])
-        except:
-            pass
-        zaitem = self.__getZaItem(paperId=paperId)
-        if zaitem is not None:
-            cnames = []
-            for col in zaitem['data']['collections']:
-                cnames.append(self.za.getCollectionName(col))
-            collection = ":".join(cnames)
-            #collection = self.za.getCollectionName(zaitem['data']['collections'])
-            #collection = self.za.getCollectionNameByKey(zaitem['key'])
-
-        return {
-            "author": author, 
-            "year": year, 
-            "ncit": ncit, 
-            "collection": collection,
-            "title": title,
-        }
+        ns = self.summaries.get(paperId)
+        if ns is None:
+            ns = NodeSummary.fromNode(paperId, self.nodes[paperId], self.__cachedCollectionName)
+        return ns
 
     @dedup_paper
-    def __getJsNode(self, paperId=None):
+    def __getJsNode(self, paperId=None, color=None):
         if paperId in self.filterIds:
             logging.info("PaperId '%s' is filtered" % paperId)
             return {}
         if paperId not in self.nodes.keys():
             logging.err("No Node for PaperId '%s'" % paperId)
             return {}
-        if 'smitem' not in self.nodes[paperId]:
+        if not self.nodes.core(paperId).has_smitem:
             logging.info("No Semantic Scholar entry for PaperId '%s'" % paperId)
             return {}
 
-        #author, year, ncit, title = self.__getNodeInfo(paperId)
         ni = self.__getNodeInfo(paperId=paperId)
 
-        jsnode = {
-                "author": ni["author"],
-                "year": ni["year"],   
-                "ncit": ni["ncit"],
-                "collection": ni["collection"],
-                "title": ni["title"],
-                "node_data": {         
-                    "color": self.__getNodeColor(paperId=paperId),
-                    "id": paperId,
-                    "label": self.__getPaperName(paperId=paperId),
-                    "shape": "box",
-                }
-            }
+        jsnode = ni.asDict()
+        jsnode["node_data"] = {
+            "color": color if color is not None else self.__getNodeColor(paperId=paperId),
+            "id": paperId,
+            "label": ni.label,
+            "shape": "box",
+        }
         try:
-            jsnode['node_data']['level'] = "%d" % self.year_to_level[int(ni['year'])]
+            jsnode['node_data']['level'] = "%d" % self.years.level(int(ni.year))
         except Exception as e:
             logging.error("Can not get year for %s: %s" % (paperId, e))
-            #logging.error(json.dumps(self.year_to_level, sort_keys=True, indent=2))
             jsnode['node_data']['level'] = "1"
         return jsnode
     
-    @dedup_paper
     def __loadGraph(self):
         logging.info("Load Graph")
-        G = nx.read_gpickle(self.graph_path)
+        timings = {}
+        t0 = time.perf_counter()
+        G = self.journal.load()
+        timings['journal'] = time.perf_counter() - t0
         self.g = nx.DiGraph()
-        #self.g.add_nodes_from(G.nodes(data=True))
-        all_nodes = set()
-        for gnode in G.nodes(data=True):
-            if gnode[0] not in self.filterIds and \
-                gnode[0] not in all_nodes and \
-                gnode[0] not in PAPER_DEDUPS.keys():
-                self.g.add_node(gnode[0], **gnode[1])
-                all_nodes.add(gnode[0])
-                paperId = gnode[0]
-                self.nodes[paperId] = self.__getNode(paperId=paperId)
-            
-        # clean edges (TODO: remove)
-        #self.g.remove_edges_from(list(self.g.edges))
-        self.refreshAllLinks()
+        # everything rebuilt here is already in snapshot + journal
+        self.journal.recording = False
+        gnodes = []
+        seen = set()
+        for paperId, attrs in G.nodes(data=True):
+            if paperId in self.filterIds or paperId in seen or paperId in PAPER_DEDUPS.keys():
+                continue
+            seen.add(paperId)
+            gnodes.append((paperId, attrs))
+        chunks = [gnodes[i:i + ZotGraph.LOAD_CHUNK] for i in range(0, len(gnodes), ZotGraph.LOAD_CHUNK)]
+
+        # read the cache in chunks, the next chunk is read while the current
+        # one is built and only the node store budget stays in memory
+        timings['cache'] = 0
+        timings['nodes'] = 0
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="zgload") as prefetch:
+            future = None
+            if len(chunks) > 0:
+                future = prefetch.submit(self.__loadCacheNodes, [paperId for paperId, _ in chunks[0]])
+            for i, chunk in enumerate(chunks):
+                t = time.perf_counter()
+                cached = future.result()
+                if i + 1 < len(chunks):
+                    future = prefetch.submit(self.__loadCacheNodes, [paperId for paperId, _ in chunks[i + 1]])
+                timings['cache'] += time.perf_counter() - t
+                t = time.perf_counter()
+                for paperId, attrs in chunk:
+                    self.g.add_node(paperId, **attrs)
+                    node = self.__fetchNode(paperId=paperId, node=cached.get(paperId))
+                    self.__trackNode(node)
+                    self.__setNode(paperId, node)
+                timings['nodes'] += time.perf_counter() - t
+
+        t = time.perf_counter()
+        nedges = self.__buildEdges()
+        timings['edges'] = time.perf_counter() - t
+        self.journal.recording = True
+        timings['total'] = time.perf_counter() - t0
+        self.load_timings = timings
+        logging.info("Loaded graph with %d nodes, %d edges in %.2fs (%s)" % (
+            len(gnodes), nedges, timings['total'],
+            ", ".join("%s %.2fs" % (phase, sec) for phase, sec in timings.items() if phase != 'total')))
+
+    def __buildEdges(self):
+        # bulk refreshAllLinks for a freshly loaded graph: one pass over the
+        # links against the node id set, nothing is journaled or logged as change
+        ids = set(self.g.nodes)
+        edges = {}
+        for paperId in self.g.nodes:
+            core = self.nodes.core(paperId)
+            for refId, isInfluential in core.references():
+                if refId in ids:
+                    ZotGraph.__collectEdge(edges, paperId, refId, isInfluential)
+            for citId, isInfluential in core.citations():
+                if citId in ids:
+                    ZotGraph.__collectEdge(edges, citId, paperId, isInfluential)
+        self.g.add_edges_from((from_node, to_node, attrs) for (from_node, to_node), attrs in edges.items())
+        return len(edges)
+
+    def __collectEdge(edges, from_node, to_node, isInfluential):
+        # same rules as __addEdge, but influential if either end says so:
+        # nodes fetched through paper/batch may not know the flags
+        if from_node == to_node:
+            return
+        if (to_node, from_node) in edges:
+            from_node, to_node = to_node, from_node
+        if (from_node, to_node) in edges and not isInfluential:
+            return
+        edgeColor, weight = ZotGraph.__edgeStyle(isInfluential)
+        edges[(from_node, to_node)] = {"color": edgeColor, "weight": weight}
+
+    def __edgeStyle(isInfluential):
+        if isInfluential:
+            return '#2e5361', 6
+        return '#bdc9c4', 1
 
     def saveGraph(self):
-        logging.info("save graph to %s" % self.graph_path)
-        nx.write_gpickle(self.g, self.graph_path)
+        logging.debug("save graph to %s" % self.graph_path)
+        with self.lock.read():
+            self.journal.flush()
+        if self.journal.needsCompaction():
+            # copied on the compaction thread
+            self.journal.compact(self.g, self.lock.read)
 
 
     def getGraph(self):
+        with self.lock.read(), metrics.PHASE_SECONDS.time(phase="render_graph"):
+            return self.__getGraph()
+
+    def getVersion(self):
+        with self.lock.read():
+            return self.changes.epoch, self.changes.version
+
+    def getGraphDelta(self, since=0, epoch=None):
+        """Nodes and edges changed after version since
+        Falls back to a full snapshot (full=True) if the changes are not
+        logged anymore or the epoch does not match.
+        """
+        with self.lock.read():
+            delta = {
+                'epoch': self.changes.epoch,
+                'version': self.changes.version,
+                'full': False,
+                'new_nodes': [],
+                'new_edges': [],
+                'removed_nodes': [],
+                'recolored': [],
+            }
+            changes = self.changes.since(epoch, since)
+            if changes is not None and (ChangeLog.LAYOUT, None) in changes:
+                changes = None
+            if changes is None:
+                logging.info("Full graph for version %s/%s" % (epoch, since))
+                delta['full'] = True
+                delta['new_nodes'], delta['new_edges'] = self.__getGraph()
+                return delta
+            nodes = set()
+            removed = set()
+            recolored = set()
+            edges = set()
+            for kind, key in changes:
+                if kind == ChangeLog.NODE:
+                    nodes.add(key)
+                elif kind == ChangeLog.NODE_REMOVED:
+                    removed.add(key)
+                elif kind == ChangeLog.COLOR:
+                    recolored.add(key)
+                elif kind == ChangeLog.EDGE:
+                    edges.add(key)
+            # only the current state of each changed node/edge is sent
+            for paperId in nodes:
+                if self.g.has_node(paperId):
+                    delta['new_nodes'].append(self.__getJsNode(paperId=paperId))
+            for paperId in removed:
+                if not self.g.has_node(paperId):
+                    delta['removed_nodes'].append(paperId)
+            for paperId in recolored:
+                if paperId not in nodes and paperId in self.node_colors.keys():
+                    delta['recolored'].append({
+                        'id': paperId,
+                        'color': self.node_colors[paperId],
+                    })
+            for from_node, to_node in edges:
+                if self.g.has_edge(from_node, to_node):
+                    delta['new_edges'].append({
+                        "color": self.g.edges[from_node, to_node]["color"],
+                        "from": from_node,
+                        "to": to_node,
+                    })
+            return delta
+
+    def __getGraph(self):
         logging.info("Get Graph")
         nodes = []
         edges = []
         added_nodes = set()
+        colors = self.__getNodeColors(list(self.g.nodes))
         for node in self.g.nodes(data=True):
             if node[0] not in added_nodes and node[0] not in PAPER_DEDUPS.keys():
                 logging.debug(node)
-                gnode = self.__getJsNode(paperId=node[0])
+                gnode = self.__getJsNode(paperId=node[0], color=colors[node[0]])
                 nodes.append(gnode)
                 added_nodes.add(node[0])
         for edge in self.g.edges(data=True):
@@ -243,47 +393,52 @@ class ZotGraph:
         return nodes, edges
     
     def getPaperInfo(self):
-        self.lock.acquire()
         paperInfo = []
-        for node in self.g.nodes:
-            paperInfo.append({
-                'id': node,
-                'html': self.__getPaperInfo(paperId=node),
-            })
-        self.lock.release()
+        with self.lock.read():
+            for node in self.g.nodes:
+                paperInfo.append({
+                    'id': node,
+                    'html': self.__getPaperInfo(paperId=node),
+                })
         return paperInfo
 
     @dedup_paper
-    def __clearCacheNode(self, paperId=None):
-        if paperId == "":
-            logging.error("Empty PaperId")
-            return
-        ncache_path = os.path.join(self.ncachefn, paperId)
-        if os.path.exists(ncache_path):
-            os.remove(ncache_path)
+    def getPaperInfoById(self, paperId=None):
+        if paperId not in self.nodes.keys():
+            logging.error("No node for PaperId '%s'" % paperId)
+            return None
+        with self.lock.read(), metrics.PHASE_SECONDS.time(phase="render_paperinfo"):
+            html = self.__getPaperInfo(paperId=paperId)
+        return html
 
     @dedup_paper
     def __storeCacheNode(self, paperId=None, node=None, force=False):
         if paperId == "":
             logging.error("Empty PaperId")
             return
-        if force or not os.path.exists(os.path.join(self.ncachefn, paperId)):
-            with open(os.path.join(self.ncachefn, paperId), "w") as fd:
-                fd.write(json.dumps(node, sort_keys=True, indent=2))
+        if force or not self.ncache.contains(paperId):
+            self.ncache.put(paperId, node)
+
+    def __isCachedNode(self, paperId):
+        return self.ncache.contains(paperId)
+
+    def __loadCacheNodes(self, paperIds):
+        logging.debug("Loading %d Cached Nodes" % len(paperIds))
+        nodes = self.ncache.getMany(paperIds)
+        metrics.CACHE_LOOKUPS.inc(len(nodes), cache="node_cache", result="hit")
+        metrics.CACHE_LOOKUPS.inc(len(paperIds) - len(nodes), cache="node_cache", result="miss")
+        for node in nodes.values():
+            node['r_processed'] = False
+            node['c_processed'] = False
+        return nodes
 
     @dedup_paper
     def __loadCacheNode(self, paperId=None):
         if paperId == "":
             logging.error("Empty PaperId")
             return
-        if not os.path.exists(os.path.join(self.ncachefn, paperId)):
-            return None
-        with open(os.path.join(self.ncachefn, paperId), "r") as fd:
-            logging.debug("Loading Cached Node %s" % paperId)
-            node = json.loads(fd.read())
-            node['r_processed'] = False
-            node['c_processed'] = False
-            return node
+        logging.debug("Loading Cached Node %s" % paperId)
+        return self.__loadCacheNodes([paperId]).get(paperId)
     
     @dedup_paper
     def __getZaItem(self, paperId=None):
@@ -322,68 +477,37 @@ class ZotGraph:
         return "?"
 
 
-    def __cluster_rs(self, all_rs, c_diff=32, verbose=False):
-        r_diffs = [0]
-        s_rs = sorted(list(all_rs))
-
-        if verbose:
-            logging.info(s_rs)
-        for i in range(0, len(s_rs)-1):
-            r_diffs.append(-1*(s_rs[i]-s_rs[i+1]))
-        
-        if verbose:
-            logging.info(r_diffs)
+    def __matchTitles(self, ref_titles, smitem):
+        # score all extracted titles against all Semantic Scholar reference
+        # titles in one pass, returns idx -> (best_r, best_paperId, best_title, candidates)
+        sm_refs = [ref_sm for ref_sm in smitem["references"] \
+            if ref_sm['title'] and len(ref_sm['title']) >= ZotGraph.MIN_TITLE_LEN]
+        idxs = list(ref_titles.keys())
+        matches = {}
+        if len(idxs) == 0 or len(sm_refs) == 0:
+            return matches
+        queries = [ref_titles[idx].lower() for idx in idxs]
+        choices = [ref_sm['title'].lower() for ref_sm in sm_refs]
+        if rf_process is not None:
+            scores = rf_process.cdist(queries, choices, scorer=rf_fuzz.partial_ratio, workers=-1)
+        else:
+            scores = np.array([[fuzz.partial_ratio(c, q) for c in choices] for q in queries])
+        best = scores.argmax(axis=1)
+        for i, idx in enumerate(idxs):
+            j = best[i]
+            candidates = [{
+                "t": sm_refs[k]['title'],
+                "id": sm_refs[k]['paperId'],
+            } for k in np.flatnonzero(scores[i] == scores[i, j])]
+            matches[idx] = (int(round(scores[i, j])), sm_refs[j]['paperId'], sm_refs[j]['title'], candidates)
+        return matches
 
-        clusters = {}
-        cluster = []
-        for i in range(0, len(s_rs)):
-            if r_diffs[i] >= c_diff:
-                if verbose:
-                    logging.info("ADD Cluster %d: %s" % (s_rs[i], str(cluster)))
-                clusters[s_rs[i-1]] = cluster
-                cluster = []
-            cluster.append(s_rs[i])
-        if len(cluster) > 0:
-            clusters[s_rs[-1]] = cluster
-        if verbose:
-            logging.info(json.dumps(clusters, sort_keys=True, indent=2))
-        return clusters
-        
     @dedup_paper
-    def __matchTitle(self, ref_title, smitem):
-        if len(ref_title) < ZotGraph.MIN_TITLE_LEN:
-            return 0, "", ""
-        logging.debug("Search for %s" % ref_title)
-        best_r = 0
-        best_paperId = None
-        best_title = ""
-        candidates = {}
-        all_rs = set()
-        for ref_sm in smitem["references"]:
-            if len(ref_sm['title']) < ZotGraph.MIN_TITLE_LEN:
-                continue
-            r = fuzz.partial_ratio(ref_sm['title'].lower(), ref_title.lower())
-            all_rs.add(r)
-            if r not in candidates.keys():
-                candidates[r] = []
-            if r > best_r:
-                best_r = r
-                best_paperId = ref_sm['paperId']
-                best_title = ref_sm['title']
-            candidates[r].append({
-                "t": ref_sm['title'],
-                "id": ref_sm['paperId'],
-            })
-            #if r == 100:
-            #    break
-        clusters = self.__cluster_rs(all_rs)
-        return best_r, best_paperId, best_title, candidates
-        
-    @dedup_paper
-    def __makeNewNode(self, paperId=None):
+    def __makeNewNode(self, paperId=None, smitem=None, force=False):
 
-        logging.info("Searching Semantic Scholar for '%s'" % (paperId))
-        smitem = self.sm.paper(paperId)
+        if smitem is None:
+            logging.info("Searching Semantic Scholar for '%s'" % (paperId))
+            smitem = self.sm.paper(paperId)
         #try:
         #    logging.info("Searching Semantic Scholar for '%s'" % (paperId))
         #    smitem = self.sm.paper(paperId)
@@ -410,6 +534,7 @@ class ZotGraph:
             zaitem[0]['extref'], zaitem[0]['refinfo'] = self.__extractRefs(zaitem[0]['data']['key'], paperId=paperId)
             new_titles = {}
             if zaitem[0]['extref'] and 'titles' in zaitem[0]['extref'].keys():
+                ref_titles = {}
                 for idx, ref_title in zaitem[0]['extref']['titles'].items():
                     new_titles[idx] = ref_title
                     if ref_title is None:
@@ -418,10 +543,16 @@ class ZotGraph:
                         continue
                     if len(ref_title) < ZotGraph.MIN_TITLE_LEN:
                         continue
-                    logging.debug("Search for %s" % ref_title)
-                    best_r, best_paperId, best_title, candidates = self.__matchTitle(ref_title, smitem)
-                    for cand in candidates[best_r]:
-                        logging.info("Best candidates score %d: '%s' / %s" % (best_r, cand['t'], cand['id']))
+                    ref_titles[idx] = ref_title
+                with metrics.PHASE_SECONDS.time(phase="match_titles"):
+                    matches = self.__matchTitles(ref_titles, smitem)
+                for idx, ref_title in ref_titles.items():
+                    if idx not in matches.keys():
+                        logging.info("Fuzzy matched title failed (no references): '%s'" % ref_title)
+                        continue
+                    best_r, best_paperId, best_title, candidates = matches[idx]
+                    for cand in candidates:
+                        logging.debug("Best candidates score %d: '%s' / %s" % (best_r, cand['t'], cand['id']))
                     if best_r > ZotGraph.FUZZ_TITLE_MINR:
                         logging.info("Fuzzy matched title score %d '%s' / '%s'" % (best_r, ref_title, best_title))
                         zaitem[0]['extref']['paperIds'][idx] = best_paperId
@@ -448,17 +579,55 @@ class ZotGraph:
             'zaitem': zaitem,
             'title': title,
         }
-        self.__storeCacheNode(paperId=paperId, node=node)
+        self.__storeCacheNode(paperId=paperId, node=node, force=force)
 
         return node
     
     def __getPaperIdByTitle(self, title):
         if title is None:
             return None
-        for paperId, node in self.nodes.items():
-            if fuzz.partial_ratio(node['title'].lower(), title.lower()) > 70:
-                return paperId
-        return None
+        paperId, _ = self.title_index.lookup(title, minr=70)
+        return paperId
+
+    def __pageInNode(self, paperId):
+        # runs under the read lock, so never falls back to the network like
+        # __fetchNode: every node in the graph was stored in the node cache
+        node = self.__loadCacheNode(paperId=paperId)
+        if node is None:
+            logging.error("Node %s evicted from memory but missing in the node cache, rescan it" % paperId)
+            return None
+        if node['smitem'] is None:
+            return node
+        return self.__dedupRefs(node, fetch=False)
+
+    def __resolveCollections(self, node):
+        # looks up the collection names of a new node before it is added,
+        # __setNode runs under the graph lock and only reads them cached
+        for zaitem in node.get('zaitem') or []:
+            for ckey in zaitem['data']['collections']:
+                try:
+                    self.za.getCollectionName(ckey)
+                except Exception as e:
+                    logging.error("Could not get Zotero collection %s: %s" % (ckey, e))
+
+    def __cachedCollectionName(self, ckey):
+        name = self.za.getCollectionName(ckey, fetch=False)
+        if name is None:
+            logging.warn("Zotero collection %s not resolved" % ckey)
+            return "?"
+        return name
+
+    def __setNode(self, paperId, node):
+        self.nodes.put(paperId, node)
+        self.summaries[paperId] = NodeSummary.fromNode(paperId, node, self.__cachedCollectionName)
+        self.__forgetNodeColors(paperId)
+        self.title_index.add(paperId, node['title'])
+
+    def __delNode(self, paperId):
+        self.nodes.remove(paperId)
+        self.summaries.pop(paperId, None)
+        self.__forgetNodeColors(paperId)
+        self.title_index.remove(paperId)
 
     @dedup_paper
     def __getAnnotRefs(self, zaitem, paperId=None, annots=None):
@@ -548,6 +717,12 @@ class ZotGraph:
         if zaitem is not None:
             annots_cand = self.za.getAnnotations(zaitem['key'])[0]
             if isinstance(annots_cand, str):
+                ckey = (paperId, zaitem['key'], hash(annots_cand), self.membership_version)
+                cached = self.annot_cache.get(ckey)
+                if cached is not None:
+                    metrics.CACHE_LOOKUPS.inc(cache="annotations", result="hit")
+                    return cached
+                metrics.CACHE_LOOKUPS.inc(cache="annotations", result="miss")
                 annots = annots_cand
                 #logging.info("Got annots for %s: %s" % (paperId, annots))
                 ref_replace = self.__getAnnotRefs(zaitem, paperId=paperId, annots=annots)
@@ -555,8 +730,17 @@ class ZotGraph:
                     if verbose:
                         logging.debug("Replace %s ref %s -> %s" % (paperId, key, replacement))
                     annots = annots.replace(key, replacement)
+                self.annot_cache.put(ckey, annots)
         return annots 
 
+    def getCacheStats(self):
+        return {
+            "annotations": self.annot_cache.stats(),
+            "nodes": self.nodes.stats(),
+            "extref": self.re.stats(),
+            "load": self.load_timings,
+        }
+
     @dedup_paper
     def __getAnnotations(self, paperId=None):
         verbose = False
@@ -581,7 +765,7 @@ class ZotGraph:
         ret = '<p>\n'
         ret += '<a href="%s">%s</a>\n' % (linkurl, linkurl)
         ret += '</p>\n'
-        ret += '<h2>%s</h2>\n' % self.nodes[paperId]['title']
+        ret += '<h2>%s</h2>\n' % self.nodes.core(paperId).title
         ret += '<p>\n'
         ret += abstract
         ret += '</p>\n'
@@ -596,44 +780,17 @@ class ZotGraph:
         logging.debug("Got paper information for %s" % paperId)
         return ret
 
-    def __updateYearSpan(self):
-        years_sorted = sorted(list(self.year_to_paperid.keys()))
-        new_min = years_sorted[0]
-        new_max = years_sorted[-1]
-        changed = False
-        if new_min < self.c_min_year:
-            logging.info("Adjusting year range min %d -> %d:%d" % (self.c_min_year, new_min, self.c_max_year))
-            self.c_min_year = new_min
-            changed = True
-        if new_max > self.c_max_year:
-            logging.info("Adjusting year range max %d: %d -> %d" % (self.c_min_year, self.c_max_year, new_max))
-            self.c_max_year = new_max
-            changed = True
-        if changed:
-            seqmap = plt.get_cmap('summer')
-            norm_year = matplotlib.colors.Normalize(vmin=self.c_min_year, vmax=self.c_max_year)
-            self.color["YEAR"] = plt.cm.ScalarMappable(cmap=seqmap, norm=norm_year)
-        self.year_to_level = {t: i+1 for i, t in enumerate(sorted(self.year_to_paperid.keys()))}
-
     def __updateYearSpanRemove(self, node):
         try:
-            y = int(node['smitem']['year'])
+            paperId = node['smitem']['paperId']
         except Exception as e:
-            logging.error("Failed to update year span on removing %s: %s" % (node['smitem']['paperId'], e))
-            return
-        if y not in self.year_to_paperid.keys():
-            logging.error("Can not remove year %d" % y)
+            logging.error("Failed to update year span on removing: %s" % e)
             return
-
-        if node['smitem']['paperId'] not in self.year_to_paperid[y]:
-            logging.error("PaperId %d not part of year %d" % (node['smitem']['paperId'], y))
+        if paperId not in self.years and paperId not in self.g:
+            # filtered before it was tracked
             return
-
-        self.year_to_paperid[y].remove(node['smitem']['paperId'])
-        if len(self.year_to_paperid[y]) == 0:
-            logging.info("Removing year %d" % y)
-            del self.year_to_paperid[y]
-        self.__updateYearSpan()
+        if not self.years.remove(paperId):
+            logging.error("PaperId %s not part of the year span" % paperId)
 
     def __updateYearSpanAdd(self, node):
         try:
@@ -641,41 +798,43 @@ class ZotGraph:
         except Exception as e:
             logging.error("Failed to update year span on adding %s: %s" % (node['smitem']['paperId'], e))
             return
-        if y not in self.year_to_paperid.keys():
-            logging.info("Add year %d" % y)
-            self.year_to_paperid[y] = set()
-        self.year_to_paperid[y].add(node['smitem']['paperId'])
-        self.__updateYearSpan()
+        self.years.add(node['smitem']['paperId'], y)
 
     @dedup_paper
-    def __getNode(self, paperId=None):
-        node = self.__loadCacheNode(paperId=paperId)
+    def __getNode(self, paperId=None, smitem=None, node=None):
+        node = self.__fetchNode(paperId=paperId, smitem=smitem, node=node)
+        self.__trackNode(node)
+        return node
+
+    @dedup_paper
+    def __fetchNode(self, paperId=None, smitem=None, node=None):
+        # cache / network part of __getNode, does not touch graph state
         if node == None:
-            node = self.__makeNewNode(paperId=paperId)
+            node = self.__loadCacheNode(paperId=paperId)
+        if node == None:
+            node = self.__makeNewNode(paperId=paperId, smitem=smitem)
         if node == None:
             logging.error("Failed to get node for %s" % paperId)
             raise("Failed to get node")
-        node = self.__dedupRefs(node)
+        self.__resolveCollections(node)
+        return self.__dedupRefs(node)
+
+    def __trackNode(self, node):
         self.__updateYearSpanAdd(node)
 
         try:
             nc = len(node['smitem']['citations'])
-            if nc > self.c_max_nc:
+            if nc > self.c_max_ncit:
                 self.c_max_ncit = nc
-                seqmap = plt.get_cmap('summer')
-                norm_ncit = matplotlib.colors.Normalize(vmin=self.c_min_ncit, vmax=self.c_max_ncit)
-                self.color["NCIT"] = plt.cm.ScalarMappable(cmap=seqmap, norm=norm_ncit)
-            if nc < self.c_min_nc:
-                self.c_min_nc = nc
-                seqmap = plt.get_cmap('summer')
-                norm_ncit = matplotlib.colors.Normalize(vmin=self.c_min_ncit, vmax=self.c_max_ncit)
-                self.color["NCIT"] = plt.cm.ScalarMappable(cmap=seqmap, norm=norm_ncit)
+            if nc < self.c_min_ncit:
+                self.c_min_ncit = nc
         except:
             pass
-        return node
 
-    def __getNodeNoDedup(self, paperId=None):
+    def __getNodeNoDedup(self, paperId=None, fetch=True):
         node = self.__loadCacheNode(paperId=paperId)
+        if node == None and not fetch:
+            return None
         if node == None:
             node = self.__makeNewNode(paperId=paperId)
         if node == None:
@@ -683,153 +842,222 @@ class ZotGraph:
             raise("Failed to get node")
         return node
     
-    @dedup_paper    
+    def __clearMentions(self):
+        with self.mentions_lock:
+            # cited paperId -> {citing paperId: [paragraphs]}
+            self.mentions = {}
+            # citing paperId -> {"title", "cited"} for every indexed annotation source
+            self.mention_sources = {}
+
+    def __unindexMentions(self, paperId):
+        if paperId not in self.mention_sources.keys():
+            return
+        for cited in self.mention_sources[paperId]["cited"]:
+            if cited in self.mentions.keys():
+                self.mentions[cited].pop(paperId, None)
+                if len(self.mentions[cited]) == 0:
+                    del self.mentions[cited]
+        del self.mention_sources[paperId]
+
+    def __indexMentions(self, paperId, zaitem, title):
+        self.__unindexMentions(paperId)
+        # zaitems are not kept here, they hold the extracted references
+        source = {"title": title, "cited": set()}
+        self.mention_sources[paperId] = source
+        if zaitem is None:
+            return
+        try:
+            candidates = set(cid for cid in zaitem['extref']['paperIds'].values() if cid is not None)
+        except Exception:
+            return
+        if len(candidates) == 0:
+            return
+        annots = self.__getAnnotationsZa(zaitem, paperId=paperId)
+        if not isinstance(annots, str) or annots == ZotGraph.NO_ANNOTS_STR:
+            return
+        for para in annots.split("<p>"):
+            for cited in candidates:
+                if cited not in para:
+                    continue
+                if cited not in self.mentions.keys():
+                    self.mentions[cited] = {}
+                if paperId not in self.mentions[cited].keys():
+                    self.mentions[cited][paperId] = []
+                self.mentions[cited][paperId].append(para)
+                source["cited"].add(cited)
+
+    def __nodeZaItem(node):
+        if node is None or 'zaitem' not in node.keys() or len(node['zaitem']) == 0:
+            return None
+        return node['zaitem'][0]
+
+    def __getCachedZaItem(self, paperId):
+        return ZotGraph.__nodeZaItem(self.__loadCacheNode(paperId=paperId))
+
+    def __indexNodeMentions(self, paperId):
+        with self.mentions_lock:
+            self.__indexMentions(paperId, self.__getZaItem(paperId=paperId), self.nodes.core(paperId).title)
+
+    def __reindexMentionsOf(self, paperId):
+        # rendered annotations link to graph members, so the paragraphs
+        # mentioning a paper change when it enters or leaves the graph
+        with self.mentions_lock:
+            for citing in list(self.mentions.get(paperId, {}).keys()):
+                source = self.mention_sources[citing]
+                if citing in self.nodes:
+                    zaitem = self.__getZaItem(paperId=citing)
+                else:
+                    zaitem = self.__getCachedZaItem(citing)
+                self.__indexMentions(citing, zaitem, source["title"])
+
+    @dedup_paper
     def __whatDoOthersSay(self, paperId=None):
+        # called by concurrent readers, the index is filled lazily
+        with self.mentions_lock:
+            return self.__whatDoOthersSayLocked(paperId=paperId)
+
+    def __whatDoOthersSayLocked(self, paperId=None):
         if paperId not in self.nodes:
             logging.error("No node for paperid %s")
             return
         
         logging.debug("Get Mentions about %s" % paperId)
-        ret = ""
-        handled = set()
-        for cit in self.nodes[paperId]['smitem']["citations"]:
-            ref_id = cit["paperId"]
-            if ref_id in handled:
+        citing = []
+        for citId in self.nodes.core(paperId).cits:
+            if citId is not None and citId not in citing:
+                citing.append(citId)
+
+        # index annotation sources we have not seen yet
+        extIds = []
+        for ref_id in citing:
+            if ref_id in self.mention_sources.keys():
                 continue
-            handled.add(ref_id)
-
-            if ref_id not in self.nodes:
-                logging.info("loading mentions from external node %s" % ref_id)
-                extNode = self.__loadCacheNode(ref_id)
-                if extNode is None:
-                    continue
-                zaitem = self.__getZaItem(paperId=ref_id)
-                if 'zaitem' in extNode.keys() and len(extNode['zaitem']) > 0:
-                    annots = self.__getAnnotationsZa(extNode['zaitem'][0], paperId=ref_id)
-                else:
-                    continue
-                otherNode = extNode
+            if ref_id in self.nodes:
+                self.__indexNodeMentions(ref_id)
             else:
-                otherNode = self.__getNode(paperId=paperId)
-                annots = self.__getAnnotations(paperId=ref_id)
-            
-            if not isinstance(annots, str) or annots == ZotGraph.NO_ANNOTS_STR:
+                extIds.append(ref_id)
+        if len(extIds) > 0:
+            logging.debug("loading mentions from %d external nodes" % len(extIds))
+            extNodes = self.__loadCacheNodes(extIds)
+            for ref_id in extIds:
+                extNode = extNodes.get(ref_id)
+                title = ""
+                if extNode is not None:
+                    title = extNode['title']
+                self.__indexMentions(ref_id, ZotGraph.__nodeZaItem(extNode), title)
+
+        ret = ""
+        mentions = self.mentions.get(paperId, {})
+        for ref_id in citing:
+            if ref_id not in mentions.keys():
                 continue
             ret_paras = ""
-            for para in annots.split("<p>"):
-                if paperId in para:
-                    refs = ZotGraph.P_REFS2.findall(annots)
-                    for a_ref in refs:
-                        if paperId in a_ref[0]:
-                            para = para.replace(a_ref[0], "<strong>%s</strong>" % a_ref[0])
-                    ret_paras += "<p>" + para
-            if ret_paras != "":
-                ret += "<p><strong>%s</strong> says: </p> %s" % (otherNode["title"], ret_paras)
+            for para in mentions[ref_id]:
+                refs = ZotGraph.P_REFS2.findall(para)
+                for a_ref in refs:
+                    if paperId in a_ref[0]:
+                        para = para.replace(a_ref[0], "<strong>%s</strong>" % a_ref[0])
+                ret_paras += "<p>" + para
+            ret += "<p><strong>%s</strong> says: </p> %s" % (self.mention_sources[ref_id]["title"], ret_paras)
         return ret
 
     @dedup_paper
     def __getPaperName(self, paperId=None):
-        try:
-            smitem = self.nodes[paperId]['smitem']
-            return "%s - %d - %s" % (smitem['year'], len(smitem["citations"]), smitem['title'])
-        except:
+        ns = self.summaries.get(paperId)
+        if ns is None:
             return paperId
+        return ns.label
 
     def setColoring(self, coloring):
         if coloring not in ZotGraph.COLORINGS:
             logging.error("Invalid coloring")
             return False
-        self.lock.acquire()
-        self.coloring = coloring
-        #logging.info("Coloring: %s" % self.coloring)
-        self.colcolors = {}
-        self.lock.release()
+        with self.lock.write():
+            self.coloring = coloring
+            #logging.info("Coloring: %s" % self.coloring)
+            self.layout_range = self.__colorRange(coloring)
+            self.__recolorAll()
         return True
 
-    @dedup_paper
-    def __getColorCollection(self, paperId=None):
-        zaitem = self.__getZaItem(paperId=paperId)
-        if zaitem is None:
-            return ZotGraph.COLOR_DEFAULT_N
-        try:
-            cols = zaitem['data']['collections']
-            cols.sort()
-            colkey = "_".join(cols)
-            #cols = self.za.getCollections(zaitem)
-            #colkey = ""
-            #for _, cname in cols.items():
-            #    colkey += "_%s" % cname
-            if colkey not in self.colcolors.keys():
-                try:
-                    nextcolor = next(self.color[self.coloring])
-                except:
-                    self.color["COLLECTION"] = itertools.chain(iter(plt.cm.tab20c(np.linspace(0, 1, 20))), iter(plt.cm.tab20b(np.linspace(0, 1, 20))))
-                    nextcolor = next(self.color[self.coloring])
-                self.colcolors[colkey] = matplotlib.colors.rgb2hex(nextcolor)
-            return self.colcolors[colkey]
-        except Exception as e:
-            logging.error("Failed to get color for %s: %s" % (paperId, e))
-            logging.error(zaitem)
-            raise("XXX")
-            return ZotGraph.COLOR_DEFAULT_N
+    def __recolorAll(self):
+        # must hold the write lock
+        for paperId, color in self.__getNodeColors(list(self.g.nodes)).items():
+            if self.node_colors.get(paperId) != color:
+                self.node_colors[paperId] = color
+                self.changes.record(ChangeLog.COLOR, paperId)
+
+    def __recordLayoutChanges(self):
+        # must hold the write lock. Adding or removing a node can widen the
+        # color range, which recolors every node, or change the set of
+        # years, which shifts the level of every later year
+        if self.years.version != self.layout_years:
+            self.layout_years = self.years.version
+            self.changes.record(ChangeLog.LAYOUT, None)
+        vrange = self.__colorRange(self.coloring)
+        if vrange != self.layout_range:
+            self.layout_range = vrange
+            self.__recolorAll()
+
+    def __colorRange(self, coloring):
+        if coloring == "YEAR":
+            if self.years.min is not None:
+                return self.years.min, self.years.max
+            return self.min_year, 2021
+        if coloring == "NCIT":
+            if self.c_max_ncit >= self.c_min_ncit:
+                return self.c_min_ncit, self.c_max_ncit
+            return 0, 40
+        return None
 
-    @dedup_paper
-    def __getColorAuthor(self, paperId=None):
-        #author, year, ncit, title = self.__getNodeInfo(paperId)
-        ni = self.__getNodeInfo(paperId=paperId)
-        author = ni["author"]
-        if author not in self.colcolors.keys():
-            try:
-                nextcolor = next(self.color[self.coloring])
-            except:
-                self.color["AUTHOR"] = itertools.chain(iter(plt.cm.tab20c(np.linspace(0, 1, 20))), iter(plt.cm.tab20b(np.linspace(0, 1, 20))))
-                nextcolor = next(self.color[self.coloring])
-            self.colcolors[author] = matplotlib.colors.rgb2hex(nextcolor)
-        return self.colcolors[author]
+    def __colorValue(self, coloring, ni):
+        if coloring == "YEAR":
+            return ni.year
+        if coloring == "NCIT":
+            return ni.ncit
+        if coloring == "AUTHOR":
+            return ni.author
+        return ni.colkey
+
+    def __getNodeColors(self, paperIds):
+        """Colors of paperIds under the current coloring, computed in one
+        pass for the nodes not colored since the last range change"""
+        coloring = self.coloring
+        palette = self.color[coloring]
+        vrange = self.__colorRange(coloring)
+        with self.color_lock:
+            if coloring not in self.colcolors.keys() or self.colcolors[coloring][0] != vrange:
+                self.colcolors[coloring] = (vrange, {})
+            colors = self.colcolors[coloring][1]
+            todo = [paperId for paperId in paperIds if paperId not in colors.keys() and paperId in self.nodes]
+            values = [self.__colorValue(coloring, self.__getNodeInfo(paperId=paperId)) for paperId in todo]
+            if coloring == "COLLECTION":
+                # not in Zotero
+                for paperId, value in zip(todo, values):
+                    if value is None:
+                        colors[paperId] = ZotGraph.COLOR_DEFAULT_N
+                todo = [paperId for paperId, value in zip(todo, values) if value is not None]
+                values = [value for value in values if value is not None]
+            if len(todo) > 0:
+                if vrange is None:
+                    new_colors = palette.colors(values)
+                else:
+                    new_colors = palette.colors(values, vrange[0], vrange[1])
+                colors.update(zip(todo, new_colors))
+            return {paperId: colors.get(paperId, ZotGraph.COLOR_DEFAULT_N) for paperId in paperIds}
 
-    @dedup_paper
-    def __getColorYear(self, paperId=None, lightness=0.4):
-        #author, year, ncit, title = self.__getNodeInfo(paperId)
-        ni = self.__getNodeInfo(paperId=paperId)
-        year = ni["year"]
-        try:
-            nextcolor = matplotlib.colors.rgb2hex(self.color[self.coloring].to_rgba(int(year),alpha=lightness))
-        except Exception as e:
-            logging.error("Error %s" % e)
-            nextcolor = "#ffffff"
-        #logging.info("Color %s" % nextcolor)
-        return nextcolor
-
-    @dedup_paper
-    def __getColorNcit(self, paperId=None, lightness=0.4):
-        #author, year, ncit, title = self.__getNodeInfo(paperId)
-        ni = self.__getNodeInfo(paperId=paperId)
-        ncit = ni["ncit"]
-        try:
-            nextcolor = matplotlib.colors.rgb2hex(self.color[self.coloring].to_rgba(int(ncit),alpha=lightness))
-        except Exception as e:
-            logging.error("Error %s" % e)
-            nextcolor = "#ffffff"
-        #logging.info("Color %s" % nextcolor)
-        return nextcolor
+    def __forgetNodeColors(self, paperId):
+        with self.color_lock:
+            for _, colors in self.colcolors.values():
+                colors.pop(paperId, None)
 
     @dedup_paper
     def __getNodeColor(self, paperId=None):
         if paperId not in self.nodes.keys():
             logging.error("Error no node for PaperId '%s'" % paperId)
             return
-        #logging.info(self.coloring)
-        if self.coloring == "COLLECTION":
-            return self.__getColorCollection(paperId=paperId)
-        if self.coloring == "AUTHOR":
-            return self.__getColorAuthor(paperId=paperId)
-        if self.coloring == "YEAR":
-            return self.__getColorYear(paperId=paperId)
-        if self.coloring == "NCIT":
-            return self.__getColorNcit(paperId=paperId)
-        return ZotGraph.COLOR_DEFAULT_N    
-
-    def __dedupRefs(self, node):
+        return self.__getNodeColors([paperId])[paperId]
+
+    def __dedupRefs(self, node, fetch=True):
         if node['smitem'] is None:
             return
         for i, ref in enumerate(node['smitem']['references']):
@@ -841,7 +1069,10 @@ class ZotGraph:
                 logging.debug("Replace duplicate cit for %s: %s -> %s" % (node['smitem']['paperId'], ref['paperId'], PAPER_DEDUPS[ref['paperId']]))
                 node['smitem']['citations'][i]['paperId'] = PAPER_DEDUPS[ref['paperId']]
         if node['smitem']['paperId'] in PAPER_DEDUPS_INV.keys():
-            dedup_node = self.__getNodeNoDedup(PAPER_DEDUPS_INV[node['smitem']['paperId']])
+            dedup_node = self.__getNodeNoDedup(PAPER_DEDUPS_INV[node['smitem']['paperId']], fetch=fetch)
+            if dedup_node is None:
+                logging.warn("Duplicate node of %s not cached, not merged" % node['smitem']['paperId'])
+                return node
             logging.debug("Merge %d citations and %d references for duplicate node %s / %s" % \
                 (len(dedup_node['smitem']['citations']), len(dedup_node['smitem']['references']), 
                 node['smitem']['paperId'], dedup_node['smitem']['paperId']))
@@ -866,75 +1097,361 @@ class ZotGraph:
         new_edges = []
         if paperId not in self.nodes.keys():
             return
-        node = self.nodes[paperId]
-        if node['smitem'] is None:
+        core = self.nodes.core(paperId)
+        if not core.has_smitem:
             return
-        for ref in node['smitem']['references']:
-            if self.g.has_node(ref['paperId']) and not self.g.has_edge(paperId, ref['paperId']):
-                #logging.info("Add reference edge from '%s' -> '%s' " % (self.__getPaperName(paperId), self.__getPaperName(ref['paperId'])))
-                redge = self.__addEdge(from_node=paperId, to_node=ref['paperId'], isInfluential=ref['isInfluential'])
+        for refId, isInfluential in core.references():
+            if self.g.has_node(refId) and not self.g.has_edge(paperId, refId):
+                #logging.info("Add reference edge from '%s' -> '%s' " % (self.__getPaperName(paperId), self.__getPaperName(refId)))
+                redge = self.__addEdge(from_node=paperId, to_node=refId, isInfluential=isInfluential)
                 if redge is not None:
                     new_edges.append(redge)
                 
-        for ref in node['smitem']['citations']:
-            if self.g.has_node(ref['paperId']) and not self.g.has_edge(ref['paperId'], paperId):
-                #logging.info("Add citation edge from '%s' <- '%s' " % (self.__getPaperName(paperId), self.__getPaperName(ref['paperId'])))
-                redge = self.__addEdge(from_node=ref['paperId'], to_node=paperId, isInfluential=ref['isInfluential'])
+        for refId, isInfluential in core.citations():
+            if self.g.has_node(refId) and not self.g.has_edge(refId, paperId):
+                #logging.info("Add citation edge from '%s' <- '%s' " % (self.__getPaperName(paperId), self.__getPaperName(refId)))
+                redge = self.__addEdge(from_node=refId, to_node=paperId, isInfluential=isInfluential)
                 if redge is not None:
                     new_edges.append(redge)
         #self.lock.release()
         return new_edges
     
     def refreshAllLinks(self):
-        self.lock.acquire()
-        for paperId in self.g.nodes:
-            self.__refreshLinks(paperId=paperId)
-        self.lock.release()
+        with self.lock.write():
+            for paperId in self.g.nodes:
+                self.__refreshLinks(paperId=paperId)
 
     @dedup_paper        
-    def addLinks(self, paperId=None, influential=False, onlyRef=False, onlyCit=False):
-        self.lock.acquire()
+    def addLinks(self, paperId=None, influential=False, onlyRef=False, onlyCit=False, job=None):
         new_nodes = []
         new_edges = []
         new_paperinfo = []
         logging.debug("Add links for PaperId '%s'" % paperId)
-        if paperId in self.filterIds:
-            logging.debug("PaperId '%s' is filtered" % paperId)
-            self.lock.release()
-            return new_nodes, new_edges, new_paperinfo
-        if paperId not in self.nodes.keys():
-            logging.error("Error no node for PaperId '%s'" % paperId)
-            self.lock.release()
-            return new_nodes, new_edges, new_paperinfo
-        node = self.nodes[paperId]
-
-        if node['smitem'] is not None:
-            if not onlyCit and not node['r_processed']:
-                for ref in node['smitem']['references']:
-                    if not influential or ref['isInfluential']:
-                        ref_nodes, ref_edges, ref_paperinfo = \
-                            self.__addNode(ref['doi'], ref['title'], paperId=ref['paperId'], pnode=paperId, isRef=True, isInfluential=ref['isInfluential'])
-                        for rnode in ref_nodes:
-                            new_nodes.append(rnode)
-                        for redge in ref_edges:
-                            new_edges.append(redge)
-                        for rpi in ref_paperinfo:
-                            new_paperinfo.append(rpi)
-            if not onlyRef and not node['c_processed']:
-                for ref in node['smitem']['citations']:
-                    if not influential or ref['isInfluential']:
-                        ref_nodes, ref_edges, ref_paperinfo = \
-                            self.__addNode(ref['doi'], ref['title'], paperId=ref['paperId'], pnode=paperId, isRef=False, isInfluential=ref['isInfluential'])
-                        for rnode in ref_nodes:
-                            new_nodes.append(rnode)
-                        for redge in ref_edges:
-                            new_edges.append(redge)
-                        for rpi in ref_paperinfo:
-                            new_paperinfo.append(rpi)
+        links = []
+        with self.lock.read():
+            node = self.nodes[paperId] if paperId in self.nodes.keys() else None
+        if node is not None and node['smitem'] is not None and node['smitem'].get('influentialUnknown'):
+            self.__completeInfluence(paperId, node)
+        with self.lock.read():
+            if paperId in self.filterIds:
+                logging.debug("PaperId '%s' is filtered" % paperId)
+                return new_nodes, new_edges, new_paperinfo
+            if paperId not in self.nodes.keys():
+                logging.error("Error no node for PaperId '%s'" % paperId)
+                return new_nodes, new_edges, new_paperinfo
+            node = self.nodes[paperId]
+
+            if node['smitem'] is not None:
+                if not onlyCit and not node['r_processed']:
+                    for ref in node['smitem']['references']:
+                        if not influential or ref['isInfluential']:
+                            links.append((ref, True))
+                if not onlyRef and not node['c_processed']:
+                    for ref in node['smitem']['citations']:
+                        if not influential or ref['isInfluential']:
+                            links.append((ref, False))
+
+        for ref, isRef, ref_node in self.__fetchLinks(links):
+            if job is not None and job.isCancelled():
+                logging.info("Add links for PaperId '%s' cancelled" % paperId)
+                break
+            with self.lock.write():
+                ref_nodes, ref_edges, ref_paperinfo = \
+                    self.__addNode(ref['doi'], ref['title'], paperId=ref['paperId'], pnode=paperId, isRef=isRef, isInfluential=ref['isInfluential'], node=ref_node)
+            if job is not None and (len(ref_nodes) > 0 or len(ref_edges) > 0):
+                job.emit({
+                    'new_nodes': ref_nodes,
+                    'new_edges': ref_edges,
+                    'new_paperinfo': ref_paperinfo,
+                })
+            for rnode in ref_nodes:
+                new_nodes.append(rnode)
+            for redge in ref_edges:
+                new_edges.append(redge)
+            for rpi in ref_paperinfo:
+                new_paperinfo.append(rpi)
         #node['processed'] = True
-        self.lock.release()
         return new_nodes, new_edges, new_paperinfo
 
+    def __applyInfluence(smitem, influential):
+        # influential: (reference ids, citation ids), raw and deduplicated
+        for link, ids in zip(['references', 'citations'], influential):
+            for ref in smitem[link]:
+                ref['isInfluential'] = ref['paperId'] in ids
+        smitem.pop('influentialUnknown', None)
+
+    def __completeInfluence(self, paperId, node):
+        # nodes fetched through paper/batch have no isInfluential for their
+        # links, get them from the v1 lookup before the node is expanded
+        smitem = self.sm.paper(node['smitem']['paperId'])
+        if not smitem:
+            logging.error("Failed to get influential links of '%s' from semanticscholar" % paperId)
+            return
+        influential = []
+        for link in ['references', 'citations']:
+            ids = set()
+            for ref in smitem.get(link, []):
+                if ref.get('isInfluential') and ref['paperId'] is not None:
+                    ids.add(ref['paperId'])
+                    ids.add(PAPER_DEDUPS.get(ref['paperId'], ref['paperId']))
+            influential.append(ids)
+        # the cache holds the node before __dedupRefs
+        cached = self.ncache.get(paperId)
+        if cached is not None and cached['smitem'] is not None:
+            ZotGraph.__applyInfluence(cached['smitem'], influential)
+            self.__storeCacheNode(paperId=paperId, node=cached, force=True)
+        node = dict(node)
+        node['smitem'] = dict(node['smitem'])
+        for link in ['references', 'citations']:
+            node['smitem'][link] = [dict(ref) for ref in node['smitem'][link]]
+        ZotGraph.__applyInfluence(node['smitem'], influential)
+        with self.lock.write():
+            if paperId not in self.nodes.keys():
+                return
+            self.__setNode(paperId, node)
+            core = self.nodes.core(paperId)
+            for refId, isInfluential in core.references():
+                if isInfluential:
+                    self.__restyleEdge(paperId, refId, isInfluential)
+            for citId, isInfluential in core.citations():
+                if isInfluential:
+                    self.__restyleEdge(citId, paperId, isInfluential)
+
+    def __restyleEdge(self, from_node, to_node, isInfluential):
+        # must hold the write lock
+        if not self.g.has_edge(from_node, to_node):
+            from_node, to_node = to_node, from_node
+            if not self.g.has_edge(from_node, to_node):
+                return
+        edgeColor, weight = ZotGraph.__edgeStyle(isInfluential)
+        if self.g.edges[from_node, to_node].get("weight") == weight:
+            return
+        self.g.add_edge(from_node, to_node, color=edgeColor, weight=weight)
+        self.journal.addEdge(from_node, to_node, color=edgeColor, weight=weight)
+        self.changes.record(ChangeLog.EDGE, (from_node, to_node))
+
+    def __fetchNodes(self, paperIds, force=False):
+        # yields (paperId, node) without holding the graph lock. Papers that
+        # are already part of the project come first with node None, cached
+        # nodes next, the rest is fetched in batches and built as it arrives
+        with self.lock.read():
+            known = set(self.nodes.keys()) | self.filterIds
+        pending = []
+        for paperId in paperIds:
+            if paperId is None:
+                continue
+            if not force and paperId in known:
+                yield paperId, None
+                continue
+            if paperId not in pending:
+                pending.append(paperId)
+        if len(pending) == 0:
+            return
+        if not force:
+            cached = self.__loadCacheNodes(pending)
+            for paperId, node in cached.items():
+                yield paperId, self.__fetchNode(paperId=paperId, node=node)
+            pending = [paperId for paperId in pending if paperId not in cached.keys()]
+        if len(pending) == 0:
+            return
+        logging.info("Fetching %d papers from Semantic Scholar" % len(pending))
+        # start the PDF extractions of the next papers while building one
+        window = []
+        # a rescan replaces the cached nodes, use the v1 lookup so they keep
+        # their influential flags, paper/batch does not have them
+        for paperId, smitem in self.sm.fetchPapers(pending, batch=not force):
+            if not smitem:
+                logging.error("Failed to get paper '%s' from semanticscholar" % paperId)
+                continue
+            self.__prefetchRefs(smitem)
+            window.append((paperId, smitem))
+            if len(window) < self.prefetch_refs:
+                continue
+            paperId, smitem = window.pop(0)
+            node = self.__buildFetchedNode(paperId, smitem, force=force)
+            if node is not None:
+                yield paperId, node
+        for paperId, smitem in window:
+            node = self.__buildFetchedNode(paperId, smitem, force=force)
+            if node is not None:
+                yield paperId, node
+
+    def __buildFetchedNode(self, paperId, smitem, force=False):
+        try:
+            if force:
+                # replaces the cached node only once the new one is built, until
+                # then evicted nodes are still paged in from the old one
+                node = self.__makeNewNode(paperId=paperId, smitem=smitem, force=True)
+                self.__resolveCollections(node)
+                return self.__dedupRefs(node)
+            return self.__fetchNode(paperId=paperId, smitem=smitem)
+        except Exception as e:
+            logging.error("Failed to make node for '%s': %s" % (paperId, e))
+            return None
+
+    def __prefetchRefs(self, smitem):
+        # resolve the Zotero item from the csv index like findItem does
+        # and start extracting its PDF before __makeNewNode needs it
+        keys = []
+        if ZotApi.isValidDOI(smitem.get('doi')):
+            keys = self.za.getItemIdByDOI(smitem['doi'])
+        if len(keys) != 1 and smitem.get('title') is not None:
+            keys = self.za.getItemIdByTitle(smitem['title'])
+        if len(keys) != 1:
+            return
+        try:
+            pdfpath = self.za.getPdfPath(keys[0])
+        except Exception as e:
+            logging.warn("Could not get pdf path for key '%s': %s" % (keys[0], e))
+            return
+        if pdfpath:
+            self.re.prefetch(pdfpath, smitem['paperId'])
+
+    def __fetchLinks(self, links):
+        # yields (ref, isRef, node) for the links of a node
+        by_paperId = {}
+        for ref, isRef in links:
+            if ref['paperId'] is None:
+                continue
+            paperId = PAPER_DEDUPS.get(ref['paperId'], ref['paperId'])
+            if paperId not in by_paperId.keys():
+                by_paperId[paperId] = []
+            by_paperId[paperId].append((ref, isRef))
+        for paperId, node in self.__fetchNodes(list(by_paperId.keys())):
+            for ref, isRef in by_paperId[paperId]:
+                yield ref, isRef, node
+
+    def hasCrawlCheckpoint(self):
+        return os.path.exists(self.crawl_path)
+
+    def __saveCrawl(self, state):
+        tmp_path = self.crawl_path + ".tmp"
+        with open(tmp_path, "w") as fd:
+            fd.write(json.dumps(state))
+        os.replace(tmp_path, self.crawl_path)
+
+    def __pushCrawlLinks(self, state, paperId, dist):
+        # queue the neighbours of paperId at dist + 1, cheap filters first
+        if dist >= state['max_dist']:
+            return
+        with self.lock.read():
+            if paperId not in self.nodes.keys() or self.nodes[paperId]['smitem'] is None:
+                return
+            smitem = self.nodes[paperId]['smitem']
+            links = [(ref, True) for ref in smitem['references']] + \
+                [(ref, False) for ref in smitem['citations']]
+        for ref, isRef in links:
+            refId = ref['paperId']
+            if refId is None:
+                continue
+            refId = PAPER_DEDUPS.get(refId, refId)
+            if refId in state['seen'] or refId in self.filterIds:
+                continue
+            try:
+                if int(ref['year']) < self.min_year:
+                    continue
+            except:
+                pass
+            # batch fetched links carry citationCount, v1 links do not
+            try:
+                if int(ref['citationCount']) > self.max_cit:
+                    continue
+            except:
+                pass
+            state['seen'].add(refId)
+            # nearest first, influential links first within a hop
+            heapq.heappush(state['frontier'], [
+                dist + 1, 0 if ref.get('isInfluential') else 1, state['seq'],
+                refId, paperId, isRef, bool(ref.get('isInfluential'))])
+            state['seq'] += 1
+
+    def crawl(self, seeds=None, max_dist=None, max_nodes=None, job=None):
+        """Prioritized BFS from seeds (default: all graph nodes) up to max_dist
+        hops (default: the project's dist filter). Resumes from the crawl
+        checkpoint when no seeds are given."""
+        if seeds is None and self.hasCrawlCheckpoint():
+            with open(self.crawl_path, "r") as fd:
+                state = json.loads(fd.read())
+            state['seen'] = set(state['seen'])
+            state.setdefault('failed', {})
+            heapq.heapify(state['frontier'])
+            if max_nodes is None:
+                max_nodes = state.get('max_nodes')
+            logging.info("Resuming crawl: %d queued, %d seen, %d added" % (len(state['frontier']), len(state['seen']), state['added']))
+        else:
+            if seeds is None:
+                with self.lock.read():
+                    seeds = list(self.g.nodes)
+            seeds = [PAPER_DEDUPS.get(seed, seed) for seed in seeds]
+            state = {
+                'max_dist': self.max_dist if max_dist is None else max_dist,
+                'frontier': [],
+                'seen': set(seeds),
+                'seq': 0,
+                'added': 0,
+                # paperId -> failed fetches
+                'failed': {},
+            }
+            for seed in seeds:
+                self.__pushCrawlLinks(state, seed, 0)
+            logging.info("Crawl from %d seeds up to %d hops: %d queued" % (len(seeds), state['max_dist'], len(state['frontier'])))
+
+        while len(state['frontier']) > 0:
+            if job is not None and job.isCancelled():
+                logging.info("Crawl cancelled, %d queued" % len(state['frontier']))
+                break
+            if max_nodes is not None and state['added'] >= max_nodes:
+                logging.info("Crawl reached %d nodes" % max_nodes)
+                break
+            batch = {}
+            while len(state['frontier']) > 0 and len(batch) < ZotGraph.CRAWL_BATCH:
+                entry = heapq.heappop(state['frontier'])
+                batch[entry[3]] = entry
+            new_nodes = []
+            new_edges = []
+            for paperId, node in self.__fetchNodes(list(batch.keys())):
+                dist, _, _, _, pnode, isRef, isInfluential = batch.pop(paperId)
+                state['failed'].pop(paperId, None)
+                with self.lock.write():
+                    nn, ne, _ = self.__addNode('', '', paperId=paperId, pnode=pnode, isRef=isRef, isInfluential=isInfluential, node=node)
+                new_nodes.extend(nn)
+                new_edges.extend(ne)
+                state['added'] += len(nn)
+                self.__pushCrawlLinks(state, paperId, dist)
+            # __fetchNodes skips papers it failed to get, retry them last within their hop
+            for paperId, entry in batch.items():
+                state['failed'][paperId] = state['failed'].get(paperId, 0) + 1
+                if state['failed'][paperId] > ZotGraph.CRAWL_RETRIES:
+                    logging.error("Crawl: giving up on '%s' after %d failed fetches" % (paperId, state['failed'][paperId]))
+                    continue
+                entry[1] = 2
+                entry[2] = state['seq']
+                state['seq'] += 1
+                heapq.heappush(state['frontier'], entry)
+            if job is not None and (len(new_nodes) > 0 or len(new_edges) > 0):
+                job.emit({
+                    'new_nodes': new_nodes,
+                    'new_edges': new_edges,
+                    'new_paperinfo': [],
+                })
+            self.saveGraph()
+            # only left behind if the crawl is interrupted, e.g. by a restart
+            self.__saveCrawl({
+                'max_dist': state['max_dist'],
+                'max_nodes': max_nodes,
+                'frontier': state['frontier'],
+                'seen': list(state['seen']),
+                'seq': state['seq'],
+                'added': state['added'],
+                'failed': state['failed'],
+            })
+            logging.info("Crawl: %d added, %d queued, %d failed" % (state['added'], len(state['frontier']), len(state['failed'])))
+
+        # finished, cancelled or at max_nodes: nothing to resume
+        if self.hasCrawlCheckpoint():
+            os.remove(self.crawl_path)
+        return state['added']
+
     @dedup_paper
     def __filterSMItem(self, paperId=None):
         try:
@@ -965,63 +1482,82 @@ class ZotGraph:
     @dedup_paper
     def addPaperId(self, paperId=None):
         logging.debug("Add paperId '%s'" % (paperId))
-        self.lock.acquire()
-        ret = self.__addNode('', '', paperId=paperId)
-        self.lock.release()
-        return ret
+        new_nodes = []
+        new_edges = []
+        new_paperInfo = []
+        for paperId, node in self.__fetchNodes([paperId]):
+            with self.lock.write():
+                nn, ne, np = self.__addNode('', '', paperId=paperId, node=node)
+            new_nodes.extend(nn)
+            new_edges.extend(ne)
+            new_paperInfo.extend(np)
+        return new_nodes, new_edges, new_paperInfo
     
     def addCollectionId(self, colname):
         logging.debug("Add collection '%s'" % (colname))
         new_nodes = []
         new_edges = []
         new_paperInfo = []
-        self.lock.acquire()
         skeys = self.za.getCollectionItemsByName(colname)
         logging.info("Got keys for collection %s: %s" % (colname, ", ".join(skeys)))
-        for skey in skeys:
-            nn, ne, np = self.__addNode("", "", paperId=skey)
+        skeys = [PAPER_DEDUPS.get(skey, skey) for skey in skeys]
+        for skey, node in self.__fetchNodes(skeys):
+            with self.lock.write():
+                nn, ne, np = self.__addNode("", "", paperId=skey, node=node)
             new_nodes.extend(nn)
             new_edges.extend(ne)
             new_paperInfo.extend(np)
-        self.lock.release()
         return new_nodes, new_edges, new_paperInfo
 
+    def __reloadCsv(self):
+        self.za.reloadCsv()
+        with self.lock.write():
+            self.__clearMentions()
+            self.annot_cache.clear()
+
+    def __rescanNode(self, paperId, node):
+        # must hold the write lock
+        if paperId not in self.nodes.keys():
+            return None
+        self.__trackNode(node)
+        self.__setNode(paperId, node)
+        if self.g.has_node(paperId):
+            self.node_colors[paperId] = self.__getNodeColor(paperId=paperId)
+            self.changes.record(ChangeLog.NODE, paperId)
+            self.__recordLayoutChanges()
+        return self.__getJsNode(paperId=paperId)
+
     @dedup_paper
     def rescan_all(self):
-        self.lock.acquire()
         logging.debug("Rescan All PaperIds")
-        self.za.reloadCsv()
+        self.__reloadCsv()
         new_nodes = []
         new_edges = []
         new_paperinfo = []
-        for paperId in self.g.nodes:
+        with self.lock.read():
+            paperIds = list(self.g.nodes)
+        for paperId, node in self.__fetchNodes(paperIds, force=True):
             logging.debug("Rescan PaperId %s" % paperId)
-            self.__clearCacheNode(paperId=paperId)
-            node = self.__getNode(paperId=paperId)
-            new_nodes.append(self.__getJsNode(paperId=paperId))
-            new_paperinfo.append({
-                'id': paperId,
-                'html': self.__getPaperInfo(paperId=paperId),
-            })
-        self.lock.release()
+            with self.lock.write():
+                jsnode = self.__rescanNode(paperId, node)
+            if jsnode is not None:
+                new_nodes.append(jsnode)
         return new_nodes, new_edges, new_paperinfo
 
     @dedup_paper
     def rescan(self, paperId=None):
-        self.lock.acquire()
         logging.debug("Rescan PaperId %s" % paperId)
-        self.za.reloadCsv()
-        self.__clearCacheNode(paperId=paperId)
+        self.__reloadCsv()
         new_nodes = []
         new_edges = []
         new_paperinfo = []
-        node = self.__getNode(paperId=paperId)
-        new_nodes.append(self.__getJsNode(paperId=paperId))
-        new_paperinfo.append({
-            'id': paperId,
-            'html': self.__getPaperInfo(paperId=paperId),
-        })
-        self.lock.release()
+        # the cached node is only replaced once the paper was fetched again,
+        # evicted nodes are paged in from it
+        for paperId, node in self.__fetchNodes([paperId], force=True):
+            with self.lock.write():
+                jsnode = self.__rescanNode(paperId, node)
+            if jsnode is not None:
+                new_nodes.append(jsnode)
         return new_nodes, new_edges, new_paperinfo
 
     @dedup_paper
@@ -1035,14 +1571,19 @@ class ZotGraph:
         self.__updateYearSpanRemove(self.nodes[paperId])
         if self.g.has_node(paperId):
             self.g.remove_node(paperId)
+            self.journal.removeNode(paperId)
+            self.membership_version += 1
+            self.node_colors.pop(paperId, None)
+            self.changes.record(ChangeLog.NODE_REMOVED, paperId)
+            self.__recordLayoutChanges()
+            self.__reindexMentionsOf(paperId)
         if paperId in self.nodes.keys():
-            del self.nodes[paperId]
+            self.__delNode(paperId)
 
     @dedup_paper
     def removePaperId(self, paperId=None):
-        self.lock.acquire()
-        self.__removePaperId(paperId=paperId)
-        self.lock.release()
+        with self.lock.write():
+            self.__removePaperId(paperId=paperId)
 
     def __addEdge(self, from_node=None, to_node=None, isInfluential=False, edgeColor=COLOR_INZOT):
         if from_node == to_node:
@@ -1066,21 +1607,19 @@ class ZotGraph:
         year_from = None
         year_to = None
         try:
-            year_from = int(ni_from["year"])
+            year_from = int(ni_from.year)
         except Exception as e:
-            logging.error("No year for from '%s'" % ni_from['title'])
+            logging.error("No year for from '%s'" % ni_from.title)
         try:
-            year_to = int(ni_to["year"])
+            year_to = int(ni_to.year)
         except Exception as e:
-            logging.error("No year for to '%s'" % ni_to['title'])
+            logging.error("No year for to '%s'" % ni_to.title)
         if year_from is not None and year_to is not None and year_from < year_to:
-            logging.error("Corrupted edge %d -> %d, '%s' -> '%s'" % (year_from, year_to, ni_from['title'], ni_to['title']))
-        weight = 1
-        edgeColor = '#bdc9c4'
-        if isInfluential:
-            weight = 6
-            edgeColor = '#2e5361'
+            logging.error("Corrupted edge %d -> %d, '%s' -> '%s'" % (year_from, year_to, ni_from.title, ni_to.title))
+        edgeColor, weight = ZotGraph.__edgeStyle(isInfluential)
         self.g.add_edge(from_node, to_node, color=edgeColor, weight=weight)
+        self.journal.addEdge(from_node, to_node, color=edgeColor, weight=weight)
+        self.changes.record(ChangeLog.EDGE, (from_node, to_node))
         return {
             "from": from_node,
             "to": to_node,
@@ -1089,7 +1628,7 @@ class ZotGraph:
         }
 
     @dedup_paper
-    def __addNode(self, doi, title, paperId=None, pnode=None, isRef=False, isInfluential=False, edgeColor=COLOR_INZOT):
+    def __addNode(self, doi, title, paperId=None, pnode=None, isRef=False, isInfluential=False, edgeColor=COLOR_INZOT, node=None):
         new_nodes = []
         new_edges = []
         new_paperinfo = []
@@ -1110,23 +1649,29 @@ class ZotGraph:
                         new_edges.append(redge)
             return new_nodes, new_edges, new_paperinfo
 
-        node = self.__getNode(paperId=paperId)
-        self.nodes[paperId] = node
+        if node is None:
+            node = self.__fetchNode(paperId=paperId)
+        self.__setNode(paperId, node)
 
         if self.__filterSMItem(paperId=paperId):
             logging.debug("add filter '%s' / '%s' / '%s'" % (doi, title, paperId))
             self.__removePaperId(paperId=paperId)
             return new_nodes, new_edges, new_paperinfo
+        # filtered nodes must not widen the year and citation ranges
+        self.__trackNode(node)
     
         label = self.__getPaperName(paperId=paperId)
         color = self.__getNodeColor(paperId=paperId)
         logging.info("Add node '%s' / '%s'" % (paperId, label))
         self.g.add_node(paperId, label=label, shape='box', color=color)
+        self.journal.addNode(paperId, label=label, shape='box', color=color)
+        self.membership_version += 1
+        self.node_colors[paperId] = color
+        self.changes.record(ChangeLog.NODE, paperId)
+        self.__recordLayoutChanges()
+        self.__indexNodeMentions(paperId)
+        self.__reindexMentionsOf(paperId)
         new_nodes.append(self.__getJsNode(paperId=paperId))
-        new_paperinfo.append({
-            'id': paperId,
-            'html': self.__getPaperInfo(paperId=paperId),
-        })
         if pnode:
             if isRef:
                 redge = self.__addEdge(from_node=pnode, to_node=paperId, isInfluential=isInfluential, edgeColor=edgeColor)
@@ -0,0 +1,240 @@
+import atexit
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+
+
+class ZoteroSqlite:
+    """Answers the pyzotero calls ZotApi makes from the local zotero.sqlite
+
+    Zotero keeps its database locked while it runs, so a snapshot copy is
+    opened read-only; refresh() takes a new one. Items and collections are
+    returned in the shape of the web API (key, data.title, data.DOI,
+    data.collections, data.name, data.parentCollection, ...), lookups go
+    through the unique key indexes of the Zotero schema.
+    """
+
+    # sqlite limits the number of host parameters per statement
+    MAX_VARS = 500
+    # itemAttachments.linkMode
+    LINK_MODE_LINKED_URL = 3
+    ITEM_FIELDS = ['title', 'DOI', 'date', 'url', 'publicationTitle']
+    CHILD_TYPES = ('attachment', 'note', 'annotation')
+
+    def __init__(self, path, library_id=None, library_type="user", storage=None, base_dir=None):
+        self.path = path
+        self.storage = storage if storage else os.path.join(os.path.dirname(path), "storage")
+        # "Linked Attachment Base Directory" of the Zotero preferences
+        self.base_dir = base_dir
+        self.warned_base_dir = False
+        self.library_id = library_id
+        self.library_type = library_type
+        self.tmpdir = tempfile.mkdtemp(prefix="zotsqlite")
+        self.snapshot = None
+        self.generation = 0
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        # the snapshots are full copies of the database
+        atexit.register(self.close)
+        self.refresh()
+
+    def refresh(self):
+        """Copy the database again, e.g. after changes in Zotero"""
+        with self.lock:
+            self.generation += 1
+            snapshot = os.path.join(self.tmpdir, "zotero-%d.sqlite" % self.generation)
+            shutil.copyfile(self.path, snapshot)
+            # changes not checkpointed yet
+            if os.path.exists(self.path + "-wal"):
+                shutil.copyfile(self.path + "-wal", snapshot + "-wal")
+            old = self.snapshot
+            self.snapshot = snapshot
+        if old is not None:
+            for fn in [old, old + "-wal"]:
+                try:
+                    os.remove(fn)
+                except OSError:
+                    pass
+        self.libraryID = self.__libraryID()
+        logging.info("Zotero database snapshot %s (library %d)" % (snapshot, self.libraryID))
+
+    def __conn(self):
+        # one connection per thread, reopened when a newer snapshot exists
+        snapshot = self.snapshot
+        conn = getattr(self.local, "conn", None)
+        if conn is None or self.local.snapshot != snapshot:
+            if conn is not None:
+                conn.close()
+            conn = sqlite3.connect("file:%s?mode=ro" % snapshot, uri=True, check_same_thread=False)
+            self.local.conn = conn
+            self.local.snapshot = snapshot
+        return conn
+
+    def __query(self, sql, args=()):
+        return self.__conn().execute(sql, args).fetchall()
+
+    def __queryIn(self, sql, values, args=()):
+        # sql has one "%s" for the IN list
+        values = list(values)
+        rows = []
+        for i in range(0, len(values), ZoteroSqlite.MAX_VARS):
+            chunk = values[i:i + ZoteroSqlite.MAX_VARS]
+            rows.extend(self.__query(sql % ",".join("?" * len(chunk)), list(args) + chunk))
+        return rows
+
+    def __libraryID(self):
+        if self.library_type == "group":
+            rows = self.__query("SELECT libraryID FROM groups WHERE groupID = ?", (int(self.library_id),))
+        else:
+            rows = self.__query("SELECT libraryID FROM libraries WHERE type = 'user'")
+        if len(rows) == 0:
+            raise ValueError("No %s library %s in %s" % (self.library_type, self.library_id, self.path))
+        return rows[0][0]
+
+    def __fields(self, itemIDs, fields):
+        # itemID -> {field: value}
+        res = {itemID: {} for itemID in itemIDs}
+        rows = self.__queryIn(
+            "SELECT d.itemID, f.fieldName, v.value FROM itemData d "
+            "JOIN fields f ON f.fieldID = d.fieldID "
+            "JOIN itemDataValues v ON v.valueID = d.valueID "
+            "WHERE f.fieldName IN (" + ",".join("?" * len(fields)) + ") AND d.itemID IN (%s)",
+            itemIDs, fields)
+        for itemID, field, value in rows:
+            res[itemID][field] = value
+        return res
+
+    def __itemCollections(self, itemIDs):
+        res = {itemID: [] for itemID in itemIDs}
+        rows = self.__queryIn(
+            "SELECT ci.itemID, c.key FROM collectionItems ci "
+            "JOIN collections c ON c.collectionID = ci.collectionID WHERE ci.itemID IN (%s)",
+            itemIDs)
+        for itemID, ckey in rows:
+            res[itemID].append(ckey)
+        return res
+
+    def __items(self, rows):
+        # rows of (itemID, key, typeName)
+        itemIDs = [row[0] for row in rows]
+        fields = self.__fields(itemIDs, ZoteroSqlite.ITEM_FIELDS)
+        cols = self.__itemCollections(itemIDs)
+        items = []
+        for itemID, key, typeName in rows:
+            data = {
+                "key": key,
+                "itemType": typeName,
+                "collections": cols[itemID],
+            }
+            data.update(fields[itemID])
+            items.append({"key": key, "data": data})
+        return items
+
+    def __topItemRows(self, where, args):
+        return self.__query(
+            "SELECT i.itemID, i.key, t.typeName FROM items i "
+            "JOIN itemTypes t ON t.itemTypeID = i.itemTypeID "
+            "WHERE i.libraryID = ? AND t.typeName NOT IN (?, ?, ?) "
+            "AND i.itemID NOT IN (SELECT itemID FROM deletedItems) AND " + where,
+            [self.libraryID] + list(ZoteroSqlite.CHILD_TYPES) + list(args))
+
+    def top(self, itemKey=None, **kwargs):
+        if itemKey is None:
+            return self.__items(self.__topItemRows("1", []))
+        keys = itemKey.split(",")
+        return self.__items(self.__topItemRows("i.key IN (%s)" % ",".join("?" * len(keys)), keys))
+
+    def __collection(self, row):
+        key, name, parent = row
+        return {
+            "key": key,
+            "data": {
+                "key": key,
+                "name": name,
+                "parentCollection": parent if parent is not None else False,
+            },
+        }
+
+    COLLECTION_SQL = (
+        "SELECT c.key, c.collectionName, p.key FROM collections c "
+        "LEFT JOIN collections p ON p.collectionID = c.parentCollectionID "
+        "WHERE c.libraryID = ? AND c.collectionID NOT IN (SELECT collectionID FROM deletedCollections)")
+
+    def collection(self, key, **kwargs):
+        rows = self.__query(ZoteroSqlite.COLLECTION_SQL + " AND c.key = ?", (self.libraryID, key))
+        if len(rows) == 0:
+            raise KeyError("No Zotero collection %s" % key)
+        return self.__collection(rows[0])
+
+    def collections(self, **kwargs):
+        return [self.__collection(row) for row in self.__query(ZoteroSqlite.COLLECTION_SQL, (self.libraryID,))]
+
+    def collection_items(self, key, **kwargs):
+        return self.__items(self.__topItemRows(
+            "i.itemID IN (SELECT ci.itemID FROM collectionItems ci "
+            "JOIN collections c ON c.collectionID = ci.collectionID WHERE c.libraryID = ? AND c.key = ?)",
+            [self.libraryID, key]))
+
+    def __attachmentPath(self, key, path):
+        # stored files are "storage:<name>" below storage/<attachment key>/,
+        # linked files "attachments:<relative path>" below the base directory
+        if path is None:
+            return None
+        if path.startswith("storage:"):
+            return os.path.join(self.storage, key, path[len("storage:"):])
+        if path.startswith("attachments:"):
+            if not self.base_dir:
+                if not self.warned_base_dir:
+                    logging.warning("Linked attachments relative to the Zotero base directory, set ZOTERO_BASE_DIR")
+                    self.warned_base_dir = True
+                return None
+            return os.path.join(self.base_dir, *path[len("attachments:"):].split("/"))
+        return path
+
+    def indexRows(self):
+        """One row per top level item with the columns of the Zotero CSV export ZotApi indexes"""
+        rows = self.__topItemRows("1", [])
+        itemIDs = [row[0] for row in rows]
+        fields = self.__fields(itemIDs, ['title', 'DOI'])
+        notes = {}
+        for parentID, note in self.__queryIn(
+                "SELECT parentItemID, note FROM itemNotes WHERE parentItemID IN (%s) ORDER BY itemID", itemIDs):
+            notes.setdefault(parentID, []).append(note)
+        files = {}
+        links = {}
+        attachments = self.__queryIn(
+            "SELECT a.parentItemID, a.itemID, i.key, a.linkMode, a.path FROM itemAttachments a "
+            "JOIN items i ON i.itemID = a.itemID "
+            "WHERE a.parentItemID IN (%s) AND a.itemID NOT IN (SELECT itemID FROM deletedItems) ORDER BY a.itemID",
+            itemIDs)
+        urls = self.__fields([a[1] for a in attachments if a[3] == ZoteroSqlite.LINK_MODE_LINKED_URL], ['url'])
+        for parentID, itemID, key, linkMode, path in attachments:
+            if linkMode == ZoteroSqlite.LINK_MODE_LINKED_URL:
+                if 'url' in urls[itemID]:
+                    links.setdefault(parentID, []).append(urls[itemID]['url'])
+                continue
+            path = self.__attachmentPath(key, path)
+            if path is not None:
+                files.setdefault(parentID, []).append(path)
+        res = []
+        for itemID, key, typeName in rows:
+            res.append({
+                'Key': key,
+                'Title': fields[itemID].get('title'),
+                'DOI': fields[itemID].get('DOI'),
+                'Notes': "\n".join(notes[itemID]) if itemID in notes else None,
+                # joined like the CSV export does
+                'File Attachments': "; ".join(files[itemID]) if itemID in files else None,
+                'Link Attachments': "; ".join(links[itemID]) if itemID in links else None,
+            })
+        return res
+
+    def close(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self.local.conn = None
+        shutil.rmtree(self.tmpdir, ignore_errors=True)